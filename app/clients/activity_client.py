@@ -1,10 +1,18 @@
 """
 HTTP client for communicating with the mrnewton-activity component
+
+Responses are validated straight from the raw bytes with pydantic-core
+(model_validate_json), without building intermediate Python dicts.
 """
 import httpx
+import logging
 import os
 from typing import Optional, List
-from app.models.schemas import Submission, Activity, DeploymentInstance
+from app.models.schemas import Submission, SubmissionList, Activity, DeploymentInstance
+from app.logging_config import record_upstream_call
+from app.request_timing import timed
+
+logger = logging.getLogger(__name__)
 
 
 class ActivityClient:
@@ -31,17 +39,18 @@ class ActivityClient:
         
         async with httpx.AsyncClient(timeout=self.timeout) as client:
             try:
-                response = await client.get(url)
+                record_upstream_call("activity_api")
+                with timed("activity_submission"):
+                    response = await client.get(url)
                 
                 if response.status_code == 404:
                     return None
                 
                 response.raise_for_status()
-                data = response.json()
-                return Submission(**data)
+                return Submission.model_validate_json(response.content)
             
             except httpx.HTTPError as e:
-                print(f"HTTP error occurred while fetching submission: {e}")
+                logger.warning("HTTP error occurred while fetching submission", extra={"fields": {"url": url, "error": str(e)}})
                 raise
     
     async def get_activity(self, activity_id: str) -> Optional[Activity]:
@@ -52,17 +61,18 @@ class ActivityClient:
         
         async with httpx.AsyncClient(timeout=self.timeout) as client:
             try:
-                response = await client.get(url)
+                record_upstream_call("activity_api")
+                with timed("activity_config"):
+                    response = await client.get(url)
                 
                 if response.status_code == 404:
                     return None
                 
                 response.raise_for_status()
-                data = response.json()
-                return Activity(**data)
+                return Activity.model_validate_json(response.content)
             
             except httpx.HTTPError as e:
-                print(f"HTTP error occurred while fetching activity: {e}")
+                logger.warning("HTTP error occurred while fetching activity", extra={"fields": {"url": url, "error": str(e)}})
                 raise
     
     async def get_instance(self, instance_id: str) -> Optional[DeploymentInstance]:
@@ -73,17 +83,18 @@ class ActivityClient:
         
         async with httpx.AsyncClient(timeout=self.timeout) as client:
             try:
-                response = await client.get(url)
+                record_upstream_call("activity_api")
+                with timed("activity_instance"):
+                    response = await client.get(url)
                 
                 if response.status_code == 404:
                     return None
                 
                 response.raise_for_status()
-                data = response.json()
-                return DeploymentInstance(**data)
+                return DeploymentInstance.model_validate_json(response.content)
             
             except httpx.HTTPError as e:
-                print(f"HTTP error occurred while fetching instance: {e}")
+                logger.warning("HTTP error occurred while fetching instance", extra={"fields": {"url": url, "error": str(e)}})
                 raise
     
     async def get_instance_submissions(self, instance_id: str) -> List[Submission]:
@@ -94,18 +105,17 @@ class ActivityClient:
         
         async with httpx.AsyncClient(timeout=self.timeout) as client:
             try:
-                response = await client.get(url)
+                record_upstream_call("activity_api")
+                with timed("activity_submissions"):
+                    response = await client.get(url)
                 
                 if response.status_code == 404:
                     return []
                 
                 response.raise_for_status()
-                data = response.json()
-                
                 # Response format: {"count": n, "submissions": [...]}
-                submissions_data = data.get("submissions", [])
-                return [Submission(**sub) for sub in submissions_data]
+                return SubmissionList.model_validate_json(response.content).submissions
             
             except httpx.HTTPError as e:
-                print(f"HTTP error occurred while fetching instance submissions: {e}")
+                logger.warning("HTTP error occurred while fetching instance submissions", extra={"fields": {"url": url, "error": str(e)}})
                 raise
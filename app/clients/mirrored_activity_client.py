@@ -0,0 +1,181 @@
+"""
+Read-through mirror in front of the Activity API
+
+Reads are served from the local mirror while the copy is younger than its
+maximum age; once a copy is past half its maximum age it is refreshed in the
+background, so active data is rarely fetched on the request path. Stale or
+missing copies are fetched from the Activity API and stored, and a stale
+copy is served when the Activity API fails.
+
+Submissions of an instance fetched after the instance expired are final and
+never fetched again. In offline mode only the mirror is used.
+"""
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import httpx
+import logging
+import os
+from app.clients.activity_client import ActivityClient
+from app.models.schemas import Activity, DeploymentInstance, Submission
+from app.repositories.mirror_repository import ActivityMirrorRepository
+from app.request_timing import timed
+from app.services.precompute_scheduler import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+MIRROR_ENABLED = os.getenv("MIRROR_ENABLED", "true").lower() == "true"
+
+# Serve only mirrored data and never call the Activity API
+MIRROR_OFFLINE = os.getenv("MIRROR_OFFLINE", "false").lower() == "true"
+
+# Maximum age of mirrored instances and activities, and of submissions
+MIRROR_CONFIG_MAX_AGE_SECONDS = float(os.getenv("MIRROR_CONFIG_MAX_AGE_SECONDS", "600"))
+MIRROR_SUBMISSIONS_MAX_AGE_SECONDS = float(os.getenv("MIRROR_SUBMISSIONS_MAX_AGE_SECONDS", "30"))
+
+# Background refreshes in flight, by mirrored key
+_refreshes: Dict[Tuple[str, ...], asyncio.Task] = {}
+
+
+class MirroredActivityClient:
+    """
+    ActivityClient interface reading through the local mirror
+    """
+    
+    def __init__(
+        self,
+        upstream: ActivityClient,
+        mirror: ActivityMirrorRepository,
+        offline: bool = MIRROR_OFFLINE,
+        config_max_age_seconds: float = MIRROR_CONFIG_MAX_AGE_SECONDS,
+        submissions_max_age_seconds: float = MIRROR_SUBMISSIONS_MAX_AGE_SECONDS
+    ):
+        self.upstream = upstream
+        self.mirror = mirror
+        self.offline = offline
+        self.config_max_age_seconds = config_max_age_seconds
+        self.submissions_max_age_seconds = submissions_max_age_seconds
+    
+    async def get_submission(self, instance_id: str, student_id: str) -> Optional[Submission]:
+        with timed("mirror"):
+            cached = await self.mirror.find_submission(instance_id, student_id)
+            if cached is not None and self._age(cached[1]) >= self.submissions_max_age_seconds / 2:
+                # Rows left unchanged by a full fetch are confirmed by its time
+                list_fetched_at = await self.mirror.find_submissions_fetched_at(instance_id)
+                if list_fetched_at is not None and list_fetched_at > cached[1]:
+                    cached = (cached[0], list_fetched_at)
+        
+        async def fetch():
+            submission = await self.upstream.get_submission(instance_id, student_id)
+            if submission is not None:
+                await self.mirror.save_submission(submission)
+            return submission
+        
+        return await self._read_through(
+            ("submission", instance_id, student_id), cached, fetch, self.submissions_max_age_seconds
+        )
+    
+    async def get_activity(self, activity_id: str) -> Optional[Activity]:
+        with timed("mirror"):
+            cached = await self.mirror.find_activity(activity_id)
+        
+        async def fetch():
+            activity = await self.upstream.get_activity(activity_id)
+            if activity is not None:
+                await self.mirror.save_activity(activity)
+            return activity
+        
+        return await self._read_through(("activity", activity_id), cached, fetch, self.config_max_age_seconds)
+    
+    async def get_instance(self, instance_id: str) -> Optional[DeploymentInstance]:
+        with timed("mirror"):
+            cached = await self.mirror.find_instance(instance_id)
+        
+        async def fetch():
+            instance = await self.upstream.get_instance(instance_id)
+            if instance is not None:
+                await self.mirror.save_instance(instance)
+            return instance
+        
+        return await self._read_through(("instance", instance_id), cached, fetch, self.config_max_age_seconds)
+    
+    async def get_instance_submissions(self, instance_id: str) -> List[Submission]:
+        with timed("mirror"):
+            cached = await self.mirror.find_instance_submissions(instance_id)
+            final = cached is not None and await self._submissions_final(instance_id, cached[1])
+        
+        async def fetch():
+            submissions = await self.upstream.get_instance_submissions(instance_id)
+            await self.mirror.save_instance_submissions(instance_id, submissions)
+            return submissions
+        
+        submissions = await self._read_through(
+            ("submissions", instance_id), cached, fetch, self.submissions_max_age_seconds, final
+        )
+        return submissions if submissions is not None else []
+    
+    async def _submissions_final(self, instance_id: str, fetched_at: datetime) -> bool:
+        """
+        Whether the mirrored list was fetched after the instance stopped accepting submissions
+        """
+        instance = await self.mirror.find_instance(instance_id)
+        if instance is None:
+            return False
+        expires_at = parse_timestamp(instance[0].expiresAt)
+        if expires_at is None:
+            return False
+        return fetched_at.replace(tzinfo=timezone.utc) >= expires_at
+    
+    async def _read_through(
+        self,
+        key: Tuple[str, ...],
+        cached: Optional[Tuple[Any, datetime]],
+        fetch: Callable[[], Awaitable[Any]],
+        max_age_seconds: float,
+        final: bool = False
+    ) -> Any:
+        if cached is not None:
+            value, fetched_at = cached
+            age = self._age(fetched_at)
+            if self.offline or final or age < max_age_seconds:
+                if not self.offline and not final and age >= max_age_seconds / 2:
+                    self._refresh_later(key, fetch)
+                return value
+        
+        if self.offline:
+            return None
+        
+        try:
+            return await fetch()
+        except httpx.HTTPError as e:
+            if cached is None:
+                raise
+            logger.warning("Activity API unavailable, serving mirrored copy", extra={"fields": {
+                "key": "/".join(key),
+                "error": str(e)
+            }})
+            return cached[0]
+    
+    @staticmethod
+    def _age(fetched_at: datetime) -> float:
+        return (datetime.utcnow() - fetched_at).total_seconds()
+    
+    def _refresh_later(self, key: Tuple[str, ...], fetch: Callable[[], Awaitable[Any]]):
+        """
+        Refresh a mirrored copy in the background, once per key at a time
+        """
+        if key in _refreshes:
+            return
+        
+        async def refresh():
+            try:
+                await fetch()
+            except Exception as e:
+                logger.warning("Mirror refresh failed", extra={"fields": {
+                    "key": "/".join(key),
+                    "error": str(e)
+                }})
+        
+        task = asyncio.create_task(refresh())
+        _refreshes[key] = task
+        task.add_done_callback(lambda _: _refreshes.pop(key, None))
@@ -3,8 +3,11 @@ MongoDB database configuration and connection management
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from typing import Optional
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # MongoDB connection string and database name
 MONGODB_URI = os.getenv(
     "MONGODB_URI",
@@ -12,6 +15,10 @@ MONGODB_URI = os.getenv(
 )
 DATABASE_NAME = "mrnewton-analytics"
 
+# MONGODB_URI=memory:// swaps Atlas for an in-process mongomock database
+# (load testing and local development; requires mongomock-motor)
+IN_MEMORY_URI_SCHEME = "memory://"
+
 # Global database client
 _client: Optional[AsyncIOMotorClient] = None
 _database: Optional[AsyncIOMotorDatabase] = None
@@ -22,9 +29,18 @@ async def connect_to_mongodb():
     Establish connection to MongoDB
     """
     global _client, _database
-    _client = AsyncIOMotorClient(MONGODB_URI)
+    if MONGODB_URI.startswith(IN_MEMORY_URI_SCHEME):
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise RuntimeError(
+                "MONGODB_URI=memory:// requires mongomock-motor (pip install -r loadtest/requirements.txt)"
+            )
+        _client = AsyncMongoMockClient()
+    else:
+        _client = AsyncIOMotorClient(MONGODB_URI)
     _database = _client[DATABASE_NAME]
-    print(f"Connected to MongoDB database: {DATABASE_NAME}")
+    logger.info("Connected to MongoDB database", extra={"fields": {"database": DATABASE_NAME}})
 
 
 async def close_mongodb_connection():
@@ -34,7 +50,7 @@ async def close_mongodb_connection():
     global _client
     if _client:
         _client.close()
-        print("MongoDB connection closed")
+        logger.info("MongoDB connection closed")
 
 
 def get_database() -> AsyncIOMotorDatabase:
@@ -0,0 +1,186 @@
+"""
+Structured, non-blocking logging
+
+Records are enqueued by a QueueHandler on the event loop and formatted as
+JSON and written by a QueueListener thread, so request handling never waits
+on log I/O. Per-request context (request id, upstream call counts) lives in
+a context variable and is attached to every record before it is enqueued.
+"""
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+import copy
+import json
+import logging
+import os
+import queue
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Fraction of successful (< 400) requests that are logged; errors are always logged
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "1.0"))
+
+# Requests slower than this are always logged regardless of sampling
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+
+
+class RequestContext:
+    """Mutable per-request state shared with the code handling the request"""
+    
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.upstream_calls: Dict[str, int] = {}
+        # Calculated results written to and skipped as unchanged in MongoDB
+        self.result_writes: Dict[str, int] = {}
+        # Stage name -> [total duration in ms, number of occurrences]
+        self.timings: Dict[str, List[float]] = {}
+        self.debug_timing = False
+    
+    def add_timing(self, name: str, duration_ms: float):
+        """
+        Accumulate the duration of a stage; repeated stages are summed
+        """
+        entry = self.timings.setdefault(name, [0.0, 0])
+        entry[0] += duration_ms
+        entry[1] += 1
+
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+def start_request(request_id: str):
+    """
+    Bind a new request context; returns the token to reset it with
+    """
+    return _request_context.set(RequestContext(request_id))
+
+
+def end_request(token):
+    """
+    Restore the context that was active before start_request
+    """
+    _request_context.reset(token)
+
+
+def get_request_context() -> Optional[RequestContext]:
+    """
+    Get the context of the request being handled, if any
+    """
+    return _request_context.get()
+
+
+def record_upstream_call(name: str):
+    """
+    Count a call to an upstream dependency (Activity API, MongoDB) for the current request
+    """
+    context = _request_context.get()
+    if context is not None:
+        context.upstream_calls[name] = context.upstream_calls.get(name, 0) + 1
+
+
+def record_result_writes(written: int, skipped: int):
+    """
+    Count calculated results written and skipped as unchanged for the current request
+    """
+    context = _request_context.get()
+    if context is not None:
+        context.result_writes["written"] = context.result_writes.get("written", 0) + written
+        context.result_writes["skipped"] = context.result_writes.get("skipped", 0) + skipped
+
+
+def should_log_request(status_code: int, duration_ms: float) -> bool:
+    """
+    Sampling decision for the access log
+    """
+    if status_code >= 400 or duration_ms >= LOG_SLOW_REQUEST_MS:
+        return True
+    if LOG_SUCCESS_SAMPLE_RATE >= 1.0:
+        return True
+    return random.random() < LOG_SUCCESS_SAMPLE_RATE
+
+
+class RequestContextFilter(logging.Filter):
+    """Copies the request id onto the record while still on the request's context"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        record.request_id = context.request_id if context else None
+        return True
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Queue handler that defers all formatting to the listener thread
+    
+    The queue is in-process, so records (including their args and
+    exc_info) are passed as they are; the message is interpolated by the
+    formatter on the listener instead of on the event loop. Log calls pass
+    values in `extra` fields rather than mutable format args.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        
+        entry.update(getattr(record, "fields", None) or {})
+        
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """
+    Route the root logger through a queue to a JSON stream handler thread
+    """
+    global _listener
+    if _listener is not None:
+        return
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    
+    # httpx logs every request at INFO; upstream calls are counted per request instead
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flush queued records and stop the listener thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -3,16 +3,55 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from datetime import datetime
 import logging
+import time
+import uuid
 
-from app.routers import analytics
-from app.database.mongodb import connect_to_mongodb, close_mongodb_connection
+from app.routers import analytics, admin
+from app.database.mongodb import connect_to_mongodb, close_mongodb_connection, get_database
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.services.analytics_service import AnalyticsCalculationService
+from app.repositories.archive_repository import AnalyticsArchiveRepository
+from app.repositories.regrade_job_repository import RegradeJobRepository
+from app.repositories.rollup_repository import ActivityRollupRepository
+from app.repositories.item_analysis_repository import ItemAnalysisRepository
+from app.repositories.mirror_repository import ActivityMirrorRepository
+from app.repositories.summary_repository import InstanceSummaryRepository
+from app.repositories.lease_repository import LeaseRepository
+from app.repositories.metrics_cache import (
+    WORKER_ID,
+    start_metrics_cache_invalidation,
+    stop_metrics_cache_invalidation
+)
+from app.services.metrics_events import get_metrics_broker
+from app.services.regrade_service import resume_regrade_jobs, stop_regrade_jobs
+from app.services.retention_service import RetentionService, start_archive_job, stop_archive_job
+from app.services.rollup_service import (
+    RollupReconciliationService,
+    start_rollup_reconciliation,
+    stop_rollup_reconciliation
+)
+from app.services.summary_service import (
+    InstanceSummaryService,
+    start_summary_reconciliation,
+    stop_summary_reconciliation
+)
+from app.services.precompute_scheduler import (
+    start_precompute_scheduler,
+    stop_precompute_scheduler,
+    get_precompute_scheduler
+)
+from app.logging_config import (
+    setup_logging,
+    shutdown_logging,
+    start_request,
+    end_request,
+    get_request_context,
+    should_log_request
+)
+from app.request_timing import SERVER_TIMING_DEBUG_ENABLED, server_timing_header
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%dT%H:%M:%S'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -30,32 +69,152 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "X-Request-ID"],
 )
 
+# Background precompute job for active instances
+async def precompute_instance(instance_id: str):
+    """
+    Recompute all student metrics of an instance for the precompute scheduler
+    """
+    service = AnalyticsCalculationService(
+        analytics.build_activity_client(),
+        AnalyticsMetricsRepository(get_database()),
+        get_precompute_scheduler(),
+        ItemAnalysisRepository(get_database())
+    )
+    await service.calculate_instance_metrics(instance_id, force_recalculate=True)
+
+async def claim_precompute(instance_id: str, lease_seconds: float) -> bool:
+    """
+    Claim an instance's precompute for one interval, so one worker recomputes it
+    """
+    return await LeaseRepository(get_database()).acquire(f"precompute:{instance_id}", WORKER_ID, lease_seconds)
+
+def lease_claim(name: str):
+    """
+    Claim of a worker-wide job for one run, so one worker runs it
+    """
+    async def claim(lease_seconds: float) -> bool:
+        return await LeaseRepository(get_database()).acquire(name, WORKER_ID, lease_seconds)
+    return claim
+
 # Startup event: Connect to MongoDB
 @app.on_event("startup")
 async def startup_event():
+    setup_logging()
     logger.info("Starting up MrNewton Analytics API...")
     await connect_to_mongodb()
     logger.info("MongoDB connected successfully")
+    await AnalyticsMetricsRepository(get_database()).ensure_indexes()
+    await AnalyticsArchiveRepository(get_database()).ensure_indexes()
+    await RegradeJobRepository(get_database()).ensure_indexes()
+    await ActivityRollupRepository(get_database()).ensure_indexes()
+    await ItemAnalysisRepository(get_database()).ensure_indexes()
+    await ActivityMirrorRepository(get_database()).ensure_indexes()
+    await InstanceSummaryRepository(get_database()).ensure_indexes()
+    await LeaseRepository(get_database()).ensure_indexes()
+    logger.info("MongoDB indexes ensured")
+    start_metrics_cache_invalidation(
+        AnalyticsMetricsRepository(get_database()).collection,
+        on_change=get_metrics_broker().publish_document,
+        wants_documents=get_metrics_broker().has_subscribers
+    )
+    start_precompute_scheduler(precompute_instance, claim=claim_precompute)
+    start_archive_job(lambda: RetentionService(
+        AnalyticsMetricsRepository(get_database()),
+        AnalyticsArchiveRepository(get_database())
+    ), claim=lease_claim("retention-archive"))
+    start_summary_reconciliation(
+        lambda: InstanceSummaryService(
+            AnalyticsMetricsRepository(get_database()),
+            InstanceSummaryRepository(get_database())
+        ),
+        claim=lease_claim("summary-reconciliation")
+    )
+    start_rollup_reconciliation(
+        lambda: RollupReconciliationService(
+            AnalyticsMetricsRepository(get_database()),
+            ActivityRollupRepository(get_database())
+        ),
+        claim=lease_claim("rollup-reconciliation")
+    )
+    await resume_regrade_jobs(RegradeJobRepository(get_database()), analytics.build_regrade_service)
 
 # Shutdown event: Close MongoDB connection
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down MrNewton Analytics API...")
+    await stop_precompute_scheduler()
+    await stop_archive_job()
+    await stop_summary_reconciliation()
+    await stop_rollup_reconciliation()
+    await stop_regrade_jobs()
+    await stop_metrics_cache_invalidation()
     await close_mongodb_connection()
     logger.info("MongoDB connection closed")
+    shutdown_logging()
+
+def _route_template(request) -> str:
+    """
+    Path template of the matched route (e.g. /api/v1/analytics/instances/{instance_id}/metrics)
+    
+    Depending on the FastAPI version, routes from included routers may report
+    their path without the router prefix, so the prefix is recovered from the URL.
+    """
+    path = request.url.path
+    route = request.scope.get("route")
+    if route is None or not hasattr(route, "path_regex"):
+        return path
+    
+    for index, char in enumerate(path):
+        if char == "/" and route.path_regex.match(path[index:]):
+            return path[:index] + route.path
+    
+    return route.path
 
 # Request logger middleware
 @app.middleware("http")
 async def log_requests(request, call_next):
-    timestamp = datetime.utcnow().isoformat()
-    logger.info(f"{request.method} {request.url.path}")
-    response = await call_next(request)
-    return response
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = start_request(request_id)
+    start = time.perf_counter()
+    status_code = 500
+    
+    if SERVER_TIMING_DEBUG_ENABLED and request.headers.get("x-debug-timing") == "1":
+        get_request_context().debug_timing = True
+    
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        
+        timing = server_timing_header((time.perf_counter() - start) * 1000)
+        if timing:
+            response.headers["Server-Timing"] = timing
+            response.headers["Timing-Allow-Origin"] = "*"
+        
+        return response
+    
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        if should_log_request(status_code, duration_ms):
+            context = get_request_context()
+            fields = {
+                "method": request.method,
+                "route": _route_template(request),
+                "status": status_code,
+                "duration_ms": round(duration_ms, 2),
+                "upstream_calls": dict(context.upstream_calls)
+            }
+            if context.result_writes:
+                fields["result_writes"] = dict(context.result_writes)
+            logger.info("request", extra={"fields": fields})
+        end_request(token)
 
 # Include routers
 app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["Analytics"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin"])
 
 # Root redirect to API docs
 @app.get("/", include_in_schema=False)
@@ -43,6 +43,92 @@ class AnalyticsMetrics(BaseModel):
     calculated_at: str
 
 
+class CohortRank(BaseModel):
+    """Standing of a student's final score within the results of an instance"""
+    position: int = Field(description="1 for the highest final score; equal scores share a position")
+    cohort_size: int = Field(description="Students with stored results in the instance")
+    percentile_rank: float = Field(description="Percentage of the cohort scoring below, counting equal scores as half")
+
+
+class InstanceSummary(BaseModel):
+    """Aggregate overview of the stored metrics of an instance"""
+    instance_id: str
+    student_count: int = 0
+    pass_count: int = 0
+    pass_rate: float = 0.0
+    mean_final_score: float = 0.0
+    median_final_score: float = 0.0
+    average_total_time_seconds: float = 0.0
+    attempts_histogram: Dict[str, int] = Field(default_factory=dict, description="Number of students per total_attempts value")
+    first_calculated_at: Optional[str] = None
+    last_calculated_at: Optional[str] = None
+
+
+class ActivityRollup(BaseModel):
+    """Aggregate of the latest results of an activity across all its instances"""
+    activity_id: str
+    bucket_start: Optional[str] = Field(default=None, description="First day (YYYY-MM-DD) of the time bucket, None for the whole range")
+    result_count: int = 0
+    instance_count: int = 0
+    pass_count: int = 0
+    pass_rate: float = 0.0
+    mean_final_score: float = 0.0
+    average_total_time_seconds: float = 0.0
+    attempts_histogram: Dict[str, int] = Field(default_factory=dict, description="Number of results per total_attempts value")
+
+
+class ItemAnalysis(BaseModel):
+    """Statistics of one exercise over the latest attempts of an instance"""
+    exercise_index: int
+    question: str
+    correct_option: str
+    responses: int = Field(default=0, description="Students who answered the exercise")
+    difficulty: Optional[float] = Field(default=None, description="Proportion of responses that are correct")
+    discrimination: Optional[float] = Field(default=None, description="Proportion correct in the upper score group minus the lower group")
+    option_distribution: Dict[str, int] = Field(default_factory=dict, description="Number of responses per selected option")
+    rationale_count: int = Field(default=0, description="Responses with a non-empty rationale")
+
+
+class InstanceItemAnalysis(BaseModel):
+    """Item analysis of every exercise of an instance"""
+    instance_id: str
+    activity_id: str
+    student_count: int = 0
+    group_size: int = Field(default=0, description="Students in each of the upper and lower score groups")
+    items: List[ItemAnalysis] = Field(default_factory=list)
+    calculated_at: str
+
+
+class RegradeFailure(BaseModel):
+    """An instance a regrade job could not recompute"""
+    instance_id: str
+    error: str
+
+
+class RegradeJob(BaseModel):
+    """Background recomputation of every result of an activity"""
+    job_id: str
+    activity_id: str
+    status: str = Field(default="pending", description="pending, running, completed, partial (some instances failed), failed or cancelled")
+    activity_hash: Optional[str] = Field(default=None, description="Configuration hash results are regraded to")
+    instance_ids: List[str] = Field(default_factory=list)
+    completed_instances: List[str] = Field(default_factory=list)
+    failed_instances: List[RegradeFailure] = Field(default_factory=list, description="Instances that failed in the last run, retried when the job is resumed")
+    students_recomputed: int = 0
+    students_unchanged: int = 0
+    created_at: str
+    updated_at: str
+    error: Optional[str] = None
+
+
+class RationaleSearchHit(BaseModel):
+    """A ranked match from the answer rationale search"""
+    instance_id: str
+    student_id: str
+    score: float = Field(description="Text relevance score")
+    snippets: List[str] = Field(default_factory=list, description="Rationale excerpts around the matched terms")
+
+
 # Activity component data models (for API communication)
 
 class Answer(BaseModel):
@@ -52,27 +138,28 @@ class Answer(BaseModel):
 
 
 class AttemptResult(BaseModel):
-    """Result of a single attempt"""
-    attemptIndex: int
+    """Result of a single attempt (the unused upstream attemptIndex and result are not declared)"""
     answers: Dict[str, Answer]
-    result: float
     submittedAt: str
     timeSpentSeconds: Optional[int] = None
 
 
 class Submission(BaseModel):
-    """Student submission with multiple attempts"""
+    """Student submission with multiple attempts (the unused upstream number_of_attempts and created_at are not declared)"""
     submissionId: str = Field(alias="submission_id")
     instanceId: str = Field(alias="instance_id")
     studentId: str = Field(alias="student_id")
-    numberOfAttempts: int = Field(alias="number_of_attempts")
     attempts: List[AttemptResult]
-    createdAt: str = Field(alias="created_at")
 
     class Config:
         populate_by_name = True
 
 
+class SubmissionList(BaseModel):
+    """Activity API response listing the submissions of an instance"""
+    submissions: List[Submission] = Field(default_factory=list)
+
+
 class Exercise(BaseModel):
     """Exercise definition"""
     question: str
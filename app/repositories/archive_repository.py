@@ -0,0 +1,58 @@
+"""
+Repository for archived per-instance analytics summaries
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Any, Dict, Optional
+from datetime import datetime
+from app.models.schemas import InstanceSummary
+from app.logging_config import record_upstream_call
+from app.repositories.metrics_repository import collection_stats
+
+
+class AnalyticsArchiveRepository:
+    """Repository for compact summaries of instances removed from the hot collection"""
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["analyticsArchive"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the archive queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index("instance_id", name="instance_id", unique=True)
+    
+    async def save(self, summary: InstanceSummary) -> InstanceSummary:
+        """
+        Save (or replace) the archived summary of an instance
+        """
+        record_upstream_call("mongodb")
+        document = summary.model_dump()
+        document["archived_at"] = datetime.utcnow()
+        
+        await self.collection.update_one(
+            {"instance_id": summary.instance_id},
+            {"$set": document},
+            upsert=True
+        )
+        
+        return summary
+    
+    async def find_by_instance(self, instance_id: str) -> Optional[InstanceSummary]:
+        """
+        Find the archived summary of an instance
+        """
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one({"instance_id": instance_id}, {"_id": 0, "archived_at": 0})
+        
+        if document:
+            return InstanceSummary(**document)
+        
+        return None
+    
+    async def collection_stats(self) -> Dict[str, Any]:
+        """
+        Document count, data size and index footprint of the archive collection
+        """
+        record_upstream_call("mongodb")
+        return await collection_stats(self.collection)
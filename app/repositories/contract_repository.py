@@ -2,8 +2,12 @@
 Repository for analytics contract operations
 """
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import Optional
+from typing import Optional, Tuple
 from app.models.schemas import AnalyticsContract, MetricDefinition
+from app.logging_config import record_upstream_call
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class AnalyticsContractRepository:
@@ -17,13 +21,22 @@ class AnalyticsContractRepository:
         Get the current analytics contract
         Returns the most recent contract
         """
+        current = await self.get_current_with_version()
+        return current[1] if current else None
+    
+    async def get_current_with_version(self) -> Optional[Tuple[str, AnalyticsContract]]:
+        """
+        Get the current analytics contract with its version, the id of its
+        document, from a single read
+        """
+        record_upstream_call("mongodb")
         document = await self.collection.find_one(
             {},
             sort=[("_id", -1)]
         )
         
         if document:
-            return AnalyticsContract(
+            return str(document["_id"]), AnalyticsContract(
                 qualitative=document.get("qualitative", []),
                 quantitative=document.get("quantitative", [])
             )
@@ -33,6 +46,8 @@ class AnalyticsContractRepository:
         """
         Save a new analytics contract
         """
+        record_upstream_call("mongodb")
         document = contract.model_dump()
-        await self.collection.insert_one(document)
+        result = await self.collection.insert_one(document)
+        logger.info("Analytics contract saved", extra={"fields": {"contract_id": str(result.inserted_id)}})
         return contract
@@ -0,0 +1,82 @@
+"""
+Repository for stored per-instance item analyses
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Optional
+from datetime import datetime
+import hashlib
+import json
+from app.models.schemas import InstanceItemAnalysis
+from app.logging_config import record_upstream_call
+
+
+class ItemAnalysisRepository:
+    """Repository for the item analysis computed with each instance recalculation"""
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["itemAnalysis"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the item analysis queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index("instance_id", name="instance_id", unique=True)
+    
+    async def save(self, analysis: InstanceItemAnalysis, only_if_changed: bool = False) -> InstanceItemAnalysis:
+        """
+        Save (or replace) the item analysis of an instance
+        
+        With only_if_changed, an analysis equal to the stored one (ignoring
+        calculated_at) is not written and keeps its stored calculation time.
+        """
+        document = analysis.model_dump()
+        canonical = json.dumps({**document, "calculated_at": None}, sort_keys=True, separators=(",", ":"))
+        document["_content_hash"] = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        
+        if only_if_changed:
+            record_upstream_call("mongodb")
+            stored = await self.collection.find_one(
+                {"instance_id": analysis.instance_id},
+                {"_id": 0, "_content_hash": 1}
+            )
+            if stored and stored.get("_content_hash") == document["_content_hash"]:
+                return analysis
+        
+        record_upstream_call("mongodb")
+        document["_calculated_at"] = datetime.utcnow()
+        await self.collection.update_one(
+            {"instance_id": analysis.instance_id},
+            {"$set": document},
+            upsert=True
+        )
+        
+        return analysis
+    
+    async def find_current(
+        self,
+        instance_id: str,
+        results_written_at: datetime
+    ) -> Optional[InstanceItemAnalysis]:
+        """
+        Find the item analysis of an instance if it was computed no earlier
+        than the latest write of the instance's results
+        """
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one(
+            {"instance_id": instance_id, "_calculated_at": {"$gte": results_written_at}},
+            {"_id": 0, "_calculated_at": 0, "_content_hash": 0}
+        )
+        
+        if document:
+            return InstanceItemAnalysis(**document)
+        
+        return None
+    
+    async def delete_by_instance(self, instance_id: str) -> bool:
+        """
+        Delete the item analysis of an instance
+        """
+        record_upstream_call("mongodb")
+        result = await self.collection.delete_one({"instance_id": instance_id})
+        return result.deleted_count > 0
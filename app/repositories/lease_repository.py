@@ -0,0 +1,69 @@
+"""
+Repository for named leases that let one worker at a time run a shared job
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from app.logging_config import record_upstream_call
+
+LEASE_TTL_INDEX = "lease_ttl"
+
+
+class LeaseRepository:
+    """
+    Repository for leases, one document per name
+    
+    A lease is held by one owner (a worker id) until it expires; its owner
+    may renew it at any time and anyone may take it once it has expired.
+    An expired lease is as good as a missing one, so the TTL monitor removes
+    them, including the per-instance leases of instances no longer precomputed.
+    """
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["leases"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the lease queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index("name", name="name", unique=True)
+        await self.collection.create_index(
+            [("expires_at", ASCENDING)],
+            name=LEASE_TTL_INDEX,
+            expireAfterSeconds=0
+        )
+    
+    async def acquire(self, name: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Atomically take or renew a lease; False while another owner holds it
+        """
+        record_upstream_call("mongodb")
+        now = datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {
+                    "name": name,
+                    "$or": [
+                        {"owner": owner},
+                        {"expires_at": {"$lte": now}}
+                    ]
+                },
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Held by another owner: the upsert collided with its document
+            return False
+        return True
+    
+    async def release(self, name: str, owner: str):
+        """
+        Let the lease be taken immediately, if still held by owner
+        """
+        record_upstream_call("mongodb")
+        await self.collection.update_one(
+            {"name": name, "owner": owner},
+            {"$set": {"expires_at": datetime.utcnow()}}
+        )
@@ -0,0 +1,289 @@
+"""
+In-process LRU cache of stored student metrics
+
+Sits in front of AnalyticsMetricsRepository lookups by (instance_id,
+student_id). Local writes invalidate entries directly; writes from other
+workers are picked up through a MongoDB change stream on the analytics
+collection. Entries also expire after a maximum age, which bounds staleness
+when change streams are unavailable (standalone servers, mongomock).
+
+The same change stream delivers results saved by other workers to the live
+metrics feed.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import time
+import uuid
+from app.models.schemas import AnalyticsMetrics
+
+logger = logging.getLogger(__name__)
+
+METRICS_CACHE_ENABLED = os.getenv("METRICS_CACHE_ENABLED", "true").lower() == "true"
+METRICS_CACHE_SIZE = int(os.getenv("METRICS_CACHE_SIZE", "10000"))
+METRICS_CACHE_TTL_SECONDS = float(os.getenv("METRICS_CACHE_TTL_SECONDS", "300"))
+
+# Stamped on saved results as _writer, so change stream consumers can tell
+# this worker's writes from other workers'
+WORKER_ID = uuid.uuid4().hex
+
+CacheKey = Tuple[str, str]
+
+# Fields changed by metadata-only updates (expiry refresh, activity
+# backfill); such updates change neither the cached metrics nor the feed
+METADATA_FIELDS = {"_expires_at", "_activity_id"}
+
+# Longest wait for a change before the stream checks whether it should
+# switch between looking up updated documents and not
+CHANGE_STREAM_POLL_MS = 1000
+
+
+class MetricsCache:
+    """Bounded LRU of AnalyticsMetrics keyed by (instance_id, student_id)"""
+    
+    def __init__(self, max_size: int = METRICS_CACHE_SIZE, ttl_seconds: float = METRICS_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # key -> (metrics, document _id, stored at)
+        self._entries: "OrderedDict[CacheKey, Tuple[AnalyticsMetrics, Any, float]]" = OrderedDict()
+        self._keys_by_id: Dict[Any, CacheKey] = {}
+        self._keys_by_instance: Dict[str, Set[str]] = {}
+        # Clock bumped by every invalidation, and the clock value at which
+        # each student, instance or document was last invalidated (bounded;
+        # reads older than the forgotten ones are not cached); see put()
+        self.generation = 0
+        self._invalidated: "OrderedDict[Tuple[Any, ...], int]" = OrderedDict()
+        self._forgotten_generation = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, instance_id: str, student_id: str) -> Optional[AnalyticsMetrics]:
+        key = (instance_id, student_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        metrics, _, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._remove(key)
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return metrics
+    
+    def put(self, metrics: AnalyticsMetrics, document_id: Any = None, generation: Optional[int] = None):
+        """
+        Store a document read from MongoDB
+        
+        Pass the generation seen before the read started: if the student,
+        its instance or the document was invalidated meanwhile, the document
+        may predate that write, so it is not cached. Invalidations of other
+        keys do not prevent caching.
+        """
+        if generation is not None and self._invalidated_since(metrics, document_id, generation):
+            return
+        
+        key = (metrics.instance_id, metrics.student_id)
+        self._remove(key)
+        
+        self._entries[key] = (metrics, document_id, time.monotonic())
+        if document_id is not None:
+            self._keys_by_id[document_id] = key
+        self._keys_by_instance.setdefault(metrics.instance_id, set()).add(metrics.student_id)
+        
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+    
+    def invalidate(self, instance_id: str, student_id: str):
+        self._mark(("student", instance_id, student_id))
+        self._remove((instance_id, student_id))
+    
+    def invalidate_instance(self, instance_id: str):
+        self._mark(("instance", instance_id))
+        for student_id in list(self._keys_by_instance.get(instance_id, ())):
+            self._remove((instance_id, student_id))
+    
+    def invalidate_document(self, document_id: Any):
+        self._mark(("document", document_id))
+        key = self._keys_by_id.get(document_id)
+        if key is not None:
+            self._remove(key)
+    
+    def clear(self):
+        self.generation += 1
+        self._invalidated.clear()
+        self._forgotten_generation = self.generation
+        self._entries.clear()
+        self._keys_by_id.clear()
+        self._keys_by_instance.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+    
+    def _mark(self, marker: Tuple[Any, ...]):
+        self.generation += 1
+        self._invalidated[marker] = self.generation
+        self._invalidated.move_to_end(marker)
+        while len(self._invalidated) > self.max_size:
+            _, self._forgotten_generation = self._invalidated.popitem(last=False)
+    
+    def _invalidated_since(self, metrics: AnalyticsMetrics, document_id: Any, generation: int) -> bool:
+        if generation < self._forgotten_generation:
+            return True
+        markers = [("student", metrics.instance_id, metrics.student_id), ("instance", metrics.instance_id)]
+        if document_id is not None:
+            markers.append(("document", document_id))
+        return any(self._invalidated.get(marker, 0) > generation for marker in markers)
+    
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        
+        document_id = entry[1]
+        if document_id is not None:
+            self._keys_by_id.pop(document_id, None)
+        
+        students = self._keys_by_instance.get(key[0])
+        if students is not None:
+            students.discard(key[1])
+            if not students:
+                del self._keys_by_instance[key[0]]
+
+
+# Global caches for this worker, one per database name
+_caches: Dict[str, MetricsCache] = {}
+_watch_task: Optional[asyncio.Task] = None
+
+
+def get_metrics_cache(database_name: str) -> Optional[MetricsCache]:
+    """
+    Get the worker's metrics cache for a database (None when disabled)
+    """
+    if not METRICS_CACHE_ENABLED:
+        return None
+    cache = _caches.get(database_name)
+    if cache is None:
+        cache = _caches[database_name] = MetricsCache()
+    return cache
+
+
+async def _watch_changes(
+    collection,
+    cache: Optional[MetricsCache],
+    on_change: Optional[Callable[[Dict[str, Any]], None]],
+    wants_documents: Callable[[], bool]
+):
+    """
+    Evict entries changed or deleted by any worker (or by the TTL monitor) and
+    hand results written by other workers to on_change
+    
+    Updated documents are only looked up (updateLookup, one read per write)
+    while wants_documents() is true; the stream is reopened from its resume
+    token whenever that changes, so no event is lost in between.
+    """
+    operations = ["update", "replace", "delete", "invalidate", "drop"]
+    if on_change is not None:
+        # Inserts carry their document without a lookup
+        operations.append("insert")
+    pipeline = [{"$match": {"operationType": {"$in": operations}}}]
+    retry_delay = 1.0
+    resume_token = None
+    
+    while True:
+        lookup = on_change is not None and wants_documents()
+        options: Dict[str, Any] = {"max_await_time_ms": CHANGE_STREAM_POLL_MS}
+        if lookup:
+            options["full_document"] = "updateLookup"
+        if resume_token is not None:
+            options["resume_after"] = resume_token
+        
+        try:
+            async with collection.watch(pipeline, **options) as stream:
+                retry_delay = 1.0
+                while lookup == (on_change is not None and wants_documents()):
+                    change = await stream.try_next()
+                    resume_token = stream.resume_token
+                    if change is None:
+                        continue
+                    
+                    operation = change["operationType"]
+                    if operation in ("invalidate", "drop"):
+                        if cache is not None:
+                            cache.clear()
+                        resume_token = None
+                        break
+                    
+                    description = change.get("updateDescription") or {}
+                    updated = set(description.get("updatedFields", {}))
+                    if updated and updated <= METADATA_FIELDS and not description.get("removedFields"):
+                        continue
+                    
+                    if cache is not None:
+                        cache.invalidate_document(change["documentKey"]["_id"])
+                    
+                    document = change.get("fullDocument")
+                    if on_change is not None and document and document.get("_writer") != WORKER_ID:
+                        on_change(document)
+        
+        except asyncio.CancelledError:
+            raise
+        except (NotImplementedError, TypeError):
+            # mongomock has no watch()
+            logger.warning("Change streams not supported, metrics cache relies on entry TTL")
+            return
+        except Exception as e:
+            if "replica set" in str(e).lower() or getattr(e, "code", None) == 40573:
+                logger.warning("Change streams not supported, metrics cache relies on entry TTL")
+                return
+            # Changes missed while disconnected cannot be replayed, so start clean
+            if cache is not None:
+                cache.clear()
+            resume_token = None
+            logger.warning("Metrics change stream interrupted", extra={"fields": {"error": str(e)}})
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 60.0)
+
+
+def start_metrics_cache_invalidation(
+    collection,
+    on_change: Optional[Callable[[Dict[str, Any]], None]] = None,
+    wants_documents: Callable[[], bool] = lambda: True
+):
+    """
+    Start listening for changes made by other workers
+    
+    on_change receives every result inserted by another worker, and every
+    result updated by another worker while wants_documents() is true (e.g.
+    while this worker has live feed subscribers).
+    """
+    global _watch_task
+    cache = get_metrics_cache(collection.database.name)
+    if (cache is None and on_change is None) or _watch_task is not None:
+        return
+    _watch_task = asyncio.create_task(_watch_changes(collection, cache, on_change, wants_documents))
+
+
+async def stop_metrics_cache_invalidation():
+    """
+    Stop the change stream listener
+    """
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except asyncio.CancelledError:
+            pass
+        _watch_task = None
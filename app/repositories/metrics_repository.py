@@ -2,35 +2,438 @@
 Repository for analytics metrics operations
 """
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import Optional, List
-from app.models.schemas import AnalyticsMetrics
-from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, TEXT, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from typing import Any, Dict, Optional, List, Tuple
+from app.models.schemas import AnalyticsMetrics, RationaleSearchHit
+from app.logging_config import record_upstream_call
+from app.repositories.metrics_cache import MetricsCache, WORKER_ID, get_metrics_cache
+from app.repositories.rollup_repository import ActivityRollupRepository
+from app.repositories.summary_repository import InstanceSummaryRepository
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+RATIONALE_TEXT_INDEX = "answer_rationale_text"
+INSTANCE_STUDENT_INDEX = "instance_student"
+RETENTION_TTL_INDEX = "retention_ttl"
+ACTIVITY_INDEX = "activity_hash"
+STUDENT_INDEX = "student_calculated_metrics"
+SEQUENCE_INDEX = "instance_sequence"
+INSTANCE_CALCULATED_INDEX = "instance_calculated"
+
+# Days a result is kept after the instance expires (or after its last
+# calculation when the instance has no expiry) before MongoDB's TTL monitor
+# removes it
+ANALYTICS_RETENTION_DAYS = float(os.getenv("ANALYTICS_RETENTION_DAYS", "90"))
+SNIPPET_RADIUS = 60
+
+# Server error code for a $text query on a collection without a text index
+INDEX_NOT_FOUND = 27
+
+# Unchanged results that are recalculated get their expiry pushed forward,
+# once it would move by more than this
+EXPIRY_REFRESH_MIN_SECONDS = 86400
+
+# Results saved this long before a replay are replayed even if their event
+# sequence is below the client's last event id: a sequence is allocated
+# before its result is written, so concurrent writes can commit out of order
+METRICS_EVENTS_REPLAY_GRACE_SECONDS = float(os.getenv("METRICS_EVENTS_REPLAY_GRACE_SECONDS", "10"))
+
+# Quantitative metrics, stored in STUDENT_INDEX so a student's results can
+# be listed from the index alone
+QUANTITATIVE_FIELDS = [
+    "total_attempts",
+    "total_time_seconds",
+    "average_time_per_attempt",
+    "number_of_correct_answers",
+    "final_score",
+    "activity_success"
+]
+
+# Fields of a stored result needed to move its contribution between rollups
+# and instance summaries
+ROLLUP_PROJECTION = {
+    "_id": 0,
+    "instance_id": 1,
+    "metrics": 1,
+    "calculated_at": 1,
+    "_activity_id": 1,
+    "_rolled_up": 1,
+    "_summarized": 1
+}
+
+
+def content_hash(
+    metrics: AnalyticsMetrics,
+    instance_expires_at: Optional[datetime] = None,
+    activity_id: Optional[str] = None,
+    activity_hash: Optional[str] = None
+) -> str:
+    """
+    Hash of what a save writes apart from the calculation time
+    
+    Stored as _content_hash so a recalculation producing the same result
+    can be recognized without comparing the documents.
+    """
+    content = {
+        "metrics": metrics.metrics.model_dump(),
+        "qualitative": metrics.qualitative.model_dump(),
+        "instance_expires_at": instance_expires_at.isoformat() if instance_expires_at else None,
+        "activity_id": activity_id,
+        "activity_hash": activity_hash
+    }
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
 
 
 class AnalyticsMetricsRepository:
     """Repository for managing calculated analytics metrics in MongoDB"""
     
-    def __init__(self, database: AsyncIOMotorDatabase):
+    def __init__(
+        self,
+        database: AsyncIOMotorDatabase,
+        cache: Optional[MetricsCache] = None
+    ):
         self.collection = database["analytics"]
+        self.sequences = database["eventSequences"]
+        # Per-student lookups go through the worker's LRU for this database unless one is given
+        self.cache = cache if cache is not None else get_metrics_cache(database.name)
+        self.rollups = ActivityRollupRepository(database)
+        self.summaries = InstanceSummaryRepository(database)
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the metrics queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index(
+            [("instance_id", ASCENDING), ("student_id", ASCENDING)],
+            name=INSTANCE_STUDENT_INDEX,
+            unique=True
+        )
+        await self.collection.create_index(
+            [("qualitative.answer_rationale", TEXT)],
+            name=RATIONALE_TEXT_INDEX,
+            default_language="english"
+        )
+        await self.collection.create_index(
+            [("_activity_id", ASCENDING), ("_activity_hash", ASCENDING)],
+            name=ACTIVITY_INDEX
+        )
+        await self.collection.create_index(
+            [("student_id", ASCENDING), ("calculated_at", ASCENDING), ("instance_id", ASCENDING)]
+            + [(f"metrics.{field}", ASCENDING) for field in QUANTITATIVE_FIELDS],
+            name=STUDENT_INDEX
+        )
+        await self.collection.create_index(
+            [("instance_id", ASCENDING), ("_seq", ASCENDING)],
+            name=SEQUENCE_INDEX
+        )
+        await self.collection.create_index(
+            [("instance_id", ASCENDING), ("_calculated_at", DESCENDING)],
+            name=INSTANCE_CALCULATED_INDEX
+        )
+        await self.collection.create_index(
+            [("_expires_at", ASCENDING)],
+            name=RETENTION_TTL_INDEX,
+            expireAfterSeconds=0
+        )
     
-    async def save(self, metrics: AnalyticsMetrics) -> AnalyticsMetrics:
+    async def save(
+        self,
+        metrics: AnalyticsMetrics,
+        instance_expires_at: Optional[datetime] = None,
+        activity_id: Optional[str] = None,
+        activity_hash: Optional[str] = None
+    ) -> int:
         """
         Save calculated analytics metrics
+        
+        instance_expires_at (naive UTC) anchors the retention period; without
+        it the document expires relative to this calculation. activity_id and
+        activity_hash record the activity configuration the result was
+        computed with; results with an activity_id also update the activity
+        rollups, replacing the previous result's contribution.
+        
+        Returns the result's event sequence, increasing with every save in
+        the instance and used as its live feed event id.
+        
+        Round trips: the sequence, the upsert returning the replaced
+        document, then the rollup and summary updates together. The
+        summary update is not atomic with the upsert (that would need a
+        transaction, hence a replica set); a failure between the two leaves
+        drift for the summary reconciliation to correct.
+        """
+        sequence = await self._next_sequence(metrics.instance_id)
+        document, update = self._result_update(metrics, sequence, instance_expires_at, activity_id, activity_hash)
+        
+        # Upsert: update if exists, insert if not. A concurrent insert of the
+        # same student fails on the unique index, and then this one updates it
+        for attempt in range(2):
+            record_upstream_call("mongodb")
+            try:
+                previous = await self.collection.find_one_and_update(
+                    {
+                        "instance_id": metrics.instance_id,
+                        "student_id": metrics.student_id
+                    },
+                    update,
+                    projection=ROLLUP_PROJECTION,
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+                break
+            except DuplicateKeyError:
+                if attempt:
+                    raise
+        
+        await self._apply_changes([(previous, document)])
+        self._saved(metrics)
+        
+        return sequence
+    
+    def _result_update(
+        self,
+        metrics: AnalyticsMetrics,
+        sequence: int,
+        instance_expires_at: Optional[datetime],
+        activity_id: Optional[str],
+        activity_hash: Optional[str]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Stored document of a result and the update writing it
         """
         document = metrics.model_dump()
         document["_calculated_at"] = datetime.utcnow()
+        document["_seq"] = sequence
+        retention_start = instance_expires_at or document["_calculated_at"]
+        document["_expires_at"] = retention_start + timedelta(days=ANALYTICS_RETENTION_DAYS)
+        document["_writer"] = WORKER_ID
+        document["_content_hash"] = content_hash(metrics, instance_expires_at, activity_id, activity_hash)
+        if activity_id:
+            document["_activity_id"] = activity_id
+        if activity_hash:
+            document["_activity_hash"] = activity_hash
+        
+        # Results with an activity are counted in the activity rollups;
+        # _rolled_up marks documents whose contribution has to be removed
+        # when they are replaced
+        document["_summarized"] = True
+        update: Dict[str, Any] = {"$set": document}
+        if activity_id:
+            document["_rolled_up"] = True
+        else:
+            update["$unset"] = {"_rolled_up": ""}
+        return document, update
+    
+    def _saved(self, metrics: AnalyticsMetrics):
+        # Dropped rather than replaced, so the next read caches the document _id
+        # that change stream events from other workers refer to
+        if self.cache is not None:
+            self.cache.invalidate(metrics.instance_id, metrics.student_id)
+    
+    async def _apply_changes(self, changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        """
+        Move the contributions of written or deleted results in the activity
+        rollups and instance summaries
+        
+        Each change pairs the stored document replaced or deleted (read with
+        ROLLUP_PROJECTION, or None) with the one written (or None). Only
+        documents marked _rolled_up / _summarized count; results stored
+        before instance summaries existed are counted by the next
+        reconciliation instead. Both collections get one bulk write, sent
+        concurrently.
+        """
+        def counted(document: Optional[Dict[str, Any]], marker: str) -> Optional[Dict[str, Any]]:
+            return document if document and document.get(marker) else None
+        
+        await asyncio.gather(
+            self.rollups.apply_changes([
+                (counted(previous, "_rolled_up"), counted(current, "_rolled_up"))
+                for previous, current in changes
+            ]),
+            self.summaries.apply_changes([
+                (counted(previous, "_summarized"), counted(current, "_summarized"))
+                for previous, current in changes
+            ])
+        )
+    
+    async def _next_sequence(self, instance_id: str, count: int = 1) -> int:
+        """
+        Allocate count consecutive event sequences of an instance and return the last
+        """
+        record_upstream_call("mongodb")
+        counter = await self.sequences.find_one_and_update(
+            {"instance_id": instance_id},
+            {"$inc": {"seq": count}},
+            projection={"_id": 0, "seq": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+    
+    async def save_changed(
+        self,
+        metrics_list: List[AnalyticsMetrics],
+        instance_expires_at: Optional[datetime] = None,
+        activity_id: Optional[str] = None,
+        activity_hash: Optional[str] = None
+    ) -> Tuple[List[AnalyticsMetrics], List[Tuple[AnalyticsMetrics, int]]]:
+        """
+        Save the results of an instance whose content differs from the stored one
         
-        # Upsert: update if exists, insert if not
-        await self.collection.update_one(
+        The stored results are read in one query; unchanged results are not
+        written and keep their stored calculated_at. Their expiry is still
+        pushed forward with one update when it would move by more than
+        EXPIRY_REFRESH_MIN_SECONDS, since without an instance expiry it is
+        anchored to the calculation. Returns the results as stored and the
+        ones written with their event sequence.
+        
+        The changed results share one sequence allocation and one bulk
+        write, and their rollup and summary changes are applied once for
+        the batch. A stored result is only replaced if it is still the one
+        read (same _seq), and a new student is only inserted if no other
+        save inserted it meanwhile (unique INSTANCE_STUDENT_INDEX); the
+        others are saved again one by one, unless that save came later.
+        """
+        if not metrics_list:
+            return [], []
+        
+        record_upstream_call("mongodb")
+        instance_id = metrics_list[0].instance_id
+        cursor = self.collection.find(
             {
-                "instance_id": metrics.instance_id,
-                "student_id": metrics.student_id
+                "instance_id": instance_id,
+                "student_id": {"$in": [metrics.student_id for metrics in metrics_list]}
             },
-            {"$set": document},
-            upsert=True
+            {**ROLLUP_PROJECTION, "student_id": 1, "_content_hash": 1, "_expires_at": 1, "_seq": 1}
         )
+        stored = {document["student_id"]: document async for document in cursor}
+        
+        expires_at = (instance_expires_at or datetime.utcnow()) + timedelta(days=ANALYTICS_RETENTION_DAYS)
+        refresh_before = expires_at - timedelta(seconds=EXPIRY_REFRESH_MIN_SECONDS)
+        results = []
+        changed = []
+        refreshed = []
+        for metrics in metrics_list:
+            previous = stored.get(metrics.student_id)
+            if previous and previous.get("_content_hash") == content_hash(metrics, instance_expires_at, activity_id, activity_hash):
+                results.append(metrics.model_copy(update={"calculated_at": previous["calculated_at"]}))
+                if previous.get("_expires_at") is not None and previous["_expires_at"] < refresh_before:
+                    refreshed.append(metrics.student_id)
+                continue
+            
+            results.append(metrics)
+            changed.append(metrics)
+        
+        written = await self._write_changed(changed, stored, instance_expires_at, activity_id, activity_hash)
+        
+        if refreshed:
+            record_upstream_call("mongodb")
+            await self.collection.update_many(
+                {"instance_id": instance_id, "student_id": {"$in": refreshed}},
+                {"$set": {"_expires_at": expires_at}}
+            )
+        
+        logger.debug("Analytics metrics saved", extra={"fields": {
+            "instance_id": instance_id,
+            "written": len(written),
+            "skipped": len(results) - len(written),
+            "expiry_refreshed": len(refreshed)
+        }})
+        return results, written
+    
+    async def _write_changed(
+        self,
+        changed: List[AnalyticsMetrics],
+        stored: Dict[str, Dict[str, Any]],
+        instance_expires_at: Optional[datetime],
+        activity_id: Optional[str],
+        activity_hash: Optional[str]
+    ) -> List[Tuple[AnalyticsMetrics, int]]:
+        """
+        Write the changed results of an instance given the stored documents
+        read for them (by student_id), returning each with its sequence
+        """
+        if not changed:
+            return []
+        
+        instance_id = changed[0].instance_id
+        last_sequence = await self._next_sequence(instance_id, len(changed))
+        
+        written = []
+        operations = []
+        for index, metrics in enumerate(changed):
+            sequence = last_sequence - len(changed) + index + 1
+            document, update = self._result_update(metrics, sequence, instance_expires_at, activity_id, activity_hash)
+            previous = stored.get(metrics.student_id)
+            # A new student only matches nothing: if another save inserted it
+            # meanwhile, the insert fails on the unique index
+            query: Dict[str, Any] = {"instance_id": instance_id, "student_id": metrics.student_id}
+            query["_seq"] = previous["_seq"] if previous and "_seq" in previous else {"$exists": False}
+            operations.append(UpdateOne(query, update, upsert=previous is None))
+            written.append((metrics, sequence, document))
         
-        return metrics
+        conflicts = set()
+        record_upstream_call("mongodb")
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            matched, upserted = result.matched_count, len(result.upserted_ids)
+        except BulkWriteError as e:
+            # New students inserted meanwhile by a concurrent recalculation
+            # fail on the unique index and are saved again below
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            conflicts.update(written[error["index"]][0].student_id for error in errors)
+            matched, upserted = e.details["nMatched"], e.details["nUpserted"]
+        
+        superseded = set()
+        if matched + upserted + len(conflicts) < len(operations):
+            # Some stored results were replaced since they were read
+            record_upstream_call("mongodb")
+            cursor = self.collection.find(
+                {"instance_id": instance_id, "student_id": {"$in": [metrics.student_id for metrics in changed]}},
+                {"_id": 0, "student_id": 1, "_seq": 1}
+            )
+            landed = {document["student_id"]: document.get("_seq", 0) async for document in cursor}
+            for metrics, sequence, _ in written:
+                if metrics.student_id in conflicts:
+                    continue
+                current = landed.get(metrics.student_id, 0)
+                if current < sequence:
+                    # Not written: replaced by a save allocated before this one
+                    conflicts.add(metrics.student_id)
+                elif current > sequence:
+                    # Replaced by a later save, before or after this write
+                    superseded.add(metrics.student_id)
+        
+        await self._apply_changes([
+            (stored.get(metrics.student_id), document)
+            for metrics, _, document in written
+            if metrics.student_id not in conflicts and metrics.student_id not in superseded
+        ])
+        if superseded:
+            # Whether these writes replaced another result is unknown: the
+            # summary is rewritten on its next read and the rollups by their
+            # reconciliation
+            await self.summaries.mark_unreconciled(instance_id)
+        
+        saved = []
+        for metrics, sequence, _ in written:
+            if metrics.student_id in conflicts:
+                saved.append((metrics, await self.save(metrics, instance_expires_at, activity_id, activity_hash)))
+            elif metrics.student_id not in superseded:
+                self._saved(metrics)
+                saved.append((metrics, sequence))
+        return saved
     
     async def find_by_instance_and_student(
         self,
@@ -40,6 +443,14 @@ class AnalyticsMetricsRepository:
         """
         Find analytics metrics for a specific instance and student
         """
+        generation = None
+        if self.cache is not None:
+            cached = self.cache.get(instance_id, student_id)
+            if cached is not None:
+                return cached
+            generation = self.cache.generation
+        
+        record_upstream_call("mongodb")
         document = await self.collection.find_one({
             "instance_id": instance_id,
             "student_id": student_id
@@ -47,16 +458,63 @@ class AnalyticsMetricsRepository:
         
         if document:
             # Remove MongoDB _id field
-            document.pop("_id", None)
+            document_id = document.pop("_id", None)
             document.pop("_calculated_at", None)
-            return AnalyticsMetrics(**document)
+            metrics = AnalyticsMetrics(**document)
+            if self.cache is not None:
+                self.cache.put(metrics, document_id, generation)
+            return metrics
         
         return None
     
+    async def get_calculated_at(
+        self,
+        instance_id: str,
+        student_id: str
+    ) -> Optional[str]:
+        """
+        Get only the calculated_at stamp of a student's stored metrics
+        
+        Used to validate conditional requests without loading the document.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(instance_id, student_id)
+            if cached is not None:
+                return cached.calculated_at
+        
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one(
+            {"instance_id": instance_id, "student_id": student_id},
+            {"_id": 0, "calculated_at": 1}
+        )
+        return document.get("calculated_at") if document else None
+    
+    async def get_instance_version(self, instance_id: str) -> Optional[Tuple[int, datetime]]:
+        """
+        Get the number of stored results and the latest write time for an instance
+        
+        Any save refreshes _calculated_at and any delete changes the count,
+        so the pair identifies the current state of the instance. Both are
+        answered from INSTANCE_CALCULATED_INDEX without reading the results.
+        """
+        record_upstream_call("mongodb")
+        latest = await self.collection.find_one(
+            {"instance_id": instance_id},
+            {"_id": 0, "_calculated_at": 1},
+            sort=[("_calculated_at", DESCENDING)]
+        )
+        if latest is None:
+            return None
+        
+        record_upstream_call("mongodb")
+        count = await self.collection.count_documents({"instance_id": instance_id})
+        return count, latest["_calculated_at"]
+    
     async def find_by_instance(self, instance_id: str) -> List[AnalyticsMetrics]:
         """
         Find all analytics metrics for an instance
         """
+        record_upstream_call("mongodb")
         cursor = self.collection.find({"instance_id": instance_id})
         results = []
         
@@ -67,6 +525,208 @@ class AnalyticsMetricsRepository:
         
         return results
     
+    async def find_by_instance_since(
+        self,
+        instance_id: str,
+        after_sequence: int
+    ) -> List[Tuple[AnalyticsMetrics, int]]:
+        """
+        Find the results of an instance saved after an event sequence, with
+        their sequence, in sequence order
+        
+        Results saved in the last METRICS_EVENTS_REPLAY_GRACE_SECONDS are
+        included whatever their sequence, so a result committed after a
+        later sequence was delivered is not missed; clients may receive it
+        twice.
+        """
+        record_upstream_call("mongodb")
+        grace_start = datetime.utcnow() - timedelta(seconds=METRICS_EVENTS_REPLAY_GRACE_SECONDS)
+        cursor = self.collection.find(
+            {
+                "instance_id": instance_id,
+                "$or": [
+                    {"_seq": {"$gt": after_sequence}},
+                    {"_seq": {"$exists": True}, "_calculated_at": {"$gte": grace_start}}
+                ]
+            },
+            {"_id": 0, "instance_id": 1, "student_id": 1, "metrics": 1, "qualitative": 1, "calculated_at": 1, "_seq": 1}
+        ).sort("_seq", ASCENDING)
+        
+        results = []
+        async for document in cursor:
+            sequence = document.pop("_seq")
+            results.append((AnalyticsMetrics(**document), sequence))
+        return results
+    
+    async def find_by_student(
+        self,
+        student_id: str,
+        skip: int = 0,
+        limit: int = 20,
+        quantitative_only: bool = False,
+        ascending: bool = False
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Get a page of a student's stored results across instances, ordered by calculated_at
+        
+        Both the count and the ordered page are served by the student index
+        (the count without reading any document). With quantitative_only
+        every projected field is in the index, so the page is read from the
+        index alone. Returns the total number of results and the current page.
+        """
+        record_upstream_call("mongodb")
+        total = await self.collection.count_documents({"student_id": student_id})
+        
+        projection: Dict[str, int] = {"_id": 0, "instance_id": 1, "calculated_at": 1}
+        if quantitative_only:
+            projection.update({f"metrics.{field}": 1 for field in QUANTITATIVE_FIELDS})
+        else:
+            projection.update({"metrics": 1, "qualitative": 1})
+        cursor = self.collection.find({"student_id": student_id}, projection).sort([
+            ("calculated_at", ASCENDING if ascending else DESCENDING),
+            ("instance_id", ASCENDING if ascending else DESCENDING)
+        ]).skip(skip).limit(limit)
+        
+        return total, [document async for document in cursor]
+    
+    async def find_instance_ids(self) -> List[str]:
+        """
+        Get every instance with stored results
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct("instance_id")
+    
+    async def find_instance_ids_by_activity(self, activity_id: str) -> List[str]:
+        """
+        Get every instance with stored results for an activity
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct("instance_id", {"_activity_id": activity_id})
+    
+    async def find_rolled_up_by_activity(self, activity_id: str, since: str) -> List[Dict[str, Any]]:
+        """
+        Get the stored results of an activity counted in its rollups and
+        calculated on or after since (YYYY-MM-DD)
+        """
+        record_upstream_call("mongodb")
+        cursor = self.collection.find(
+            {"_activity_id": activity_id, "_rolled_up": True, "calculated_at": {"$gte": since}},
+            ROLLUP_PROJECTION
+        )
+        return [document async for document in cursor]
+    
+    async def find_instance_ids_without_activity(self) -> List[str]:
+        """
+        Get the instances with results stored before results recorded their
+        activity, not yet resolved (see set_activity_id)
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct("instance_id", {"_activity_id": {"$exists": False}})
+    
+    async def set_activity_id(self, instance_id: str, activity_id: Optional[str]) -> int:
+        """
+        Backfill the activity of an instance's results that do not record one
+        
+        None records that the activity could not be resolved, so the
+        instance is not looked up again; its results belong to no activity
+        until they are recalculated.
+        """
+        record_upstream_call("mongodb")
+        result = await self.collection.update_many(
+            {"instance_id": instance_id, "_activity_id": {"$exists": False}},
+            {"$set": {"_activity_id": activity_id}}
+        )
+        return result.modified_count
+    
+    async def find_student_ids_by_activity_hash(
+        self,
+        instance_id: str,
+        activity_hash: str
+    ) -> List[str]:
+        """
+        Get the students of an instance whose results were computed with the given activity configuration
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct(
+            "student_id",
+            {"instance_id": instance_id, "_activity_hash": activity_hash}
+        )
+    
+    async def find_expiring_instance_ids(self, before: datetime) -> List[str]:
+        """
+        Get the instances whose results are all due to expire before the given time
+        
+        Both queries use the retention index: instances with some result
+        expiring are candidates, minus those with a result expiring later.
+        """
+        record_upstream_call("mongodb")
+        candidates = await self.collection.distinct("instance_id", {"_expires_at": {"$lte": before}})
+        if not candidates:
+            return []
+        
+        record_upstream_call("mongodb")
+        still_live = set(await self.collection.distinct(
+            "instance_id",
+            {"instance_id": {"$in": candidates}, "_expires_at": {"$gt": before}}
+        ))
+        return [instance_id for instance_id in candidates if instance_id not in still_live]
+    
+    async def find_quantitative_by_instance(
+        self,
+        instance_id: str,
+        with_ids: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Get only the quantitative metrics and calculation time of each student in an instance
+        
+        with_ids keeps the document _id, so exactly the rows read can be deleted.
+        """
+        record_upstream_call("mongodb")
+        cursor = self.collection.find(
+            {"instance_id": instance_id},
+            {"_id": int(with_ids), "student_id": 1, "metrics": 1, "calculated_at": 1}
+        )
+        return [document async for document in cursor]
+    
+    async def delete_by_instance(
+        self,
+        instance_id: str,
+        document_ids: Optional[List[Any]] = None,
+        calculated_before: Optional[datetime] = None
+    ) -> int:
+        """
+        Delete all analytics metrics for an instance
+        
+        With document_ids only those documents are deleted, and with
+        calculated_before only if they were not recalculated since; results
+        written meanwhile are kept and the instance summary is left to be
+        reconciled on its next read.
+        """
+        record_upstream_call("mongodb")
+        query: Dict[str, Any] = {"instance_id": instance_id}
+        if document_ids is not None:
+            query["_id"] = {"$in": document_ids}
+        if calculated_before is not None:
+            query["_calculated_at"] = {"$lte": calculated_before}
+        result = await self.collection.delete_many(query)
+        
+        if self.cache is not None:
+            self.cache.invalidate_instance(instance_id)
+        
+        record_upstream_call("mongodb")
+        if len(query) == 1 or not await self.collection.find_one({"instance_id": instance_id}, {"_id": 1}):
+            await self.summaries.delete_by_instance(instance_id)
+        else:
+            await self.summaries.mark_unreconciled(instance_id)
+        return result.deleted_count
+    
+    async def collection_stats(self) -> Dict[str, Any]:
+        """
+        Document count, data size and index footprint of the analytics collection
+        """
+        record_upstream_call("mongodb")
+        return await collection_stats(self.collection)
+    
     async def delete_by_instance_and_student(
         self,
         instance_id: str,
@@ -75,9 +735,122 @@ class AnalyticsMetricsRepository:
         """
         Delete analytics metrics for a specific instance and student
         """
-        result = await self.collection.delete_one({
+        record_upstream_call("mongodb")
+        previous = await self.collection.find_one_and_delete(
+            {"instance_id": instance_id, "student_id": student_id},
+            projection=ROLLUP_PROJECTION
+        )
+        if self.cache is not None:
+            self.cache.invalidate(instance_id, student_id)
+        if previous:
+            await self._apply_changes([(previous, None)])
+        
+        logger.debug("Analytics metrics deleted", extra={"fields": {
             "instance_id": instance_id,
-            "student_id": student_id
-        })
+            "student_id": student_id,
+            "deleted": int(previous is not None)
+        }})
+        return previous is not None
+    
+    async def search_rationales(
+        self,
+        query: str,
+        instance_id: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 20
+    ) -> Tuple[int, List[RationaleSearchHit]]:
+        """
+        Full-text search over student answer rationales
+        
+        Results are ranked by the MongoDB text score and paginated with
+        skip/limit. Returns the total number of matching documents and the
+        current page of hits. Raises ValueError when the text index has not
+        been created.
+        """
+        record_upstream_call("mongodb")
+        filter_query = {"$text": {"$search": query}}
+        if instance_id:
+            filter_query["instance_id"] = instance_id
         
-        return result.deleted_count > 0
+        try:
+            total = await self.collection.count_documents(filter_query)
+            
+            cursor = self.collection.find(
+                filter_query,
+                {
+                    "_id": 0,
+                    "instance_id": 1,
+                    "student_id": 1,
+                    "qualitative.answer_rationale": 1,
+                    "score": {"$meta": "textScore"}
+                }
+            ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(limit)
+            
+            hits = []
+            async for document in cursor:
+                rationales = document.get("qualitative", {}).get("answer_rationale", [])
+                hits.append(RationaleSearchHit(
+                    instance_id=document["instance_id"],
+                    student_id=document["student_id"],
+                    score=document.get("score", 0.0),
+                    snippets=self._extract_snippets(rationales, query)
+                ))
+        except OperationFailure as e:
+            if e.code != INDEX_NOT_FOUND:
+                raise
+            raise ValueError(f"Rationale search is unavailable: index {RATIONALE_TEXT_INDEX} does not exist")
+        
+        return total, hits
+    
+    @staticmethod
+    def _extract_snippets(rationales: List[str], query: str) -> List[str]:
+        """
+        Build short snippets around the query terms found in each rationale
+        
+        The text index stems words, so a document can match without the
+        literal term appearing; in that case the rationale is returned
+        truncated to the snippet size.
+        """
+        terms = [term for term in re.findall(r"\w+", query.lower()) if term]
+        snippets = []
+        
+        for rationale in rationales:
+            lowered = rationale.lower()
+            positions = [lowered.find(term) for term in terms]
+            positions = [pos for pos in positions if pos >= 0]
+            if not positions:
+                continue
+            
+            start = max(0, min(positions) - SNIPPET_RADIUS)
+            end = min(len(rationale), min(positions) + SNIPPET_RADIUS)
+            snippet = rationale[start:end].strip()
+            if start > 0:
+                snippet = "..." + snippet
+            if end < len(rationale):
+                snippet = snippet + "..."
+            snippets.append(snippet)
+        
+        if not snippets and rationales:
+            first = rationales[0]
+            snippets.append(
+                first if len(first) <= 2 * SNIPPET_RADIUS
+                else first[:2 * SNIPPET_RADIUS].rstrip() + "..."
+            )
+        
+        return snippets
+
+
+async def collection_stats(collection) -> Dict[str, Any]:
+    """
+    Summarize collStats for a collection
+    """
+    stats = await collection.database.command({"collStats": collection.name})
+    return {
+        "collection": collection.name,
+        "count": stats.get("count", 0),
+        "size_bytes": stats.get("size", 0),
+        "storage_size_bytes": stats.get("storageSize", 0),
+        "average_document_bytes": stats.get("avgObjSize", 0),
+        "total_index_size_bytes": stats.get("totalIndexSize", 0),
+        "index_sizes_bytes": stats.get("indexSizes", {})
+    }
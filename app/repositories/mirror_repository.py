@@ -0,0 +1,222 @@
+"""
+Repository for the local mirror of Activity API data
+
+Instances, activities and submissions fetched from the Activity API are
+stored as returned (by alias) together with their fetch time, and expire
+MIRROR_RETENTION_DAYS after they were last fetched.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReplaceOne
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from app.models.schemas import Activity, DeploymentInstance, Submission
+from app.logging_config import record_upstream_call
+import hashlib
+import json
+import os
+
+MIRROR_TTL_INDEX = "mirror_ttl"
+
+# Days a mirrored copy is kept after it was last fetched before MongoDB's
+# TTL monitor removes it; a later read fetches it again
+MIRROR_RETENTION_DAYS = float(os.getenv("MIRROR_RETENTION_DAYS", "90"))
+
+# Unchanged submissions of a full fetch get their expiry pushed forward,
+# once it would move by more than this
+MIRROR_EXPIRY_REFRESH_MIN_SECONDS = 86400
+
+# Mirror bookkeeping fields, never part of the mirrored documents
+_METADATA = {"_id": 0, "_fetched_at": 0, "_expires_at": 0, "_content_hash": 0}
+
+
+def _expires_at(fetched_at: datetime) -> datetime:
+    return fetched_at + timedelta(days=MIRROR_RETENTION_DAYS)
+
+
+class ActivityMirrorRepository:
+    """Repository for mirrored Activity API documents"""
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.instances = database["mirrorInstances"]
+        self.activities = database["mirrorActivities"]
+        self.submissions = database["mirrorSubmissions"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the mirror lookups
+        """
+        record_upstream_call("mongodb")
+        await self.instances.create_index("instance_id", name="instance_id", unique=True)
+        await self.activities.create_index("activity_id", name="activity_id", unique=True)
+        await self.submissions.create_index(
+            [("instance_id", ASCENDING), ("student_id", ASCENDING)],
+            name="instance_student",
+            unique=True
+        )
+        for collection in (self.instances, self.activities, self.submissions):
+            await collection.create_index(
+                [("_expires_at", ASCENDING)],
+                name=MIRROR_TTL_INDEX,
+                expireAfterSeconds=0
+            )
+    
+    async def find_instance(self, instance_id: str) -> Optional[Tuple[DeploymentInstance, datetime]]:
+        """
+        Get a mirrored instance and its fetch time
+        """
+        record_upstream_call("mongodb")
+        document = await self.instances.find_one(
+            {"instance_id": instance_id, "instance": {"$exists": True}},
+            {"_id": 0, "instance": 1, "_fetched_at": 1}
+        )
+        if not document:
+            return None
+        return DeploymentInstance(**document["instance"]), document["_fetched_at"]
+    
+    async def save_instance(self, instance: DeploymentInstance):
+        record_upstream_call("mongodb")
+        fetched_at = datetime.utcnow()
+        await self.instances.update_one(
+            {"instance_id": instance.instanceId},
+            {"$set": {
+                "instance": instance.model_dump(by_alias=True),
+                "_fetched_at": fetched_at,
+                "_expires_at": _expires_at(fetched_at)
+            }},
+            upsert=True
+        )
+    
+    async def find_activity(self, activity_id: str) -> Optional[Tuple[Activity, datetime]]:
+        """
+        Get a mirrored activity and its fetch time
+        """
+        record_upstream_call("mongodb")
+        document = await self.activities.find_one(
+            {"activity_id": activity_id},
+            {"_id": 0, "_expires_at": 0, "_content_hash": 0}
+        )
+        if not document:
+            return None
+        fetched_at = document.pop("_fetched_at")
+        return Activity(**document), fetched_at
+    
+    async def save_activity(self, activity: Activity):
+        record_upstream_call("mongodb")
+        document = activity.model_dump(by_alias=True)
+        document["_fetched_at"] = datetime.utcnow()
+        document["_expires_at"] = _expires_at(document["_fetched_at"])
+        await self.activities.replace_one({"activity_id": activity.activity_id}, document, upsert=True)
+    
+    async def find_submission(
+        self,
+        instance_id: str,
+        student_id: str
+    ) -> Optional[Tuple[Submission, datetime]]:
+        """
+        Get a student's mirrored submission and its fetch time
+        """
+        record_upstream_call("mongodb")
+        document = await self.submissions.find_one(
+            {"instance_id": instance_id, "student_id": student_id},
+            {"_id": 0, "_expires_at": 0, "_content_hash": 0}
+        )
+        if not document:
+            return None
+        fetched_at = document.pop("_fetched_at")
+        return Submission(**document), fetched_at
+    
+    async def save_submission(self, submission: Submission):
+        record_upstream_call("mongodb")
+        await self.submissions.replace_one(
+            {"instance_id": submission.instanceId, "student_id": submission.studentId},
+            self._submission_document(submission, datetime.utcnow()),
+            upsert=True
+        )
+    
+    async def find_instance_submissions(
+        self,
+        instance_id: str
+    ) -> Optional[Tuple[List[Submission], datetime]]:
+        """
+        Get the mirrored submissions of an instance and the time the full list
+        was last fetched; None if it never was
+        """
+        fetched_at = await self.find_submissions_fetched_at(instance_id)
+        if fetched_at is None:
+            return None
+        
+        record_upstream_call("mongodb")
+        cursor = self.submissions.find({"instance_id": instance_id}, _METADATA)
+        submissions = [Submission(**document) async for document in cursor]
+        return submissions, fetched_at
+    
+    async def find_submissions_fetched_at(self, instance_id: str) -> Optional[datetime]:
+        """
+        Get the time the full submission list of an instance was last
+        fetched, which also confirms the rows it did not rewrite
+        """
+        record_upstream_call("mongodb")
+        marker = await self.instances.find_one(
+            {"instance_id": instance_id, "_submissions_fetched_at": {"$exists": True}},
+            {"_id": 0, "_submissions_fetched_at": 1}
+        )
+        return marker["_submissions_fetched_at"] if marker else None
+    
+    async def save_instance_submissions(self, instance_id: str, submissions: List[Submission]):
+        """
+        Store the full submission list of an instance
+        
+        Only rows whose content changed are written, compared by content
+        hash with the rows read in one query; unchanged rows keep their
+        fetch time (the list's fetch time confirms them) and only get their
+        expiry pushed forward once it would move by more than
+        MIRROR_EXPIRY_REFRESH_MIN_SECONDS. Mirrored submissions missing from
+        the list (removed upstream) are deleted.
+        """
+        record_upstream_call("mongodb")
+        cursor = self.submissions.find({"instance_id": instance_id}, {"_id": 0, "student_id": 1, "_content_hash": 1})
+        stored = {document["student_id"]: document.get("_content_hash") async for document in cursor}
+        
+        fetched_at = datetime.utcnow()
+        replacements = []
+        for submission in submissions:
+            document = self._submission_document(submission, fetched_at)
+            if stored.get(submission.studentId) != document["_content_hash"]:
+                replacements.append(ReplaceOne(
+                    {"instance_id": submission.instanceId, "student_id": submission.studentId},
+                    document,
+                    upsert=True
+                ))
+        if replacements:
+            record_upstream_call("mongodb")
+            await self.submissions.bulk_write(replacements, ordered=False)
+        
+        current = {submission.studentId for submission in submissions}
+        removed = [student_id for student_id in stored if student_id not in current]
+        if removed:
+            record_upstream_call("mongodb")
+            await self.submissions.delete_many({"instance_id": instance_id, "student_id": {"$in": removed}})
+        
+        if len(replacements) < len(submissions):
+            refresh_before = _expires_at(fetched_at) - timedelta(seconds=MIRROR_EXPIRY_REFRESH_MIN_SECONDS)
+            record_upstream_call("mongodb")
+            await self.submissions.update_many(
+                {"instance_id": instance_id, "_expires_at": {"$lt": refresh_before}},
+                {"$set": {"_expires_at": _expires_at(fetched_at)}}
+            )
+        
+        record_upstream_call("mongodb")
+        await self.instances.update_one(
+            {"instance_id": instance_id},
+            {"$set": {"_submissions_fetched_at": fetched_at, "_expires_at": _expires_at(fetched_at)}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def _submission_document(submission: Submission, fetched_at: datetime) -> Dict[str, Any]:
+        document = submission.model_dump(by_alias=True)
+        canonical = json.dumps(document, sort_keys=True, separators=(",", ":"), default=str)
+        document["_content_hash"] = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        document["_fetched_at"] = fetched_at
+        document["_expires_at"] = _expires_at(fetched_at)
+        return document
@@ -0,0 +1,201 @@
+"""
+Repository for regrade job state and progress
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from app.models.schemas import RegradeJob
+from app.logging_config import record_upstream_call
+
+ACTIVE_STATUSES = ["pending", "running"]
+ACTIVE_ACTIVITY_INDEX = "active_activity"
+
+
+def _job(document: Dict[str, Any]) -> RegradeJob:
+    """
+    Build a job from its stored document
+    """
+    document.pop("_active_activity_id", None)
+    return RegradeJob(**document)
+
+
+class RegradeJobRepository:
+    """
+    Repository for persisting regrade jobs so they can be resumed
+    
+    An active job stores its activity in _active_activity_id, unique among
+    the documents that have it, so an activity never has two active jobs.
+    """
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["regradeJobs"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the job queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index("job_id", name="job_id", unique=True)
+        await self.collection.create_index("status", name="status")
+        await self.collection.create_index(
+            "_active_activity_id",
+            name=ACTIVE_ACTIVITY_INDEX,
+            unique=True,
+            sparse=True
+        )
+    
+    async def create(self, job: RegradeJob) -> RegradeJob:
+        """
+        Insert a new job, or return the activity's active job if another
+        request created one first
+        """
+        record_upstream_call("mongodb")
+        try:
+            await self.collection.insert_one({**job.model_dump(), "_active_activity_id": job.activity_id})
+        except DuplicateKeyError:
+            existing = await self.find_active_for_activity(job.activity_id)
+            if existing is None:
+                raise
+            return existing
+        return job
+    
+    async def find_by_id(self, job_id: str) -> Optional[RegradeJob]:
+        """
+        Find a job by its ID
+        """
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one({"job_id": job_id}, {"_id": 0, "_lease_expires_at": 0})
+        
+        if document:
+            return _job(document)
+        
+        return None
+    
+    async def find_active_for_activity(self, activity_id: str) -> Optional[RegradeJob]:
+        """
+        Find a pending or running job for an activity
+        """
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one(
+            {"activity_id": activity_id, "status": {"$in": ACTIVE_STATUSES}},
+            {"_id": 0, "_lease_expires_at": 0}
+        )
+        
+        if document:
+            return _job(document)
+        
+        return None
+    
+    async def reopen_partial(self, activity_id: str) -> Optional[RegradeJob]:
+        """
+        Make the latest job of an activity that left instances failed active
+        again, so a run retries them
+        """
+        record_upstream_call("mongodb")
+        try:
+            document = await self.collection.find_one_and_update(
+                {"activity_id": activity_id, "status": "partial"},
+                {"$set": {
+                    "status": "pending",
+                    "updated_at": datetime.utcnow().isoformat() + "Z",
+                    "_active_activity_id": activity_id
+                }},
+                projection={"_id": 0, "_lease_expires_at": 0},
+                sort=[("created_at", -1)],
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another job became active meanwhile
+            return None
+        
+        if document:
+            return _job(document)
+        
+        return None
+    
+    async def find_resumable_ids(self) -> List[str]:
+        """
+        Get the active jobs whose lease has lapsed (their worker stopped)
+        """
+        record_upstream_call("mongodb")
+        cursor = self.collection.find(
+            {
+                "status": {"$in": ACTIVE_STATUSES},
+                "$or": [
+                    {"_lease_expires_at": {"$exists": False}},
+                    {"_lease_expires_at": {"$lt": datetime.utcnow()}}
+                ]
+            },
+            {"_id": 0, "job_id": 1}
+        )
+        return [document["job_id"] async for document in cursor]
+    
+    async def claim(self, job_id: str, lease_seconds: float) -> Optional[RegradeJob]:
+        """
+        Atomically take ownership of an active job whose lease is free
+        """
+        record_upstream_call("mongodb")
+        now = datetime.utcnow()
+        document = await self.collection.find_one_and_update(
+            {
+                "job_id": job_id,
+                "status": {"$in": ACTIVE_STATUSES},
+                "$or": [
+                    {"_lease_expires_at": {"$exists": False}},
+                    {"_lease_expires_at": {"$lt": now}}
+                ]
+            },
+            {"$set": {
+                "status": "running",
+                "updated_at": now.isoformat() + "Z",
+                "_lease_expires_at": now + timedelta(seconds=lease_seconds)
+            }},
+            projection={"_id": 0, "_lease_expires_at": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        
+        if document:
+            document.update(status="running", updated_at=now.isoformat() + "Z")
+            return _job(document)
+        
+        return None
+    
+    async def update(
+        self,
+        job_id: str,
+        fields: Dict[str, Any],
+        lease_seconds: Optional[float] = None,
+        increments: Optional[Dict[str, int]] = None,
+        add_completed_instance: Optional[str] = None,
+        add_failed_instance: Optional[Dict[str, str]] = None,
+        expected_statuses: Optional[List[str]] = None
+    ) -> bool:
+        """
+        Record progress and optionally renew (or with lease_seconds=0, release) the lease
+        
+        A status outside ACTIVE_STATUSES lets another job of the activity be
+        created. With expected_statuses the job is only updated while its
+        status is one of them; returns whether it was updated.
+        """
+        record_upstream_call("mongodb")
+        now = datetime.utcnow()
+        update: Dict[str, Any] = {"$set": {**fields, "updated_at": now.isoformat() + "Z"}}
+        
+        if lease_seconds is not None:
+            update["$set"]["_lease_expires_at"] = now + timedelta(seconds=lease_seconds)
+        if "status" in fields and fields["status"] not in ACTIVE_STATUSES:
+            update["$unset"] = {"_active_activity_id": ""}
+        if increments:
+            update["$inc"] = increments
+        if add_completed_instance:
+            update["$addToSet"] = {"completed_instances": add_completed_instance}
+        if add_failed_instance:
+            update["$push"] = {"failed_instances": add_failed_instance}
+        
+        query: Dict[str, Any] = {"job_id": job_id}
+        if expected_statuses is not None:
+            query["status"] = {"$in": expected_statuses}
+        result = await self.collection.update_one(query, update)
+        return result.matched_count == 1
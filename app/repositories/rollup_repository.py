@@ -0,0 +1,205 @@
+"""
+Repository for per-activity rollups of stored student results
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import datetime
+import hashlib
+from app.logging_config import record_upstream_call
+
+ACTIVITY_BUCKET_INDEX = "activity_bucket"
+
+
+def instance_key(instance_id: str) -> str:
+    """
+    Key of an instance in instance_counts (field names cannot contain dots
+    or start with $, which instance ids may)
+    """
+    return hashlib.sha1(instance_id.encode("utf-8")).hexdigest()[:16]
+
+
+def rollup_increments(metrics: Dict[str, Any], sign: int) -> Dict[str, float]:
+    """
+    Counter increments contributed by one result (sign -1 removes it)
+    """
+    return {
+        "result_count": sign,
+        "pass_count": sign if metrics["activity_success"] else 0,
+        "final_score_sum": sign * metrics["final_score"],
+        "total_time_seconds_sum": sign * metrics["total_time_seconds"],
+        f"attempts_histogram.{metrics['total_attempts']}": sign
+    }
+
+
+class ActivityRollupRepository:
+    """
+    Repository for per-activity counters, one document per activity and
+    calculation day (UTC)
+    
+    Counters are sums, so a result is added and removed with $inc and the
+    rollup of any date range is the sum of its day documents. Rollups hold
+    the latest result of every student; results removed by retention
+    (archiving, TTL expiry) stay counted.
+    
+    instance_counts holds the results of each instance in the bucket (keyed
+    by instance_key), so an instance leaves instance_ids with its last result. Every $inc bumps
+    version, which lets a reconciliation replace a day document only if no
+    change was applied while it was being rebuilt.
+    """
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["activityRollups"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the rollup queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index(
+            [("activity_id", ASCENDING), ("bucket", ASCENDING)],
+            name=ACTIVITY_BUCKET_INDEX,
+            unique=True
+        )
+    
+    async def apply_changes(self, changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        """
+        Move students' contributions from their previous results to the current ones
+        
+        Each change is a (previous, current) pair of stored analytics
+        documents (metrics, calculated_at, instance_id, _activity_id) or
+        None. The increments are summed per day document and applied in one
+        ordered bulk write, followed by the removal of instances left with
+        no result in a day document.
+        """
+        increments_by_key: Dict[Tuple[str, str], Dict[str, float]] = {}
+        added: Dict[Tuple[str, str], Set[str]] = {}
+        removed: Dict[Tuple[str, str], Set[str]] = {}
+        
+        for previous, current in changes:
+            for document, sign in ((previous, -1), (current, 1)):
+                if not document or not document.get("_activity_id"):
+                    continue
+                key = (document["_activity_id"], document["calculated_at"][:10])
+                increments = increments_by_key.setdefault(key, {})
+                for field, value in rollup_increments(document["metrics"], sign).items():
+                    increments[field] = increments.get(field, 0) + value
+                instance_field = f"instance_counts.{instance_key(document['instance_id'])}"
+                increments[instance_field] = increments.get(instance_field, 0) + sign
+                (added if sign > 0 else removed).setdefault(key, set()).add(document["instance_id"])
+        
+        operations = []
+        for (activity_id, bucket), increments in increments_by_key.items():
+            increments["version"] = 1
+            update: Dict[str, Any] = {"$inc": {field: value for field, value in increments.items() if value}}
+            if (activity_id, bucket) in added:
+                update["$addToSet"] = {"instance_ids": {"$each": sorted(added[(activity_id, bucket)])}}
+            operations.append(UpdateOne({"activity_id": activity_id, "bucket": bucket}, update, upsert=True))
+        
+        for (activity_id, bucket), instance_ids in removed.items():
+            for instance_id in sorted(instance_ids - added.get((activity_id, bucket), set())):
+                # The instance leaves the bucket with its last result
+                instance_field = f"instance_counts.{instance_key(instance_id)}"
+                operations.append(UpdateOne(
+                    {"activity_id": activity_id, "bucket": bucket, instance_field: 0},
+                    {"$pull": {"instance_ids": instance_id}, "$unset": {instance_field: ""}}
+                ))
+        
+        if operations:
+            record_upstream_call("mongodb")
+            await self.collection.bulk_write(operations, ordered=True)
+    
+    async def find_by_activity(
+        self,
+        activity_id: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the day documents of an activity, optionally within [since, until] (YYYY-MM-DD)
+        """
+        record_upstream_call("mongodb")
+        query: Dict[str, Any] = {"activity_id": activity_id}
+        if since or until:
+            query["bucket"] = {}
+            if since:
+                query["bucket"]["$gte"] = since
+            if until:
+                query["bucket"]["$lte"] = until
+        
+        cursor = self.collection.find(query, {"_id": 0}).sort("bucket", ASCENDING)
+        return [document async for document in cursor]
+    
+    async def find_versions(self, activity_id: str, since: str) -> Dict[str, Optional[int]]:
+        """
+        Get the version of each day document of an activity from since (YYYY-MM-DD) on
+        
+        Documents written before versions existed map to None.
+        """
+        record_upstream_call("mongodb")
+        cursor = self.collection.find(
+            {"activity_id": activity_id, "bucket": {"$gte": since}},
+            {"_id": 0, "bucket": 1, "version": 1}
+        )
+        return {document["bucket"]: document.get("version") async for document in cursor}
+    
+    async def find_activity_ids(self, since: str) -> List[str]:
+        """
+        Get every activity with a day document from since (YYYY-MM-DD) on
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct("activity_id", {"bucket": {"$gte": since}})
+    
+    async def replace_bucket(
+        self,
+        activity_id: str,
+        bucket: str,
+        rows: List[Dict[str, Any]],
+        version: Optional[int]
+    ) -> bool:
+        """
+        Rewrite a day document from all the stored results it counts, if its
+        version is still the one read before the results were
+        
+        Each row is a stored analytics document (instance_id, metrics).
+        Returns False when a change was applied meanwhile; the document is
+        then left for the next reconciliation.
+        """
+        document: Dict[str, Any] = {
+            "activity_id": activity_id,
+            "bucket": bucket,
+            "result_count": 0,
+            "pass_count": 0,
+            "final_score_sum": 0.0,
+            "total_time_seconds_sum": 0.0,
+            "attempts_histogram": {},
+            "instance_counts": {}
+        }
+        for row in rows:
+            for field, value in rollup_increments(row["metrics"], 1).items():
+                if "." in field:
+                    histogram, key = field.split(".", 1)
+                    document[histogram][key] = document[histogram].get(key, 0) + value
+                else:
+                    document[field] += value
+            counts = document["instance_counts"]
+            key = instance_key(row["instance_id"])
+            counts[key] = counts.get(key, 0) + 1
+        document["instance_ids"] = sorted({row["instance_id"] for row in rows})
+        document["version"] = (version or 0) + 1
+        document["reconciled_at"] = datetime.utcnow()
+        
+        query: Dict[str, Any] = {"activity_id": activity_id, "bucket": bucket}
+        query["version"] = version if version is not None else {"$exists": False}
+        
+        record_upstream_call("mongodb")
+        if not rows:
+            result = await self.collection.delete_one(query)
+            return version is None or result.deleted_count == 1
+        try:
+            result = await self.collection.replace_one(query, document, upsert=version is None)
+        except DuplicateKeyError:
+            # Created by a concurrent change since the versions were read
+            return False
+        return result.matched_count == 1 or result.upserted_id is not None
@@ -0,0 +1,171 @@
+"""
+Repository for materialized per-instance summaries of stored student results
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from app.logging_config import record_upstream_call
+
+
+def score_key(final_score: float) -> str:
+    """
+    Histogram key of a final score, in basis points (field names cannot contain dots)
+    """
+    return str(round(final_score * 10000))
+
+
+def summary_increments(metrics: Dict[str, Any], sign: int) -> Dict[str, float]:
+    """
+    Counter increments contributed by one student's result (sign -1 removes it)
+    """
+    return {
+        "student_count": sign,
+        "pass_count": sign if metrics["activity_success"] else 0,
+        "final_score_sum": sign * metrics["final_score"],
+        "total_time_seconds_sum": sign * metrics["total_time_seconds"],
+        f"attempts_histogram.{metrics['total_attempts']}": sign,
+        f"score_histogram.{score_key(metrics['final_score'])}": sign
+    }
+
+
+class InstanceSummaryRepository:
+    """
+    Repository for per-instance counters, one document per instance
+    
+    Counters are sums, so a student's result is added and removed with $inc
+    as it is saved, replaced or deleted. Results removed without going
+    through the repository (TTL expiry) and lost updates are corrected by
+    the reconciliation job, which rewrites the counters from the results.
+    Every change bumps version, and a rewrite only replaces the version it
+    read before the results, so changes made meanwhile are never lost.
+    """
+    
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database["instanceSummaries"]
+    
+    async def ensure_indexes(self):
+        """
+        Create the indexes required by the summary queries
+        """
+        record_upstream_call("mongodb")
+        await self.collection.create_index("instance_id", name="instance_id", unique=True)
+    
+    async def apply_changes(self, changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        """
+        Move students' contributions from their previous results to the current ones
+        
+        Each change is a (previous, current) pair of stored analytics
+        documents (instance_id, metrics, calculated_at) or None. The
+        increments are summed per instance and applied in one bulk write.
+        """
+        updates: Dict[str, Dict[str, Any]] = {}
+        for previous, current in changes:
+            instance_id = (current or previous or {}).get("instance_id")
+            if instance_id is None:
+                continue
+            
+            update = updates.setdefault(instance_id, {"$inc": {"version": 1}})
+            increments = update["$inc"]
+            for document, sign in ((previous, -1), (current, 1)):
+                if not document:
+                    continue
+                for field, value in summary_increments(document["metrics"], sign).items():
+                    increments[field] = increments.get(field, 0) + value
+            
+            if current:
+                calculated_at = current["calculated_at"]
+                first = update.setdefault("$min", {}).get("first_calculated_at")
+                last = update.setdefault("$max", {}).get("last_calculated_at")
+                update["$min"]["first_calculated_at"] = min(first or calculated_at, calculated_at)
+                update["$max"]["last_calculated_at"] = max(last or calculated_at, calculated_at)
+        
+        if updates:
+            record_upstream_call("mongodb")
+            await self.collection.bulk_write([
+                UpdateOne({"instance_id": instance_id}, update, upsert=True)
+                for instance_id, update in updates.items()
+            ], ordered=False)
+    
+    async def find_by_instance(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the counters of an instance
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.find_one({"instance_id": instance_id}, {"_id": 0})
+    
+    async def get_version(self, instance_id: str) -> Optional[int]:
+        """
+        Get only the version of an instance's counters, bumped by every change
+        """
+        record_upstream_call("mongodb")
+        document = await self.collection.find_one({"instance_id": instance_id}, {"_id": 0, "version": 1})
+        return document.get("version") if document else None
+    
+    async def replace(
+        self,
+        instance_id: str,
+        rows: List[Dict[str, Any]],
+        version: Optional[int]
+    ) -> bool:
+        """
+        Rewrite the counters of an instance from all its stored results, if
+        its version is still the one read before the results were (None
+        when there was no summary or it predates versions)
+        
+        Each row holds the "metrics" and "calculated_at" of one student.
+        The summary is removed when there are none. Returns False when a
+        change was applied meanwhile and nothing was written.
+        """
+        query: Dict[str, Any] = {"instance_id": instance_id}
+        query["version"] = version if version is not None else {"$exists": False}
+        
+        record_upstream_call("mongodb")
+        if not rows:
+            result = await self.collection.delete_one(query)
+            return version is None or result.deleted_count == 1
+        
+        document: Dict[str, Any] = {"instance_id": instance_id}
+        for row in rows:
+            for field, value in summary_increments(row["metrics"], 1).items():
+                if "." in field:
+                    histogram, key = field.split(".", 1)
+                    counts = document.setdefault(histogram, {})
+                    counts[key] = counts.get(key, 0) + value
+                else:
+                    document[field] = document.get(field, 0) + value
+        
+        calculated = sorted(row["calculated_at"] for row in rows if row.get("calculated_at"))
+        document["first_calculated_at"] = calculated[0] if calculated else None
+        document["last_calculated_at"] = calculated[-1] if calculated else None
+        document["reconciled_at"] = datetime.utcnow()
+        document["version"] = (version or 0) + 1
+        
+        try:
+            result = await self.collection.replace_one(query, document, upsert=version is None)
+        except DuplicateKeyError:
+            # Created by a concurrent change since the version was read
+            return False
+        return result.matched_count == 1 or result.upserted_id is not None
+    
+    async def mark_unreconciled(self, instance_id: str):
+        """
+        Have the summary rewritten from the stored results on its next read
+        """
+        record_upstream_call("mongodb")
+        await self.collection.update_one(
+            {"instance_id": instance_id},
+            {"$unset": {"reconciled_at": ""}, "$inc": {"version": 1}}
+        )
+    
+    async def delete_by_instance(self, instance_id: str):
+        record_upstream_call("mongodb")
+        await self.collection.delete_one({"instance_id": instance_id})
+    
+    async def find_instance_ids(self) -> List[str]:
+        """
+        Get every instance with a summary
+        """
+        record_upstream_call("mongodb")
+        return await self.collection.distinct("instance_id")
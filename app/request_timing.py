@@ -0,0 +1,63 @@
+"""
+Per-request stage timeline exposed through the Server-Timing header
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+import os
+import time
+from app.logging_config import get_request_context
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# Allow clients to request the timeline in the response body with X-Debug-Timing: 1
+SERVER_TIMING_DEBUG_ENABLED = os.getenv("SERVER_TIMING_DEBUG_ENABLED", "false").lower() == "true"
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Time a stage of the current request (no-op outside a request)
+    """
+    context = get_request_context()
+    if context is None or not SERVER_TIMING_ENABLED:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        context.add_timing(name, (time.perf_counter() - start) * 1000)
+
+
+def server_timing_header(total_ms: float) -> Optional[str]:
+    """
+    Render the current request's timeline as a Server-Timing header value
+    """
+    context = get_request_context()
+    if context is None or not SERVER_TIMING_ENABLED:
+        return None
+    
+    entries = []
+    for name, (duration_ms, count) in context.timings.items():
+        entry = f"{name};dur={duration_ms:.2f}"
+        if count > 1:
+            entry += f';desc="{count} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={total_ms:.2f}")
+    
+    return ", ".join(entries)
+
+
+def debug_timing_block() -> Optional[Dict[str, Any]]:
+    """
+    Timeline recorded so far, when the client asked for it in the body
+    """
+    context = get_request_context()
+    if context is None or not context.debug_timing:
+        return None
+    
+    return {
+        name: {"duration_ms": round(duration_ms, 2), "count": count}
+        for name, (duration_ms, count) in context.timings.items()
+    }
@@ -0,0 +1,94 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from app.database.mongodb import get_database
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.archive_repository import AnalyticsArchiveRepository
+from app.repositories.rollup_repository import ActivityRollupRepository
+from app.services.retention_service import RetentionService
+from app.services.summary_service import InstanceSummaryService
+from app.services.rollup_service import RollupReconciliationService, ROLLUP_RECONCILE_DAYS
+from app.routers.admission import AdmissionController, get_admission_controller
+from app.routers.analytics import get_summary_service
+
+router = APIRouter()
+
+# Dependency injection helpers
+def get_retention_service():
+    db = get_database()
+    return RetentionService(AnalyticsMetricsRepository(db), AnalyticsArchiveRepository(db))
+
+def get_rollup_reconciliation_service():
+    db = get_database()
+    return RollupReconciliationService(AnalyticsMetricsRepository(db), ActivityRollupRepository(db))
+
+
+@router.get("/storage")
+async def get_storage_report(
+    retention_service: RetentionService = Depends(get_retention_service)
+):
+    """
+    Report document count, data size and index footprint of the analytics
+    and archive collections, together with the retention settings.
+    """
+    try:
+        return await retention_service.storage_report()
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving storage report: {str(e)}")
+
+
+@router.post("/retention/archive")
+async def run_retention_archive(
+    retention_service: RetentionService = Depends(get_retention_service)
+):
+    """
+    Archive instances whose results expire within ANALYTICS_ARCHIVE_LEAD_HOURS
+    into per-instance summaries and remove their per-student documents.
+    The lead time is not a parameter, since archived results are deleted.
+    """
+    try:
+        return await retention_service.archive_expiring()
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error archiving instances: {str(e)}")
+
+
+@router.post("/summaries/reconcile")
+async def reconcile_instance_summaries(
+    summary_service: InstanceSummaryService = Depends(get_summary_service)
+):
+    """
+    Rewrite every instance summary from the stored results now, correcting
+    drift of the incrementally maintained counters.
+    """
+    try:
+        return await summary_service.reconcile_all()
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reconciling instance summaries: {str(e)}")
+
+
+@router.post("/rollups/reconcile")
+async def reconcile_activity_rollups(
+    days: int = Query(ROLLUP_RECONCILE_DAYS, ge=0, description="Rebuild the day documents of this many past days"),
+    reconciliation_service: RollupReconciliationService = Depends(get_rollup_reconciliation_service)
+):
+    """
+    Rebuild recent activity rollup day documents from the stored results now,
+    correcting changes lost between a result write and its rollup update.
+    """
+    try:
+        return await reconciliation_service.reconcile_recent(days)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reconciling activity rollups: {str(e)}")
+
+
+@router.get("/admission")
+async def get_admission_stats(
+    admission: AdmissionController = Depends(get_admission_controller)
+):
+    """
+    Report the concurrency, active, queued and shed request counts of each
+    admission budget in this worker.
+    """
+    return {"budgets": admission.stats()}
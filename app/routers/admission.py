@@ -0,0 +1,265 @@
+"""
+Admission control for analytics requests
+
+Requests are admitted against one of three concurrency budgets, so a burst
+of expensive recalculations cannot take the capacity needed by cheap reads:
+
+- read: stored results, revalidation, warm instances
+- student_recompute: recalculating one student from the Activity API
+- instance_recompute: recalculating every student of an instance
+
+Each budget queues requests beyond its concurrency up to a maximum queue
+length, and each queued request waits at most the budget's deadline. Excess
+requests are shed with 503 and a Retry-After estimate. Recomputations can
+additionally be rate limited per client with a token bucket.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request
+from typing import Dict, Optional
+import asyncio
+import ipaddress
+import logging
+import math
+import os
+import time
+from app.request_timing import timed
+
+logger = logging.getLogger(__name__)
+
+READ = "read"
+STUDENT_RECOMPUTE = "student_recompute"
+INSTANCE_RECOMPUTE = "instance_recompute"
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+
+# Recomputations per second allowed per client; 0 disables the token bucket
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "5"))
+
+# Header identifying the client, set by a trusted proxy or auth gateway. It
+# is only honoured on requests from ADMISSION_TRUSTED_PROXIES (comma-separated
+# addresses or networks); other clients are identified by their peer address
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-Client-ID")
+ADMISSION_TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",")
+    if network.strip()
+]
+
+MAX_TRACKED_CLIENTS = 10000
+
+
+def _budget_setting(budget: str, name: str, default: str) -> float:
+    return float(os.getenv(f"ADMISSION_{budget.upper()}_{name}", default))
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; carries the suggested retry delay"""
+    
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionBudget:
+    """
+    Concurrency limit with a bounded queue and a queueing deadline
+    """
+    
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout_seconds: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        # Moving average of the time a request holds a slot
+        self.average_duration_seconds = 1.0
+    
+    def retry_after(self) -> int:
+        """
+        Seconds until the queue ahead of a new request is expected to drain
+        """
+        backlog = (self.waiting + self.active + 1) / self.concurrency
+        return max(1, math.ceil(backlog * self.average_duration_seconds))
+    
+    @asynccontextmanager
+    async def admit(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_size:
+                self.shed += 1
+                raise Overloaded(f"{self.name} queue full", self.retry_after())
+            
+            self.waiting += 1
+            try:
+                with timed("queue"):
+                    await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout_seconds)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                raise Overloaded(f"{self.name} queue deadline exceeded", self.retry_after())
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        
+        self.active += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            duration = time.monotonic() - start
+            self.average_duration_seconds = 0.8 * self.average_duration_seconds + 0.2 * duration
+    
+    def stats(self) -> Dict[str, float]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "shed": self.shed
+        }
+
+
+class TokenBucket:
+    """Per-client token buckets refilled at a constant rate"""
+    
+    def __init__(self, rate: float, burst: float, max_clients: int = MAX_TRACKED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> (tokens, last refill)
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def take(self, client_id: str, cost: float = 1.0) -> Optional[int]:
+        """
+        Take tokens for a request; returns None when allowed, otherwise the
+        seconds until enough tokens are available
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        
+        self._buckets[client_id] = (tokens, now)
+        self._buckets.move_to_end(client_id)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        
+        if allowed:
+            return None
+        return max(1, math.ceil((cost - tokens) / self.rate))
+
+
+class AdmissionController:
+    """Routes requests to their budget and applies the per-client limit"""
+    
+    def __init__(self, budgets: Dict[str, AdmissionBudget], client_limit: Optional[TokenBucket] = None):
+        self.budgets = budgets
+        self.client_limit = client_limit
+    
+    @asynccontextmanager
+    async def admit(self, budget_name: str, client_id: Optional[str] = None):
+        """
+        Hold a slot of the budget for the duration of the block
+        
+        Raises HTTPException(503) with Retry-After when the request is shed.
+        Budgets that are not configured are unlimited.
+        """
+        if budget_name not in self.budgets:
+            yield
+            return
+        
+        try:
+            if self.client_limit is not None and client_id and budget_name != READ:
+                retry_after = self.client_limit.take(client_id)
+                if retry_after is not None:
+                    raise Overloaded("client rate limit exceeded", retry_after)
+            
+            async with self.budgets[budget_name].admit():
+                yield
+        
+        except Overloaded as e:
+            logger.warning("Request shed", extra={"fields": {
+                "budget": budget_name,
+                "client_id": client_id,
+                "reason": e.reason,
+                "retry_after": e.retry_after
+            }})
+            raise HTTPException(
+                status_code=503,
+                detail=f"Service overloaded ({e.reason}), retry later",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: budget.stats() for name, budget in self.budgets.items()}
+
+
+def build_admission_controller() -> AdmissionController:
+    """
+    Create a controller from the ADMISSION_* environment settings
+    """
+    defaults = {
+        READ: ("64", "256", "2"),
+        STUDENT_RECOMPUTE: ("8", "32", "5"),
+        INSTANCE_RECOMPUTE: ("2", "8", "10")
+    }
+    budgets = {
+        name: AdmissionBudget(
+            name,
+            concurrency=int(_budget_setting(name, "CONCURRENCY", concurrency)),
+            queue_size=int(_budget_setting(name, "QUEUE", queue_size)),
+            queue_timeout_seconds=_budget_setting(name, "TIMEOUT_SECONDS", timeout)
+        )
+        for name, (concurrency, queue_size, timeout) in defaults.items()
+    }
+    client_limit = None
+    if ADMISSION_CLIENT_RATE > 0:
+        client_limit = TokenBucket(ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST)
+    return AdmissionController(budgets, client_limit)
+
+
+# Global controller for this worker
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Get the worker's admission controller, created on first use
+    """
+    global _controller
+    if _controller is None:
+        _controller = build_admission_controller() if ADMISSION_CONTROL_ENABLED else AdmissionController({})
+    return _controller
+
+
+def get_client_id(request: Request) -> Optional[str]:
+    """
+    Dependency identifying the client for per-client rate limiting
+    
+    The client header can be set by any caller, so it is only trusted when
+    the peer is a trusted proxy; otherwise the peer address is the identity.
+    """
+    peer = request.client.host if request.client else None
+    if peer is not None and _is_trusted_proxy(peer):
+        header = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if header:
+            return header
+    return peer
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in ADMISSION_TRUSTED_PROXIES)
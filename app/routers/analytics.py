@@ -1,12 +1,43 @@
-from fastapi import APIRouter, Path, HTTPException, Depends, Body, Query
-from datetime import datetime
-from typing import List
+from fastapi import APIRouter, Path, HTTPException, Depends, Body, Query, Header
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from datetime import datetime, timedelta
+from typing import List, Optional
 from app.database.mongodb import get_database
 from app.repositories.contract_repository import AnalyticsContractRepository
 from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.regrade_job_repository import RegradeJobRepository
+from app.repositories.rollup_repository import ActivityRollupRepository
+from app.repositories.item_analysis_repository import ItemAnalysisRepository
+from app.repositories.summary_repository import InstanceSummaryRepository
+from app.repositories.archive_repository import AnalyticsArchiveRepository
 from app.clients.activity_client import ActivityClient
+from app.clients.mirrored_activity_client import MIRROR_ENABLED, MIRROR_OFFLINE, MirroredActivityClient
+from app.repositories.mirror_repository import ActivityMirrorRepository
 from app.services.analytics_service import AnalyticsCalculationService
-from app.models.schemas import MetricDefinition, AnalyticsContract
+from app.services.precompute_scheduler import get_precompute_scheduler
+from app.services.regrade_service import RegradeService, start_regrade_job
+from app.services.rollup_service import merge_rollups, bucket_rollups
+from app.services.summary_service import InstanceSummaryService
+from app.services.metrics_events import MetricsEventBroker, get_metrics_broker, stream_events
+from app.models.schemas import MetricDefinition, AnalyticsContract, RegradeJob
+from app.routers.http_cache import (
+    INSTANCE_FRESHNESS_SECONDS,
+    make_etag,
+    etag_matches,
+    cache_headers,
+    not_modified
+)
+from app.routers.negotiation import Representation, negotiate_representation, render
+from app.routers.admission import (
+    READ,
+    STUDENT_RECOMPUTE,
+    INSTANCE_RECOMPUTE,
+    AdmissionController,
+    get_admission_controller,
+    get_client_id
+)
+from app.request_timing import timed
 
 router = APIRouter()
 
@@ -19,37 +50,131 @@ def get_metrics_repository():
     db = get_database()
     return AnalyticsMetricsRepository(db)
 
-def get_activity_client():
-    return ActivityClient()
+def get_rollup_repository():
+    db = get_database()
+    return ActivityRollupRepository(db)
+
+def get_item_analysis_repository():
+    db = get_database()
+    return ItemAnalysisRepository(db)
+
+def get_regrade_job_repository():
+    db = get_database()
+    return RegradeJobRepository(db)
+
+def get_summary_service():
+    db = get_database()
+    return InstanceSummaryService(
+        AnalyticsMetricsRepository(db),
+        InstanceSummaryRepository(db),
+        AnalyticsArchiveRepository(db)
+    )
+
+def build_activity_client(offline: bool = False, **mirror_options):
+    if not MIRROR_ENABLED:
+        if offline or MIRROR_OFFLINE:
+            raise ValueError("Offline recomputation needs the Activity API mirror, which is disabled (MIRROR_ENABLED=false)")
+        return ActivityClient()
+    return MirroredActivityClient(
+        ActivityClient(),
+        ActivityMirrorRepository(get_database()),
+        offline=offline or MIRROR_OFFLINE,
+        **mirror_options
+    )
+
+def get_activity_client(
+    offline: bool = Query(False, description="Recompute from the local mirror only, without calling the Activity API")
+):
+    try:
+        return build_activity_client(offline)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 def get_analytics_service(
     activity_client: ActivityClient = Depends(get_activity_client),
-    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository)
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository),
+    item_analysis_repository: ItemAnalysisRepository = Depends(get_item_analysis_repository)
 ):
-    return AnalyticsCalculationService(activity_client, metrics_repository)
+    return AnalyticsCalculationService(
+        activity_client,
+        metrics_repository,
+        get_precompute_scheduler(),
+        item_analysis_repository
+    )
+
+def build_regrade_service():
+    db = get_database()
+    metrics_repository = AnalyticsMetricsRepository(db)
+    # Regrades always fetch the latest activity configuration (falling back to
+    # the mirrored one); instances and submissions are read through the mirror
+    return RegradeService(
+        build_activity_client(config_max_age_seconds=0),
+        metrics_repository,
+        RegradeJobRepository(db),
+        AnalyticsCalculationService(
+            build_activity_client(),
+            metrics_repository,
+            get_precompute_scheduler(),
+            ItemAnalysisRepository(db)
+        )
+    )
+
+def get_regrade_service():
+    return build_regrade_service()
+
+
+def _instance_budget(instance_id: str, force_recalculate: bool) -> str:
+    """
+    Admission budget of an instance request: warm instances are served from storage
+    """
+    scheduler = get_precompute_scheduler()
+    if not force_recalculate and scheduler is not None and scheduler.is_warm(instance_id):
+        return READ
+    return INSTANCE_RECOMPUTE
+
+
+def _regrade_job_response(job: RegradeJob) -> dict:
+    total = len(job.instance_ids)
+    completed = len(job.completed_instances)
+    return {
+        **job.model_dump(),
+        "progress": {
+            "instances_total": total,
+            "instances_completed": completed,
+            "percent": round(100 * completed / total, 1) if total else 100.0
+        }
+    }
 
 
 @router.get("/contract")
 async def get_analytics_contract(
+    if_none_match: Optional[str] = Header(None),
+    representation: Representation = Depends(negotiate_representation),
     contract_repo: AnalyticsContractRepository = Depends(get_contract_repository)
 ):
     """
     Get the analytics contract listing all supported qualitative and quantitative metrics.
     """
-    # Get the current analytics contract
-    contract = await contract_repo.get_current()
+    # The contract version is the id of the latest contract document, read
+    # with it so the ETag always describes the body it is sent with
+    current = await contract_repo.get_current_with_version()
     
-    if not contract:
+    if not current:
         raise HTTPException(
             status_code=404,
             detail="No analytics contract found. Please create one using POST /api/v1/analytics/contract"
         )
     
+    version, contract = current
+    etag = make_etag("contract", version, representation.key)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, shared=True)
+    
     # Format response to match expected structure
-    return {
+    return render(representation, {
         "qualAnalytics": [metric.model_dump() for metric in contract.qualitative],
         "quantAnalytics": [metric.model_dump() for metric in contract.quantitative]
-    }
+    }, cache_headers(etag, shared=True))
 
 
 @router.post("/contract")
@@ -86,16 +211,56 @@ async def create_analytics_contract(
 async def get_instance_metrics(
     instance_id: str = Path(..., description="The instance ID to retrieve metrics for"),
     force_recalculate: bool = Query(False, description="Force recalculation of metrics, ignoring cache"),
-    analytics_service: AnalyticsCalculationService = Depends(get_analytics_service)
+    if_none_match: Optional[str] = Header(None),
+    representation: Representation = Depends(negotiate_representation),
+    analytics_service: AnalyticsCalculationService = Depends(get_analytics_service),
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository),
+    admission: AdmissionController = Depends(get_admission_controller),
+    client_id: Optional[str] = Depends(get_client_id)
 ):
     """
     Get analytics metrics for all students in an activity instance.
     Returns cached metrics for all students who have submitted.
+    A conditional request is answered with 304 while the stored results are fresh.
+    Answers 503 with Retry-After when the recalculation capacity is exhausted.
     """
     try:
-        metrics_list = await analytics_service.calculate_instance_metrics(instance_id, force_recalculate)
+        # Read once, before the results: an ETag older than the body only
+        # costs the next request a full response, a newer one would hide it
+        async with admission.admit(READ, client_id):
+            with timed("revalidation"):
+                version = await metrics_repository.get_instance_version(instance_id)
         
-        return {
+        if if_none_match and not force_recalculate:
+            if version:
+                count, latest = version
+                etag = make_etag("instance", instance_id, count, latest.isoformat(), representation.key)
+                # Unchanged recalculations are not written, so results recomputed
+                # by the precompute scheduler count as fresh too
+                scheduler = get_precompute_scheduler()
+                if scheduler is not None:
+                    scheduler.touch(instance_id)
+                is_fresh = (
+                    datetime.utcnow() - latest < timedelta(seconds=INSTANCE_FRESHNESS_SECONDS)
+                    or (scheduler is not None and scheduler.is_warm(instance_id))
+                )
+                if is_fresh and etag_matches(if_none_match, etag):
+                    return not_modified(etag)
+        
+        async with admission.admit(_instance_budget(instance_id, force_recalculate), client_id):
+            metrics_list = await analytics_service.calculate_instance_metrics(instance_id, force_recalculate, track=True)
+        
+        headers = {}
+        if version is None:
+            # First results of the instance, written by this request
+            version = await metrics_repository.get_instance_version(instance_id)
+        if version:
+            count, latest = version
+            headers = cache_headers(
+                make_etag("instance", instance_id, count, latest.isoformat(), representation.key)
+            )
+        
+        return render(representation, {
             "instance_id": instance_id,
             "count": len(metrics_list),
             "students": [
@@ -107,8 +272,10 @@ async def get_instance_metrics(
                 }
                 for metrics in metrics_list
             ]
-        }
+        }, headers)
     
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -120,24 +287,319 @@ async def get_student_metrics(
     instance_id: str = Path(..., description="The instance ID to retrieve metrics for"),
     student_id: str = Path(..., description="The student ID to retrieve metrics for"),
     force_recalculate: bool = Query(False, description="Force recalculation of metrics, ignoring cache"),
-    analytics_service: AnalyticsCalculationService = Depends(get_analytics_service)
+    if_none_match: Optional[str] = Header(None),
+    representation: Representation = Depends(negotiate_representation),
+    analytics_service: AnalyticsCalculationService = Depends(get_analytics_service),
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository),
+    summary_service: InstanceSummaryService = Depends(get_summary_service),
+    admission: AdmissionController = Depends(get_admission_controller),
+    client_id: Optional[str] = Depends(get_client_id)
 ):
     """
     Get analytics metrics for a specific student in an activity instance.
     Calculates metrics on-demand from submission data.
+    Answers 503 with Retry-After when the recalculation capacity is exhausted.
     """
     try:
-        metrics = await analytics_service.calculate_metrics(instance_id, student_id, force_recalculate)
+        calculated_at = None
+        if not force_recalculate:
+            # Stored results are cheap reads; only a missing result needs the Activity API
+            async with admission.admit(READ, client_id):
+                with timed("revalidation" if if_none_match else "cache"):
+                    calculated_at = await metrics_repository.get_calculated_at(instance_id, student_id)
+                    if calculated_at and if_none_match:
+                        # The summary version changes with every result of the
+                        # instance, and so does the cohort standing
+                        version = await summary_service.summary_repository.get_version(instance_id)
+            if calculated_at and if_none_match:
+                etag = make_etag("student", instance_id, student_id, calculated_at, version, representation.key)
+                if etag_matches(if_none_match, etag):
+                    return not_modified(etag)
         
-        return {
+        async with admission.admit(READ if calculated_at else STUDENT_RECOMPUTE, client_id):
+            metrics = await analytics_service.calculate_metrics(instance_id, student_id, force_recalculate, track=True)
+        
+        with timed("cohort"):
+            cohort, version = await summary_service.get_cohort_rank(instance_id, metrics.metrics.final_score)
+        etag = make_etag("student", instance_id, student_id, metrics.calculated_at, version, representation.key)
+        
+        return render(representation, {
             "instance_id": metrics.instance_id,
             "student_id": metrics.student_id,
             "metrics": metrics.metrics.model_dump(),
             "qualitative": metrics.qualitative.model_dump(),
+            "cohort": cohort.model_dump() if cohort else None,
             "calculated_at": metrics.calculated_at
-        }
+        }, cache_headers(etag))
     
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating metrics: {str(e)}")
+
+
+@router.get("/students/{student_id}/metrics")
+async def get_student_metrics_across_instances(
+    student_id: str = Path(..., description="The student ID to retrieve metrics for"),
+    skip: int = Query(0, ge=0, description="Number of results to skip"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of results to return"),
+    quantitative_only: bool = Query(False, description="Omit the qualitative metrics"),
+    order: str = Query("desc", pattern="^(asc|desc)$", description="Sort by calculated_at, newest (desc) or oldest (asc) first"),
+    representation: Representation = Depends(negotiate_representation),
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository)
+):
+    """
+    Get the stored metrics of a student across all instances, ordered by calculation time.
+    Only results already calculated are returned; nothing is recalculated.
+    """
+    try:
+        with timed("cache"):
+            total, results = await metrics_repository.find_by_student(
+                student_id, skip, limit, quantitative_only, ascending=order == "asc"
+            )
+        
+        return render(representation, {
+            "student_id": student_id,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "instances": results
+        })
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving student metrics: {str(e)}")
+
+
+@router.get("/instances/{instance_id}/events")
+async def stream_instance_events(
+    instance_id: str = Path(..., description="The instance ID to follow"),
+    since: Optional[int] = Query(None, ge=0, description="Replay results saved after this event id"),
+    last_event_id: Optional[str] = Header(None),
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository),
+    broker: MetricsEventBroker = Depends(get_metrics_broker)
+):
+    """
+    Server-Sent Events feed of the instance's student metrics, pushed as
+    soon as they are recalculated. Event ids are per-instance sequences;
+    reconnecting with Last-Event-ID (or since) replays the results missed.
+    A comment line is sent as heartbeat while there are no changes.
+    """
+    resume_from = since
+    if last_event_id:
+        if not last_event_id.isdigit():
+            raise HTTPException(status_code=400, detail=f"Invalid Last-Event-ID: {last_event_id}")
+        resume_from = int(last_event_id)
+    
+    subscription = broker.subscribe(instance_id)
+    if subscription is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many live subscribers on this worker, retry later",
+            headers={"Retry-After": "5"}
+        )
+    
+    try:
+        backlog = []
+        if resume_from is not None:
+            backlog = await metrics_repository.find_by_instance_since(instance_id, resume_from)
+    
+    except Exception as e:
+        broker.unsubscribe(subscription)
+        raise HTTPException(status_code=500, detail=f"Error replaying instance events: {str(e)}")
+    
+    return StreamingResponse(
+        stream_events(broker, subscription, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(broker.unsubscribe, subscription)
+    )
+
+
+@router.get("/instances/{instance_id}/item-analysis")
+async def get_item_analysis(
+    instance_id: str = Path(..., description="The instance ID to analyse"),
+    force_recalculate: bool = Query(False, description="Recompute from the current submissions, ignoring the stored analysis"),
+    representation: Representation = Depends(negotiate_representation),
+    analytics_service: AnalyticsCalculationService = Depends(get_analytics_service),
+    admission: AdmissionController = Depends(get_admission_controller),
+    client_id: Optional[str] = Depends(get_client_id)
+):
+    """
+    Get per-exercise difficulty, discrimination index (upper vs lower 27%
+    score group), option-selection distribution and rationale counts.
+    The analysis stored with the last instance recalculation is returned
+    while no student result has been written since.
+    """
+    try:
+        analysis = None
+        if not force_recalculate:
+            async with admission.admit(READ, client_id):
+                with timed("cache"):
+                    analysis = await analytics_service.get_stored_item_analysis(instance_id)
+        
+        if analysis is None:
+            async with admission.admit(INSTANCE_RECOMPUTE, client_id):
+                analysis = await analytics_service.calculate_item_analysis(instance_id)
+        
+        return render(representation, analysis.model_dump())
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error calculating item analysis: {str(e)}")
+
+
+@router.get("/instances/{instance_id}/summary")
+async def get_instance_summary(
+    instance_id: str = Path(..., description="The instance ID to summarize"),
+    representation: Representation = Depends(negotiate_representation),
+    summary_service: InstanceSummaryService = Depends(get_summary_service)
+):
+    """
+    Get the student count, pass rate, mean and median final score, average
+    time and attempt distribution of the stored results of an instance.
+    Read from the instance's summary document, kept up to date on every save;
+    nothing is recalculated.
+    """
+    try:
+        with timed("cache"):
+            summary = await summary_service.get_summary(instance_id)
+        
+        if summary is None:
+            raise HTTPException(status_code=404, detail=f"No results found for instance {instance_id}")
+        
+        return render(representation, summary.model_dump())
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving instance summary: {str(e)}")
+
+
+@router.get("/rationales/search")
+async def search_rationales(
+    q: str = Query(..., min_length=1, description="Text to search for in student answer rationales"),
+    instance_id: Optional[str] = Query(None, description="Restrict the search to a single instance"),
+    skip: int = Query(0, ge=0, description="Number of results to skip"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of results to return"),
+    representation: Representation = Depends(negotiate_representation),
+    metrics_repository: AnalyticsMetricsRepository = Depends(get_metrics_repository)
+):
+    """
+    Search student answer rationales using the text index.
+    Results are ranked by relevance and include matching snippets.
+    """
+    try:
+        total, hits = await metrics_repository.search_rationales(q, instance_id, skip, limit)
+        
+        return render(representation, {
+            "query": q,
+            "instance_id": instance_id,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "results": [hit.model_dump() for hit in hits]
+        })
+    
+    except ValueError as e:
+        # The text index is created at startup; it is missing until that succeeds
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching rationales: {str(e)}")
+
+
+@router.get("/activities/{activity_id}/rollup")
+async def get_activity_rollup(
+    activity_id: str = Path(..., description="The activity to aggregate across instances"),
+    bucket: Optional[str] = Query(None, pattern="^(day|week|month)$", description="Also split the rollup by calculation day, week or month"),
+    since: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="First calculation day to include (YYYY-MM-DD)"),
+    until: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="Last calculation day to include (YYYY-MM-DD)"),
+    representation: Representation = Depends(negotiate_representation),
+    rollup_repository: ActivityRollupRepository = Depends(get_rollup_repository)
+):
+    """
+    Get pass rate, mean score, average time and attempt distribution of the
+    latest results of every student across all instances of an activity.
+    """
+    try:
+        documents = await rollup_repository.find_by_activity(activity_id, since, until)
+        
+        if not documents:
+            raise HTTPException(status_code=404, detail=f"No results found for activity {activity_id}")
+        
+        payload = {
+            "activity_id": activity_id,
+            "since": since,
+            "until": until,
+            "summary": merge_rollups(activity_id, documents).model_dump()
+        }
+        if bucket:
+            payload["bucket"] = bucket
+            payload["buckets"] = [
+                rollup.model_dump() for rollup in bucket_rollups(activity_id, documents, bucket)
+            ]
+        
+        return render(representation, payload)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving activity rollup: {str(e)}")
+
+
+@router.post("/activities/{activity_id}/regrade", status_code=202)
+async def regrade_activity(
+    activity_id: str = Path(..., description="The activity whose stored results should be regraded"),
+    regrade_service: RegradeService = Depends(get_regrade_service)
+):
+    """
+    Start a background job recomputing every stored result of an activity
+    against its current configuration. Returns the job already in progress
+    if there is one.
+    """
+    try:
+        job = await regrade_service.create_job(activity_id)
+        start_regrade_job(job.job_id, build_regrade_service)
+        
+        return _regrade_job_response(job)
+    
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting regrade: {str(e)}")
+
+
+@router.get("/regrade-jobs/{job_id}")
+async def get_regrade_job(
+    job_id: str = Path(..., description="The regrade job ID"),
+    job_repository: RegradeJobRepository = Depends(get_regrade_job_repository)
+):
+    """
+    Get the status and progress of a regrade job.
+    """
+    job = await job_repository.find_by_id(job_id)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Regrade job {job_id} not found")
+    
+    return _regrade_job_response(job)
+
+
+@router.post("/regrade-jobs/{job_id}/cancel")
+async def cancel_regrade_job(
+    job_id: str = Path(..., description="The regrade job ID"),
+    regrade_service: RegradeService = Depends(get_regrade_service)
+):
+    """
+    Cancel a pending or running regrade job. Instances already regraded keep their new results.
+    """
+    job = await regrade_service.cancel_job(job_id)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Regrade job {job_id} not found")
+    
+    return _regrade_job_response(job)
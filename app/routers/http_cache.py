@@ -0,0 +1,67 @@
+"""
+HTTP caching helpers: strong ETags, If-None-Match handling and Cache-Control
+"""
+from fastapi import Response
+from typing import Optional, Dict
+import hashlib
+import os
+
+# Seconds a cache may serve a response without revalidating
+CACHE_MAX_AGE_SECONDS = int(os.getenv("HTTP_CACHE_MAX_AGE", "5"))
+
+# Instance metrics are recalculated on every request; a stored result younger
+# than this is considered current enough to answer a conditional GET with 304
+INSTANCE_FRESHNESS_SECONDS = int(os.getenv("INSTANCE_METRICS_FRESHNESS_SECONDS", "30"))
+
+
+def make_etag(*parts) -> str:
+    """
+    Build a strong ETag from the values identifying a representation
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against the current ETag
+    
+    If-None-Match uses weak comparison, so a W/ prefix sent by an
+    intermediary is ignored.
+    """
+    if not if_none_match:
+        return False
+    
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    
+    return False
+
+
+def cache_headers(etag: str, shared: bool = False) -> Dict[str, str]:
+    """
+    Headers attached to every cacheable analytics response
+    
+    Responses carrying student data may only be stored by the client's own
+    cache; shared=True lets proxies and CDNs store non-personal responses
+    such as the contract.
+    """
+    scope = "public" if shared else "private"
+    return {
+        "ETag": etag,
+        "Cache-Control": f"{scope}, max-age={CACHE_MAX_AGE_SECONDS}, must-revalidate",
+        "Vary": "Accept, Accept-Encoding"
+    }
+
+
+def not_modified(etag: str, shared: bool = False) -> Response:
+    """
+    Empty 304 response carrying the validator headers
+    """
+    return Response(status_code=304, headers=cache_headers(etag, shared))
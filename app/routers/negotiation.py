@@ -0,0 +1,218 @@
+"""
+Content negotiation for analytics responses: media type (JSON, columnar JSON,
+MessagePack) and content encoding (brotli, gzip)
+"""
+from fastapi import Request, Response
+from typing import Any, Dict, List, Optional, Tuple
+from app.request_timing import debug_timing_block, timed
+import gzip
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.mrnewton.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+class Representation:
+    """Negotiated media type and content encoding for a response"""
+    
+    def __init__(self, media_type: str = JSON_MEDIA_TYPE, encoding: Optional[str] = None):
+        self.media_type = media_type
+        self.encoding = encoding
+    
+    @property
+    def key(self) -> str:
+        """Identifies the representation, so ETags differ between variants"""
+        return f"{self.media_type};{self.encoding or 'identity'}"
+
+
+def _parse_header(value: Optional[str]) -> List[Tuple[str, float]]:
+    """
+    Parse an Accept / Accept-Encoding header into (token, q) pairs
+    ordered by preference
+    """
+    if not value:
+        return []
+    
+    entries = []
+    for position, part in enumerate(value.split(",")):
+        fields = [field.strip() for field in part.split(";")]
+        token = fields[0].lower()
+        if not token:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        entries.append((token, q, position))
+    
+    entries.sort(key=lambda entry: (-entry[1], entry[2]))
+    return [(token, q) for token, q, _ in entries]
+
+
+def _available_media_types() -> List[str]:
+    media_types = [JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE]
+    if msgpack is not None:
+        media_types.append(MSGPACK_MEDIA_TYPE)
+    return media_types
+
+
+def _available_encodings() -> List[str]:
+    encodings = ["gzip"]
+    if brotli is not None:
+        encodings.insert(0, "br")
+    return encodings
+
+
+def select_media_type(accept: Optional[str]) -> str:
+    """
+    Pick the preferred supported media type, defaulting to JSON
+    """
+    available = _available_media_types()
+    aliases = {"application/x-msgpack": MSGPACK_MEDIA_TYPE}
+    
+    for token, q in _parse_header(accept):
+        if q <= 0:
+            continue
+        token = aliases.get(token, token)
+        if token in available:
+            return token
+        if token in ("*/*", "application/*"):
+            return JSON_MEDIA_TYPE
+    
+    return JSON_MEDIA_TYPE
+
+
+def select_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the preferred supported content encoding, or None for identity
+    """
+    available = _available_encodings()
+    
+    for token, q in _parse_header(accept_encoding):
+        if q <= 0:
+            continue
+        if token in available:
+            return token
+        if token == "*":
+            return available[0]
+    
+    return None
+
+
+def negotiate_representation(request: Request) -> Representation:
+    """
+    Dependency resolving the response representation from request headers
+    """
+    return Representation(
+        media_type=select_media_type(request.headers.get("accept")),
+        encoding=select_encoding(request.headers.get("accept-encoding"))
+    )
+
+
+def to_columnar(payload: Dict[str, Any], rows_key: str = "students") -> Dict[str, Any]:
+    """
+    Convert a list of row objects into column arrays with keys listed once
+    
+    Nested objects (metrics, qualitative) are flattened to dotted keys.
+    Payloads without a row list are returned unchanged.
+    """
+    rows = payload.get(rows_key)
+    if not isinstance(rows, list):
+        return payload
+    
+    flat_rows = []
+    for row in rows:
+        flat = {}
+        for key, value in row.items():
+            if isinstance(value, dict):
+                for nested_key, nested_value in value.items():
+                    flat[f"{key}.{nested_key}"] = nested_value
+            else:
+                flat[key] = value
+        flat_rows.append(flat)
+    
+    keys: Dict[str, None] = {}
+    for flat in flat_rows:
+        keys.update(dict.fromkeys(flat))
+    
+    columns = {key: [flat.get(key) for flat in flat_rows] for key in keys}
+    
+    columnar = {key: value for key, value in payload.items() if key != rows_key}
+    columnar[rows_key] = columns
+    return columnar
+
+
+def encode_body(payload: Dict[str, Any], media_type: str) -> bytes:
+    """
+    Serialize a payload for the given media type
+    """
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+    
+    if media_type == COLUMNAR_MEDIA_TYPE:
+        payload = to_columnar(payload)
+    
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress_body(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a body if it is above the size threshold
+    """
+    if not encoding or len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+    
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+
+
+def render(
+    representation: Representation,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    status_code: int = 200
+) -> Response:
+    """
+    Build the response for a payload in the negotiated representation
+    """
+    timing = debug_timing_block()
+    if timing is not None:
+        payload = {**payload, "_timing": timing}
+    
+    with timed("serialization"):
+        body = encode_body(payload, representation.media_type)
+        body, applied_encoding = compress_body(body, representation.encoding)
+    
+    response_headers = dict(headers or {})
+    response_headers["Vary"] = "Accept, Accept-Encoding"
+    if applied_encoding:
+        response_headers["Content-Encoding"] = applied_encoding
+    
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type=representation.media_type,
+        headers=response_headers
+    )
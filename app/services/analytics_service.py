@@ -1,8 +1,11 @@
 """
 Service for calculating analytics metrics from submission data
 """
-from datetime import datetime
-from typing import List, Dict
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Set, Tuple
+import hashlib
+import json
+import logging
 from app.models.schemas import (
     Submission,
     Activity,
@@ -10,10 +13,38 @@ from app.models.schemas import (
     QualitativeMetrics,
     AnalyticsMetrics,
     Answer,
-    AttemptResult
+    AttemptResult,
+    DeploymentInstance,
+    InstanceItemAnalysis
 )
 from app.clients.activity_client import ActivityClient
 from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.item_analysis_repository import ItemAnalysisRepository
+from app.services.item_analysis import compute_item_analysis
+from app.services.metrics_events import MetricsEventBroker, get_metrics_broker
+from app.request_timing import timed
+from app.logging_config import record_result_writes
+from app.services.precompute_scheduler import PrecomputeScheduler, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def activity_config_hash(activity: Activity) -> str:
+    """
+    Hash of the activity configuration that scoring depends on
+    
+    Stored with every result so results computed against an outdated
+    answer key or scoring policy can be found and regraded.
+    """
+    config = activity.model_dump(include={
+        "number_of_exercises",
+        "total_time_minutes",
+        "scoring_policy",
+        "approval_threshold",
+        "exercises"
+    })
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
 
 
 class AnalyticsCalculationService:
@@ -24,15 +55,23 @@ class AnalyticsCalculationService:
     def __init__(
         self,
         activity_client: ActivityClient,
-        metrics_repository: AnalyticsMetricsRepository
+        metrics_repository: AnalyticsMetricsRepository,
+        scheduler: Optional[PrecomputeScheduler] = None,
+        item_analysis_repository: Optional[ItemAnalysisRepository] = None,
+        events: Optional[MetricsEventBroker] = None
     ):
         self.activity_client = activity_client
         self.metrics_repository = metrics_repository
+        self.scheduler = scheduler
+        self.item_analysis_repository = item_analysis_repository
+        # Saved results are pushed to the worker's live feed unless another broker is given
+        self.events = events if events is not None else get_metrics_broker()
     
     async def calculate_instance_metrics(
         self,
         instance_id: str,
-        force_recalculate: bool = False
+        force_recalculate: bool = False,
+        track: bool = False
     ) -> List[AnalyticsMetrics]:
         """
         Calculate analytics metrics for all students in an instance
@@ -40,15 +79,27 @@ class AnalyticsCalculationService:
         Args:
             instance_id: The instance ID
             force_recalculate: If True, recalculate even if cached metrics exist
+            track: If True (request paths), keep the instance precomputed
         
         Returns:
             List of AnalyticsMetrics for all students in the instance
         """
+        if track and self.scheduler:
+            self.scheduler.touch(instance_id)
+        
+        # Active instances are kept warm by the precompute scheduler
+        if not force_recalculate and self.scheduler and self.scheduler.is_warm(instance_id):
+            with timed("cache"):
+                return await self.metrics_repository.find_by_instance(instance_id)
+        
         # Fetch instance to verify it exists
         instance = await self.activity_client.get_instance(instance_id)
         if not instance:
             raise ValueError(f"Instance {instance_id} not found")
         
+        if track and self.scheduler:
+            self.scheduler.track(instance)
+        
         # Fetch activity configuration
         activity = await self.activity_client.get_activity(instance.activityId)
         if not activity:
@@ -61,33 +112,84 @@ class AnalyticsCalculationService:
             return []
         
         # Calculate metrics for each student
-        all_metrics = []
-        for submission in submissions:
-            # Calculate quantitative metrics
-            quantitative = self._calculate_quantitative_metrics(submission, activity)
-            qualitative = self._extract_qualitative_metrics(submission)
-            
-            # Create analytics metrics object
-            metrics = AnalyticsMetrics(
-                instance_id=instance_id,
-                student_id=submission.studentId,
-                metrics=quantitative,
-                qualitative=qualitative,
-                calculated_at=datetime.utcnow().isoformat() + "Z"
-            )
-            
-            # Cache the metrics
-            await self.metrics_repository.save(metrics)
-            
-            all_metrics.append(metrics)
+        all_metrics, written = await self._calculate_and_save(instance, activity, submissions)
+        await self._save_item_analysis(instance_id, activity, submissions, results_written=written > 0)
+        
+        if self.scheduler:
+            self.scheduler.mark_computed(instance_id)
         
         return all_metrics
     
+    async def regrade_instance(
+        self,
+        instance_id: str,
+        activity: Activity,
+        activity_hash: str
+    ) -> Dict[str, int]:
+        """
+        Recompute the students of an instance whose stored results were
+        calculated against a different activity configuration
+        
+        Students already at activity_hash are skipped, so re-running a
+        regrade after an interruption only touches the remaining ones.
+        
+        Returns:
+            Counts of students, recomputed and unchanged results
+        """
+        instance = await self.activity_client.get_instance(instance_id)
+        if not instance:
+            raise ValueError(f"Instance {instance_id} not found")
+        
+        submissions = await self.activity_client.get_instance_submissions(instance_id)
+        current: Set[str] = set(
+            await self.metrics_repository.find_student_ids_by_activity_hash(instance_id, activity_hash)
+        )
+        stale = [submission for submission in submissions if submission.studentId not in current]
+        
+        _, written = await self._calculate_and_save(instance, activity, stale, activity_hash)
+        await self._save_item_analysis(instance_id, activity, submissions, results_written=written > 0)
+        
+        return {
+            "students": len(submissions),
+            "recomputed": len(stale),
+            "unchanged": len(submissions) - len(stale)
+        }
+    
+    async def get_stored_item_analysis(self, instance_id: str) -> Optional[InstanceItemAnalysis]:
+        """
+        Get the stored item analysis of an instance if no result was written after it
+        """
+        if self.item_analysis_repository is None:
+            return None
+        
+        version = await self.metrics_repository.get_instance_version(instance_id)
+        if not version:
+            return None
+        
+        return await self.item_analysis_repository.find_current(instance_id, version[1])
+    
+    async def calculate_item_analysis(self, instance_id: str) -> InstanceItemAnalysis:
+        """
+        Compute (and store) the item analysis of an instance from its current submissions
+        """
+        instance = await self.activity_client.get_instance(instance_id)
+        if not instance:
+            raise ValueError(f"Instance {instance_id} not found")
+        
+        activity = await self.activity_client.get_activity(instance.activityId)
+        if not activity:
+            raise ValueError(f"Activity {instance.activityId} not found")
+        
+        submissions = await self.activity_client.get_instance_submissions(instance_id)
+        
+        return await self._save_item_analysis(instance_id, activity, submissions)
+    
     async def calculate_metrics(
         self,
         instance_id: str,
         student_id: str,
-        force_recalculate: bool = False
+        force_recalculate: bool = False,
+        track: bool = False
     ) -> AnalyticsMetrics:
         """
         Calculate analytics metrics for a student's submission
@@ -96,17 +198,21 @@ class AnalyticsCalculationService:
             instance_id: The instance ID
             student_id: The student ID
             force_recalculate: If True, recalculate even if cached metrics exist
+            track: If True (request paths), keep the instance precomputed
         
         Returns:
             AnalyticsMetrics with calculated quantitative and qualitative data
         """
+        if track and self.scheduler:
+            self.scheduler.touch(instance_id)
         
         # Check if we have cached metrics
         if not force_recalculate:
-            cached_metrics = await self.metrics_repository.find_by_instance_and_student(
-                instance_id,
-                student_id
-            )
+            with timed("cache"):
+                cached_metrics = await self.metrics_repository.find_by_instance_and_student(
+                    instance_id,
+                    student_id
+                )
             if cached_metrics:
                 return cached_metrics
         
@@ -120,28 +226,94 @@ class AnalyticsCalculationService:
         if not instance:
             raise ValueError(f"Instance {instance_id} not found")
         
+        if track and self.scheduler:
+            self.scheduler.track(instance)
+        
         # Fetch activity configuration
         activity = await self.activity_client.get_activity(instance.activityId)
         if not activity:
             raise ValueError(f"Activity {instance.activityId} not found")
         
-        # Calculate metrics
-        quantitative = self._calculate_quantitative_metrics(submission, activity)
-        qualitative = self._extract_qualitative_metrics(submission)
-        
-        # Create analytics metrics object
-        metrics = AnalyticsMetrics(
-            instance_id=instance_id,
-            student_id=student_id,
-            metrics=quantitative,
-            qualitative=qualitative,
-            calculated_at=datetime.utcnow().isoformat() + "Z"
-        )
+        # Calculate and cache metrics
+        all_metrics, _ = await self._calculate_and_save(instance, activity, [submission])
+        
+        return all_metrics[0]
+    
+    async def _calculate_and_save(
+        self,
+        instance: DeploymentInstance,
+        activity: Activity,
+        submissions: List[Submission],
+        activity_hash: Optional[str] = None
+    ) -> Tuple[List[AnalyticsMetrics], int]:
+        """
+        Calculate and store the metrics of each submission, returning them
+        as stored and the number of results written
+        """
+        instance_expires_at = self._instance_expiry(instance)
+        activity_hash = activity_hash or activity_config_hash(activity)
+        
+        all_metrics = []
+        for submission in submissions:
+            # Calculate quantitative metrics
+            with timed("scoring"):
+                quantitative = self._calculate_quantitative_metrics(submission, activity)
+                qualitative = self._extract_qualitative_metrics(submission)
+            
+            # Create analytics metrics object
+            all_metrics.append(AnalyticsMetrics(
+                instance_id=instance.instanceId,
+                student_id=submission.studentId,
+                metrics=quantitative,
+                qualitative=qualitative,
+                calculated_at=datetime.utcnow().isoformat() + "Z"
+            ))
+        
+        # Cache the metrics; results identical to the stored ones are not rewritten
+        with timed("persistence"):
+            stored, written = await self.metrics_repository.save_changed(
+                all_metrics,
+                instance_expires_at,
+                activity_id=activity.activity_id,
+                activity_hash=activity_hash
+            )
+        record_result_writes(len(written), len(stored) - len(written))
+        
+        for metrics, sequence in written:
+            self.events.publish(metrics, sequence)
         
-        # Cache the metrics
-        await self.metrics_repository.save(metrics)
+        return stored, len(written)
+    
+    async def _save_item_analysis(
+        self,
+        instance_id: str,
+        activity: Activity,
+        submissions: List[Submission],
+        results_written: bool = True
+    ) -> InstanceItemAnalysis:
+        """
+        Compute the item analysis from submissions already fetched and store it with the instance
         
-        return metrics
+        When no result was written, the stored analysis is still current
+        for get_stored_item_analysis and is only replaced if it differs.
+        """
+        with timed("item_analysis"):
+            analysis = compute_item_analysis(instance_id, activity, submissions)
+        
+        if self.item_analysis_repository is not None:
+            with timed("persistence"):
+                await self.item_analysis_repository.save(analysis, only_if_changed=not results_written)
+        
+        return analysis
+    
+    def _instance_expiry(self, instance: DeploymentInstance) -> Optional[datetime]:
+        """
+        Instance expiresAt as naive UTC, the anchor of the results' retention period
+        """
+        expires_at = parse_timestamp(instance.expiresAt)
+        if expires_at is None:
+            return None
+        return expires_at.astimezone(timezone.utc).replace(tzinfo=None)
     
     def _calculate_quantitative_metrics(
         self,
@@ -256,7 +428,10 @@ class AnalyticsCalculationService:
             return min(int(time_diff), max_time) if max_time > 0 else int(time_diff)
         
         except Exception as e:
-            print(f"Error calculating time: {e}")
+            logger.warning("Error calculating time", extra={"fields": {
+                "submission_id": submission.submissionId,
+                "error": str(e)
+            }})
             # Fallback: estimate based on average
             return activity.total_time_minutes * 60
     
@@ -285,7 +460,10 @@ class AnalyticsCalculationService:
                         correct_count += 1
             
             except (ValueError, IndexError) as e:
-                print(f"Error processing question {question_id}: {e}")
+                logger.warning("Error processing question", extra={"fields": {
+                    "question_id": question_id,
+                    "error": str(e)
+                }})
                 continue
         
         return correct_count
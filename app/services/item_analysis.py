@@ -0,0 +1,107 @@
+"""
+Item analysis: per-exercise difficulty, discrimination, option distribution
+and rationale counts over the latest attempt of each student
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.models.schemas import Activity, InstanceItemAnalysis, ItemAnalysis, Submission
+
+# Share of students in each of the upper and lower groups (Kelley's 27%)
+DISCRIMINATION_GROUP_FRACTION = 0.27
+
+
+def _exercise_index(question_id: str) -> Optional[int]:
+    """
+    Exercise index of an answer key (e.g. "q0" -> 0)
+    """
+    try:
+        return int(question_id.replace("q", ""))
+    except ValueError:
+        return None
+
+
+def compute_item_analysis(
+    instance_id: str,
+    activity: Activity,
+    submissions: List[Submission]
+) -> InstanceItemAnalysis:
+    """
+    Compute the item analysis of an instance in a single pass over the answers
+    
+    Counters are kept in flat per-exercise lists; each student's correct
+    exercises are collected on the way, so the upper and lower groups (by
+    number of correct answers) only need one sort of the students.
+    """
+    exercises = activity.exercises
+    exercise_count = len(exercises)
+    correct_options = [exercise.correct_options for exercise in exercises]
+    
+    responses = [0] * exercise_count
+    correct = [0] * exercise_count
+    rationales = [0] * exercise_count
+    distributions: List[Dict[str, int]] = []
+    for exercise in exercises:
+        # Options given as labels are listed even when nobody selected them
+        labelled = exercise.correct_options in exercise.options
+        distributions.append(dict.fromkeys(exercise.options, 0) if labelled else {})
+    
+    correct_by_student: List[List[int]] = []
+    
+    for submission in submissions:
+        if not submission.attempts:
+            continue
+        
+        student_correct = []
+        for question_id, answer in submission.attempts[-1].answers.items():
+            index = _exercise_index(question_id)
+            if index is None or not 0 <= index < exercise_count:
+                continue
+            
+            responses[index] += 1
+            distribution = distributions[index]
+            distribution[answer.selectedOption] = distribution.get(answer.selectedOption, 0) + 1
+            if answer.selectedOption == correct_options[index]:
+                correct[index] += 1
+                student_correct.append(index)
+            if answer.rationale and answer.rationale.strip():
+                rationales[index] += 1
+        
+        correct_by_student.append(student_correct)
+    
+    student_count = len(correct_by_student)
+    group_size = 0
+    upper = [0] * exercise_count
+    lower = [0] * exercise_count
+    
+    if student_count >= 2:
+        group_size = min(student_count // 2, max(1, round(student_count * DISCRIMINATION_GROUP_FRACTION)))
+        ranked = sorted(correct_by_student, key=len)
+        for student_correct in ranked[:group_size]:
+            for index in student_correct:
+                lower[index] += 1
+        for student_correct in ranked[-group_size:]:
+            for index in student_correct:
+                upper[index] += 1
+    
+    items = [
+        ItemAnalysis(
+            exercise_index=index,
+            question=exercise.question,
+            correct_option=exercise.correct_options,
+            responses=responses[index],
+            difficulty=correct[index] / responses[index] if responses[index] else None,
+            discrimination=(upper[index] - lower[index]) / group_size if group_size else None,
+            option_distribution=distributions[index],
+            rationale_count=rationales[index]
+        )
+        for index, exercise in enumerate(exercises)
+    ]
+    
+    return InstanceItemAnalysis(
+        instance_id=instance_id,
+        activity_id=activity.activity_id,
+        student_count=student_count,
+        group_size=group_size,
+        items=items,
+        calculated_at=datetime.utcnow().isoformat() + "Z"
+    )
@@ -0,0 +1,173 @@
+"""
+Live feed of recalculated student metrics per instance (Server-Sent Events)
+
+Every saved result is published to the worker's broker, which fans it out
+to the subscribers of its instance. An event is serialized once and put on
+each subscriber's bounded queue, so publishing never waits on a slow client;
+a subscriber whose queue overflows is disconnected and resumes with
+Last-Event-ID.
+
+Event ids are the results' event sequences, allocated per instance in
+MongoDB on every save, so a reconnecting client is caught up from MongoDB
+regardless of the worker it reconnects to.
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+from app.models.schemas import AnalyticsMetrics
+
+logger = logging.getLogger(__name__)
+
+METRICS_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("METRICS_EVENTS_HEARTBEAT_SECONDS", "15"))
+METRICS_EVENTS_QUEUE_SIZE = int(os.getenv("METRICS_EVENTS_QUEUE_SIZE", "100"))
+METRICS_EVENTS_MAX_SUBSCRIBERS = int(os.getenv("METRICS_EVENTS_MAX_SUBSCRIBERS", "1000"))
+
+# Reconnection delay suggested to EventSource clients, in milliseconds
+METRICS_EVENTS_RETRY_MS = 3000
+
+
+def format_event(metrics: AnalyticsMetrics, sequence: Optional[int]) -> str:
+    """
+    Render a result as an SSE "metrics" event with its sequence as id
+    """
+    data = json.dumps({
+        "instance_id": metrics.instance_id,
+        "student_id": metrics.student_id,
+        "metrics": metrics.metrics.model_dump(),
+        "qualitative": metrics.qualitative.model_dump(),
+        "calculated_at": metrics.calculated_at
+    }, ensure_ascii=False, separators=(",", ":"))
+    event_id = f"id: {sequence}\n" if sequence is not None else ""
+    return f"{event_id}event: metrics\ndata: {data}\n\n"
+
+
+class Subscription:
+    """A client's queue of pending events for one instance"""
+    
+    def __init__(self, instance_id: str, queue_size: int):
+        self.instance_id = instance_id
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+class MetricsEventBroker:
+    """Per-worker fan-out of saved results to instance subscribers"""
+    
+    def __init__(
+        self,
+        queue_size: int = METRICS_EVENTS_QUEUE_SIZE,
+        max_subscribers: int = METRICS_EVENTS_MAX_SUBSCRIBERS
+    ):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.subscriber_count = 0
+    
+    def subscribe(self, instance_id: str) -> Optional[Subscription]:
+        """
+        Register a subscriber; None when the worker is at its connection limit
+        """
+        if self.subscriber_count >= self.max_subscribers:
+            return None
+        subscription = Subscription(instance_id, self.queue_size)
+        self._subscribers.setdefault(instance_id, set()).add(subscription)
+        self.subscriber_count += 1
+        return subscription
+    
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.instance_id)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        self.subscriber_count -= 1
+        if not subscribers:
+            del self._subscribers[subscription.instance_id]
+    
+    def has_subscribers(self) -> bool:
+        return self.subscriber_count > 0
+    
+    def publish(self, metrics: AnalyticsMetrics, sequence: Optional[int]):
+        """
+        Fan a saved result out to the subscribers of its instance
+        """
+        subscribers = self._subscribers.get(metrics.instance_id)
+        if not subscribers:
+            return
+        
+        event = (sequence, format_event(metrics, sequence))
+        for subscription in subscribers:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Disconnect rather than block; the client resumes from its last event id
+                subscription.overflowed = True
+                subscription.queue.get_nowait()
+                subscription.queue.put_nowait((None, None))
+    
+    def publish_document(self, document: Dict[str, Any]):
+        """
+        Publish a stored analytics document (e.g. from a change stream)
+        """
+        if not self._subscribers.get(document.get("instance_id")):
+            return
+        fields = {key: value for key, value in document.items() if not key.startswith("_")}
+        self.publish(AnalyticsMetrics(**fields), document.get("_seq"))
+
+
+async def stream_events(
+    broker: MetricsEventBroker,
+    subscription: Subscription,
+    backlog: List[Tuple[AnalyticsMetrics, int]],
+    heartbeat_seconds: float = METRICS_EVENTS_HEARTBEAT_SECONDS
+) -> AsyncIterator[str]:
+    """
+    Yield the SSE stream of a subscription: missed results (with their
+    sequence), then live events and heartbeats until the client disconnects
+    or falls behind
+    
+    The subscription must be registered before the backlog is read, so no
+    result saved in between is lost; live events already sent from the
+    backlog are skipped. Live events are not filtered by order, since
+    results from other workers may arrive after later sequences.
+    """
+    try:
+        yield f"retry: {METRICS_EVENTS_RETRY_MS}\n\n"
+        
+        replayed = set()
+        for metrics, sequence in backlog:
+            replayed.add(sequence)
+            yield format_event(metrics, sequence)
+        
+        while True:
+            try:
+                event_id, event = await asyncio.wait_for(subscription.queue.get(), heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            
+            if event is None:
+                logger.info("Event subscriber fell behind, disconnecting", extra={"fields": {
+                    "instance_id": subscription.instance_id
+                }})
+                return
+            if event_id is not None and event_id in replayed:
+                continue
+            yield event
+    
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# Global broker for this worker
+_broker = MetricsEventBroker()
+
+
+def get_metrics_broker() -> MetricsEventBroker:
+    """
+    Get the worker's event broker
+    """
+    return _broker
@@ -0,0 +1,227 @@
+"""
+Background precomputation of metrics for active deployment instances
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+from app.models.schemas import DeploymentInstance
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "true").lower() == "true"
+PRECOMPUTE_INTERVAL_SECONDS = float(os.getenv("PRECOMPUTE_INTERVAL_SECONDS", "60"))
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "2"))
+PRECOMPUTE_MAX_INSTANCES = int(os.getenv("PRECOMPUTE_MAX_INSTANCES", "500"))
+
+# Instances no request has read for this long stop being precomputed
+PRECOMPUTE_IDLE_SECONDS = float(os.getenv("PRECOMPUTE_IDLE_SECONDS", "3600"))
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an Activity API ISO timestamp into an aware UTC datetime
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class PrecomputeScheduler:
+    """
+    Tracks the active instances seen by the service and periodically
+    recomputes their metrics, so dashboards open against warm data.
+    
+    Instances are dropped once their expiresAt has passed, or once no
+    request has read them for idle_seconds; recomputations by the scheduler
+    itself do not count as reads. Results are considered warm for one
+    interval after a successful computation.
+    
+    Every worker runs its own scheduler; when claim is given, an instance is
+    only recomputed by the worker whose claim succeeds for that interval, so
+    an instance tracked by several workers is still recomputed once.
+    """
+    
+    def __init__(
+        self,
+        recompute: Callable[[str], Awaitable[Any]],
+        interval_seconds: float = PRECOMPUTE_INTERVAL_SECONDS,
+        concurrency: int = PRECOMPUTE_CONCURRENCY,
+        max_instances: int = PRECOMPUTE_MAX_INSTANCES,
+        idle_seconds: float = PRECOMPUTE_IDLE_SECONDS,
+        claim: Optional[Callable[[str, float], Awaitable[bool]]] = None
+    ):
+        self.recompute = recompute
+        self.claim = claim
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        self.max_instances = max_instances
+        self.idle_seconds = idle_seconds
+        # instance_id -> expiresAt (None when the instance never expires)
+        self._active: "OrderedDict[str, Optional[datetime]]" = OrderedDict()
+        # instance_id -> monotonic time of the last request reading it
+        self._read_at: Dict[str, float] = {}
+        self._computed_at: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    def track(self, instance: DeploymentInstance):
+        """
+        Register an instance read by a request; expired instances are ignored
+        """
+        expires_at = parse_timestamp(instance.expiresAt)
+        if expires_at is not None and expires_at <= datetime.now(timezone.utc):
+            self.untrack(instance.instanceId)
+            return
+        
+        self._active[instance.instanceId] = expires_at
+        self.touch(instance.instanceId)
+        
+        # Evict the least recently read instances beyond the budget
+        while len(self._active) > self.max_instances:
+            evicted, _ = self._active.popitem(last=False)
+            self._computed_at.pop(evicted, None)
+            self._read_at.pop(evicted, None)
+    
+    def touch(self, instance_id: str):
+        """
+        Record a request reading an instance, if it is tracked
+        """
+        if instance_id in self._active:
+            self._active.move_to_end(instance_id)
+            self._read_at[instance_id] = time.monotonic()
+    
+    def untrack(self, instance_id: str):
+        self._active.pop(instance_id, None)
+        self._computed_at.pop(instance_id, None)
+        self._read_at.pop(instance_id, None)
+    
+    def mark_computed(self, instance_id: str):
+        """
+        Record that the instance's stored metrics were just fully recomputed
+        """
+        if instance_id in self._active:
+            self._computed_at[instance_id] = datetime.now(timezone.utc)
+    
+    def is_warm(self, instance_id: str) -> bool:
+        """
+        Whether the stored metrics of an active instance are at most one interval old
+        """
+        computed_at = self._computed_at.get(instance_id)
+        if computed_at is None or instance_id not in self._active:
+            return False
+        age = (datetime.now(timezone.utc) - computed_at).total_seconds()
+        return age < self.interval_seconds
+    
+    def active_instances(self):
+        """
+        Drop expired and idle instances and return the ids still active
+        """
+        now = datetime.now(timezone.utc)
+        idle_before = time.monotonic() - self.idle_seconds
+        for instance_id, expires_at in list(self._active.items()):
+            if expires_at is not None and expires_at <= now:
+                logger.info("Instance expired, stopping precompute", extra={"fields": {
+                    "instance_id": instance_id
+                }})
+                self.untrack(instance_id)
+            elif self._read_at.get(instance_id, 0.0) < idle_before:
+                logger.info("Instance idle, stopping precompute", extra={"fields": {
+                    "instance_id": instance_id
+                }})
+                self.untrack(instance_id)
+        return list(self._active)
+    
+    async def run_once(self):
+        """
+        Recompute every active instance within the concurrency budget
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def precompute(instance_id: str):
+            async with semaphore:
+                try:
+                    if self.claim is not None and not await self.claim(instance_id, self.interval_seconds):
+                        # Another worker recomputes it this interval
+                        return
+                    await self.recompute(instance_id)
+                    self.mark_computed(instance_id)
+                except ValueError as e:
+                    # Instance or activity no longer exists upstream
+                    logger.warning("Precompute skipped", extra={"fields": {
+                        "instance_id": instance_id,
+                        "error": str(e)
+                    }})
+                    self.untrack(instance_id)
+                except Exception as e:
+                    logger.warning("Precompute failed", extra={"fields": {
+                        "instance_id": instance_id,
+                        "error": str(e)
+                    }})
+        
+        await asyncio.gather(*(precompute(instance_id) for instance_id in self.active_instances()))
+    
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.run_once()
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global scheduler for this worker
+_scheduler: Optional[PrecomputeScheduler] = None
+
+
+def start_precompute_scheduler(
+    recompute: Callable[[str], Awaitable[Any]],
+    claim: Optional[Callable[[str, float], Awaitable[bool]]] = None
+):
+    """
+    Create and start the worker's scheduler (no-op when disabled)
+    """
+    global _scheduler
+    if not PRECOMPUTE_ENABLED or _scheduler is not None:
+        return
+    _scheduler = PrecomputeScheduler(recompute, claim=claim)
+    _scheduler.start()
+    logger.info("Precompute scheduler started", extra={"fields": {
+        "interval_seconds": _scheduler.interval_seconds,
+        "concurrency": _scheduler.concurrency
+    }})
+
+
+async def stop_precompute_scheduler():
+    """
+    Stop the worker's scheduler
+    """
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
+
+
+def get_precompute_scheduler() -> Optional[PrecomputeScheduler]:
+    """
+    Get the running scheduler, if any
+    """
+    return _scheduler
@@ -0,0 +1,276 @@
+"""
+Bulk regrade of stored results after an activity's configuration changes
+"""
+from datetime import datetime
+from typing import Callable, Dict, Optional
+import asyncio
+import logging
+import os
+import uuid
+from app.clients.activity_client import ActivityClient
+from app.models.schemas import RegradeJob
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.regrade_job_repository import ACTIVE_STATUSES, RegradeJobRepository
+from app.services.analytics_service import AnalyticsCalculationService, activity_config_hash
+
+logger = logging.getLogger(__name__)
+
+# Instances regraded at the same time by one job
+REGRADE_CONCURRENCY = int(os.getenv("REGRADE_CONCURRENCY", "2"))
+
+# A job whose worker has not reported progress for this long can be resumed by another worker
+REGRADE_LEASE_SECONDS = float(os.getenv("REGRADE_LEASE_SECONDS", "120"))
+
+
+class RegradeService:
+    """
+    Finds every instance with results for an activity and recomputes the
+    students whose results were computed against another configuration.
+    
+    Progress is persisted per instance; an interrupted job is resumed from
+    the instances not yet completed, and within an instance only students
+    not yet at the target configuration hash are recomputed. Instances that
+    fail stay pending: the job ends as partial and a new regrade request for
+    the activity resumes it to retry them.
+    """
+    
+    def __init__(
+        self,
+        activity_client: ActivityClient,
+        metrics_repository: AnalyticsMetricsRepository,
+        job_repository: RegradeJobRepository,
+        analytics_service: AnalyticsCalculationService
+    ):
+        self.activity_client = activity_client
+        self.metrics_repository = metrics_repository
+        self.job_repository = job_repository
+        self.analytics_service = analytics_service
+    
+    async def create_job(self, activity_id: str) -> RegradeJob:
+        """
+        Create a regrade job for an activity, or return the one already in
+        progress (resuming a partial one)
+        """
+        existing = await self.job_repository.find_active_for_activity(activity_id)
+        if existing:
+            return existing
+        
+        reopened = await self.job_repository.reopen_partial(activity_id)
+        if reopened:
+            return reopened
+        
+        activity = await self.activity_client.get_activity(activity_id)
+        if not activity:
+            raise ValueError(f"Activity {activity_id} not found")
+        
+        # Results that do not record their activity yet are resolved by the run
+        instance_ids = await self.metrics_repository.find_instance_ids_by_activity(activity_id)
+        if not instance_ids and not await self.metrics_repository.find_instance_ids_without_activity():
+            raise ValueError(f"No stored results found for activity {activity_id}")
+        
+        now = datetime.utcnow().isoformat() + "Z"
+        job = RegradeJob(
+            job_id=uuid.uuid4().hex,
+            activity_id=activity_id,
+            activity_hash=activity_config_hash(activity),
+            instance_ids=instance_ids,
+            created_at=now,
+            updated_at=now
+        )
+        
+        return await self.job_repository.create(job)
+    
+    async def backfill_activity_ids(self) -> int:
+        """
+        Record the activity of results stored before results carried one
+        
+        Each such instance is resolved once through the Activity API (or
+        its mirror); instances no longer known upstream are recorded as
+        unresolved and not looked up again. Returns the number of results
+        updated.
+        """
+        updated = 0
+        for instance_id in await self.metrics_repository.find_instance_ids_without_activity():
+            instance = await self.activity_client.get_instance(instance_id)
+            if instance is None:
+                logger.warning("Regrade cannot resolve the activity of stored results", extra={"fields": {
+                    "instance_id": instance_id
+                }})
+                await self.metrics_repository.set_activity_id(instance_id, None)
+                continue
+            updated += await self.metrics_repository.set_activity_id(instance_id, instance.activityId)
+        
+        if updated:
+            logger.info("Activity backfilled on stored results", extra={"fields": {"results": updated}})
+        return updated
+    
+    async def cancel_job(self, job_id: str) -> Optional[RegradeJob]:
+        """
+        Mark a job as cancelled; a running job stops before its next instance
+        """
+        job = await self.job_repository.find_by_id(job_id)
+        if job and job.status in ACTIVE_STATUSES:
+            await self.job_repository.update(job_id, {"status": "cancelled"}, expected_statuses=ACTIVE_STATUSES)
+            job = await self.job_repository.find_by_id(job_id)
+        return job
+    
+    async def run_job(self, job_id: str):
+        """
+        Claim and run a job to completion
+        """
+        job = await self.job_repository.claim(job_id, REGRADE_LEASE_SECONDS)
+        if not job:
+            # Finished, cancelled or owned by another worker
+            return
+        
+        renewal = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            try:
+                await self._run(job)
+            finally:
+                renewal.cancel()
+        except asyncio.CancelledError:
+            # Shutting down: release the lease so another worker resumes immediately
+            await self.job_repository.update(job_id, {}, lease_seconds=0)
+            raise
+        except Exception as e:
+            logger.warning("Regrade job failed", extra={"fields": {"job_id": job_id, "error": str(e)}})
+            await self.job_repository.update(
+                job_id,
+                {"status": "failed", "error": str(e)},
+                lease_seconds=0,
+                expected_statuses=["running"]
+            )
+    
+    async def _renew_lease(self, job_id: str):
+        """
+        Keep the lease of a running job while it runs, so an instance that
+        takes longer than the lease does not let another worker claim it
+        """
+        while True:
+            await asyncio.sleep(REGRADE_LEASE_SECONDS / 3)
+            try:
+                await self.job_repository.update(
+                    job_id,
+                    {},
+                    lease_seconds=REGRADE_LEASE_SECONDS,
+                    expected_statuses=["running"]
+                )
+            except Exception as e:
+                logger.warning("Regrade lease renewal failed", extra={"fields": {"job_id": job_id, "error": str(e)}})
+    
+    async def _run(self, job: RegradeJob):
+        activity = await self.activity_client.get_activity(job.activity_id)
+        if not activity:
+            raise ValueError(f"Activity {job.activity_id} not found")
+        
+        # Results stored before they recorded their activity may add instances
+        await self.backfill_activity_ids()
+        instance_ids = list(job.instance_ids)
+        for instance_id in await self.metrics_repository.find_instance_ids_by_activity(job.activity_id):
+            if instance_id not in instance_ids:
+                instance_ids.append(instance_id)
+        
+        # Regrade to the latest configuration, even if it changed again since
+        # the job was created; failures of a previous run are retried
+        activity_hash = activity_config_hash(activity)
+        await self.job_repository.update(job.job_id, {
+            "activity_hash": activity_hash,
+            "instance_ids": instance_ids,
+            "failed_instances": []
+        })
+        
+        pending = [
+            instance_id for instance_id in instance_ids
+            if instance_id not in job.completed_instances
+        ]
+        semaphore = asyncio.Semaphore(REGRADE_CONCURRENCY)
+        cancelled = False
+        failed = 0
+        
+        async def regrade(instance_id: str):
+            nonlocal cancelled, failed
+            async with semaphore:
+                current = await self.job_repository.find_by_id(job.job_id)
+                if cancelled or not current or current.status == "cancelled":
+                    cancelled = True
+                    return
+                
+                try:
+                    counts = await self.analytics_service.regrade_instance(instance_id, activity, activity_hash)
+                    await self.job_repository.update(
+                        job.job_id,
+                        {},
+                        lease_seconds=REGRADE_LEASE_SECONDS,
+                        increments={
+                            "students_recomputed": counts["recomputed"],
+                            "students_unchanged": counts["unchanged"]
+                        },
+                        add_completed_instance=instance_id
+                    )
+                except Exception as e:
+                    # Left pending, so resuming the job retries it
+                    failed += 1
+                    await self.job_repository.update(
+                        job.job_id,
+                        {},
+                        lease_seconds=REGRADE_LEASE_SECONDS,
+                        add_failed_instance={"instance_id": instance_id, "error": str(e)}
+                    )
+        
+        await asyncio.gather(*(regrade(instance_id) for instance_id in pending))
+        
+        if cancelled:
+            return
+        
+        # A cancel that arrived after the last instance started is kept
+        status = "partial" if failed else "completed"
+        if await self.job_repository.update(
+            job.job_id,
+            {"status": status},
+            lease_seconds=0,
+            expected_statuses=["running"]
+        ):
+            logger.info("Regrade job finished", extra={"fields": {
+                "job_id": job.job_id,
+                "activity_id": job.activity_id,
+                "status": status,
+                "instances": len(instance_ids),
+                "failed_instances": failed
+            }})
+
+
+# Jobs running in this worker
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+def start_regrade_job(job_id: str, service_factory: Callable[[], RegradeService]):
+    """
+    Run a job in the background of this worker
+    """
+    task = _tasks.get(job_id)
+    if task is not None and not task.done():
+        return
+    
+    task = asyncio.create_task(service_factory().run_job(job_id))
+    _tasks[job_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(job_id, None))
+
+
+async def resume_regrade_jobs(job_repository: RegradeJobRepository, service_factory: Callable[[], RegradeService]):
+    """
+    Resume active jobs whose previous worker stopped
+    """
+    for job_id in await job_repository.find_resumable_ids():
+        logger.info("Resuming regrade job", extra={"fields": {"job_id": job_id}})
+        start_regrade_job(job_id, service_factory)
+
+
+async def stop_regrade_jobs():
+    """
+    Cancel the jobs running in this worker; their leases are released
+    """
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,179 @@
+"""
+Retention of the analytics collection: archiving cold instances into compact
+summaries ahead of TTL expiry, and reporting collection footprint
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+from app.models.schemas import InstanceSummary
+from app.repositories.metrics_repository import AnalyticsMetricsRepository, ANALYTICS_RETENTION_DAYS
+from app.repositories.archive_repository import AnalyticsArchiveRepository
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ARCHIVE_ENABLED = os.getenv("ANALYTICS_ARCHIVE_ENABLED", "false").lower() == "true"
+ANALYTICS_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# Instances are archived this long before the TTL monitor would delete their results
+ANALYTICS_ARCHIVE_LEAD_HOURS = float(os.getenv("ANALYTICS_ARCHIVE_LEAD_HOURS", "24"))
+
+
+def build_instance_summary(instance_id: str, rows: List[Dict[str, Any]]) -> InstanceSummary:
+    """
+    Aggregate the stored quantitative metrics of an instance's students
+    
+    Each row holds the "metrics" (QuantitativeMetrics fields) and
+    "calculated_at" of one student.
+    """
+    if not rows:
+        return InstanceSummary(instance_id=instance_id)
+    
+    scores = sorted(row["metrics"]["final_score"] for row in rows)
+    count = len(scores)
+    middle = count // 2
+    median = scores[middle] if count % 2 else (scores[middle - 1] + scores[middle]) / 2
+    
+    pass_count = sum(1 for row in rows if row["metrics"]["activity_success"])
+    
+    histogram: Dict[str, int] = {}
+    for row in rows:
+        key = str(row["metrics"]["total_attempts"])
+        histogram[key] = histogram.get(key, 0) + 1
+    
+    calculated = sorted(row["calculated_at"] for row in rows if row.get("calculated_at"))
+    
+    return InstanceSummary(
+        instance_id=instance_id,
+        student_count=count,
+        pass_count=pass_count,
+        pass_rate=pass_count / count,
+        mean_final_score=sum(scores) / count,
+        median_final_score=median,
+        average_total_time_seconds=sum(row["metrics"]["total_time_seconds"] for row in rows) / count,
+        attempts_histogram=histogram,
+        first_calculated_at=calculated[0] if calculated else None,
+        last_calculated_at=calculated[-1] if calculated else None
+    )
+
+
+class RetentionService:
+    """
+    Keeps the hot analytics collection small: results carry an _expires_at
+    removed by a TTL index, and cold instances can be archived first as a
+    single summary document.
+    """
+    
+    def __init__(
+        self,
+        metrics_repository: AnalyticsMetricsRepository,
+        archive_repository: AnalyticsArchiveRepository
+    ):
+        self.metrics_repository = metrics_repository
+        self.archive_repository = archive_repository
+    
+    async def archive_instance(self, instance_id: str) -> int:
+        """
+        Archive an instance's summary and remove its per-student results
+        
+        Only the documents summarized are deleted, and only if they were not
+        recalculated after being read, so results written meanwhile are kept.
+        An instance without results (e.g. archived by a concurrent run) keeps
+        its archived summary. Returns the number of deleted result documents.
+        """
+        read_at = datetime.utcnow()
+        rows = await self.metrics_repository.find_quantitative_by_instance(instance_id, with_ids=True)
+        if not rows:
+            return 0
+        await self.archive_repository.save(build_instance_summary(instance_id, rows))
+        return await self.metrics_repository.delete_by_instance(
+            instance_id,
+            document_ids=[row["_id"] for row in rows],
+            calculated_before=read_at
+        )
+    
+    async def archive_expiring(
+        self,
+        lead_hours: float = ANALYTICS_ARCHIVE_LEAD_HOURS
+    ) -> Dict[str, int]:
+        """
+        Archive every instance whose results are all due to expire within lead_hours
+        """
+        before = datetime.utcnow() + timedelta(hours=lead_hours)
+        instance_ids = await self.metrics_repository.find_expiring_instance_ids(before)
+        
+        archived_instances = 0
+        deleted_documents = 0
+        for instance_id in instance_ids:
+            deleted = await self.archive_instance(instance_id)
+            archived_instances += int(deleted > 0)
+            deleted_documents += deleted
+        
+        logger.info("Retention archive run", extra={"fields": {
+            "archived_instances": archived_instances,
+            "deleted_documents": deleted_documents
+        }})
+        
+        return {
+            "archived_instances": archived_instances,
+            "deleted_documents": deleted_documents
+        }
+    
+    async def storage_report(self) -> Dict[str, Any]:
+        """
+        Size and index footprint of the hot and archive collections
+        """
+        return {
+            "retention": {
+                "retention_days": ANALYTICS_RETENTION_DAYS,
+                "archive_enabled": ANALYTICS_ARCHIVE_ENABLED,
+                "archive_lead_hours": ANALYTICS_ARCHIVE_LEAD_HOURS
+            },
+            "analytics": await self.metrics_repository.collection_stats(),
+            "archive": await self.archive_repository.collection_stats()
+        }
+
+
+# Global archive job for this worker
+_archive_task: Optional[asyncio.Task] = None
+
+
+def start_archive_job(
+    service_factory: Callable[[], RetentionService],
+    claim: Optional[Callable[[float], Awaitable[bool]]] = None
+):
+    """
+    Periodically archive expiring instances (no-op unless ANALYTICS_ARCHIVE_ENABLED)
+    
+    With claim, a run only happens in the worker whose claim for the
+    interval succeeds.
+    """
+    global _archive_task
+    if not ANALYTICS_ARCHIVE_ENABLED or _archive_task is not None:
+        return
+    
+    async def loop():
+        while True:
+            await asyncio.sleep(ANALYTICS_ARCHIVE_INTERVAL_SECONDS)
+            try:
+                if claim is None or await claim(ANALYTICS_ARCHIVE_INTERVAL_SECONDS):
+                    await service_factory().archive_expiring()
+            except Exception as e:
+                logger.warning("Retention archive run failed", extra={"fields": {"error": str(e)}})
+    
+    _archive_task = asyncio.create_task(loop())
+
+
+async def stop_archive_job():
+    """
+    Stop the periodic archive job
+    """
+    global _archive_task
+    if _archive_task is not None:
+        _archive_task.cancel()
+        try:
+            await _archive_task
+        except asyncio.CancelledError:
+            pass
+        _archive_task = None
@@ -0,0 +1,194 @@
+"""
+Per-activity rollups: merging day documents into summaries and time buckets,
+and periodically reconciling recent day documents with the stored results
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+from app.models.schemas import ActivityRollup
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.rollup_repository import ActivityRollupRepository
+
+logger = logging.getLogger(__name__)
+
+BUCKET_GRANULARITIES = ("day", "week", "month")
+
+ROLLUP_RECONCILE_ENABLED = os.getenv("ROLLUP_RECONCILE_ENABLED", "true").lower() == "true"
+ROLLUP_RECONCILE_INTERVAL_SECONDS = float(os.getenv("ROLLUP_RECONCILE_INTERVAL_SECONDS", "3600"))
+
+# Day documents younger than this are rebuilt from the stored results; older
+# ones keep counting results removed by retention and are left as they are
+ROLLUP_RECONCILE_DAYS = int(os.getenv("ROLLUP_RECONCILE_DAYS", "7"))
+
+
+def bucket_start(day: str, granularity: str) -> str:
+    """
+    First day of the day/week (Monday)/month bucket containing a YYYY-MM-DD day
+    """
+    if granularity == "day":
+        return day
+    
+    parsed = date.fromisoformat(day)
+    if granularity == "week":
+        return (parsed - timedelta(days=parsed.weekday())).isoformat()
+    return parsed.replace(day=1).isoformat()
+
+
+def merge_rollups(
+    activity_id: str,
+    documents: List[Dict[str, Any]],
+    start: Optional[str] = None
+) -> ActivityRollup:
+    """
+    Sum the counters of rollup day documents into a single rollup
+    """
+    result_count = 0
+    pass_count = 0
+    score_sum = 0.0
+    time_sum = 0.0
+    histogram: Dict[str, int] = {}
+    instance_ids = set()
+    
+    for document in documents:
+        result_count += document.get("result_count", 0)
+        pass_count += document.get("pass_count", 0)
+        score_sum += document.get("final_score_sum", 0.0)
+        time_sum += document.get("total_time_seconds_sum", 0.0)
+        for attempts, count in document.get("attempts_histogram", {}).items():
+            histogram[attempts] = histogram.get(attempts, 0) + count
+        instance_ids.update(document.get("instance_ids", []))
+    
+    if result_count <= 0:
+        return ActivityRollup(activity_id=activity_id, bucket_start=start)
+    
+    return ActivityRollup(
+        activity_id=activity_id,
+        bucket_start=start,
+        result_count=result_count,
+        instance_count=len(instance_ids),
+        pass_count=pass_count,
+        pass_rate=pass_count / result_count,
+        mean_final_score=score_sum / result_count,
+        average_total_time_seconds=time_sum / result_count,
+        attempts_histogram={
+            attempts: count
+            for attempts, count in sorted(histogram.items(), key=lambda item: int(item[0]))
+            if count > 0
+        }
+    )
+
+
+def bucket_rollups(
+    activity_id: str,
+    documents: List[Dict[str, Any]],
+    granularity: str
+) -> List[ActivityRollup]:
+    """
+    Group day documents into day/week/month buckets, in chronological order
+    """
+    buckets: Dict[str, List[Dict[str, Any]]] = {}
+    for document in documents:
+        buckets.setdefault(bucket_start(document["bucket"], granularity), []).append(document)
+    
+    return [
+        merge_rollups(activity_id, bucket_documents, start)
+        for start, bucket_documents in sorted(buckets.items())
+    ]
+
+
+class RollupReconciliationService:
+    """
+    Rebuilds recent rollup day documents from the stored results, correcting
+    changes lost between a result write and its rollup $inc
+    """
+    
+    def __init__(
+        self,
+        metrics_repository: AnalyticsMetricsRepository,
+        rollup_repository: ActivityRollupRepository
+    ):
+        self.metrics_repository = metrics_repository
+        self.rollup_repository = rollup_repository
+    
+    async def reconcile_activity(self, activity_id: str, since: str) -> Dict[str, int]:
+        """
+        Rebuild the day documents of an activity from since (YYYY-MM-DD) on
+        
+        Versions are read before the results, so a day document changed
+        meanwhile is not overwritten and counts as a conflict.
+        """
+        versions = await self.rollup_repository.find_versions(activity_id, since)
+        rows_by_bucket: Dict[str, List[Dict[str, Any]]] = {}
+        for row in await self.metrics_repository.find_rolled_up_by_activity(activity_id, since):
+            rows_by_bucket.setdefault(row["calculated_at"][:10], []).append(row)
+        
+        counts = {"buckets": 0, "conflicts": 0}
+        for bucket in sorted(set(versions) | set(rows_by_bucket)):
+            counts["buckets"] += 1
+            replaced = await self.rollup_repository.replace_bucket(
+                activity_id, bucket, rows_by_bucket.get(bucket, []), versions.get(bucket)
+            )
+            if not replaced:
+                counts["conflicts"] += 1
+        return counts
+    
+    async def reconcile_recent(self, days: int = ROLLUP_RECONCILE_DAYS) -> Dict[str, int]:
+        """
+        Rebuild the day documents of the last days of every activity
+        """
+        since = (datetime.utcnow().date() - timedelta(days=days)).isoformat()
+        activity_ids = await self.rollup_repository.find_activity_ids(since)
+        
+        totals = {"activities": len(activity_ids), "buckets": 0, "conflicts": 0}
+        for activity_id in sorted(activity_ids):
+            for key, value in (await self.reconcile_activity(activity_id, since)).items():
+                totals[key] += value
+        
+        logger.info("Activity rollups reconciled", extra={"fields": totals})
+        return totals
+
+
+# Global reconciliation job for this worker
+_reconcile_task: Optional[asyncio.Task] = None
+
+
+def start_rollup_reconciliation(
+    service_factory: Callable[[], RollupReconciliationService],
+    claim: Optional[Callable[[float], Awaitable[bool]]] = None
+):
+    """
+    Periodically reconcile recent rollups (no-op unless ROLLUP_RECONCILE_ENABLED)
+    
+    With claim, a run only happens in the worker whose claim for the
+    interval succeeds.
+    """
+    global _reconcile_task
+    if not ROLLUP_RECONCILE_ENABLED or _reconcile_task is not None:
+        return
+    
+    async def loop():
+        while True:
+            await asyncio.sleep(ROLLUP_RECONCILE_INTERVAL_SECONDS)
+            try:
+                if claim is None or await claim(ROLLUP_RECONCILE_INTERVAL_SECONDS):
+                    await service_factory().reconcile_recent()
+            except Exception as e:
+                logger.warning("Activity rollup reconciliation failed", extra={"fields": {"error": str(e)}})
+    
+    _reconcile_task = asyncio.create_task(loop())
+
+
+async def stop_rollup_reconciliation():
+    """
+    Stop the periodic reconciliation job
+    """
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
@@ -0,0 +1,246 @@
+"""
+Materialized per-instance summaries: serving them and cohort ranks from their
+counters and periodically reconciling the counters with the stored results
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+from app.models.schemas import CohortRank, InstanceSummary
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+from app.repositories.summary_repository import InstanceSummaryRepository, score_key
+from app.repositories.archive_repository import AnalyticsArchiveRepository
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_RECONCILE_ENABLED = os.getenv("SUMMARY_RECONCILE_ENABLED", "true").lower() == "true"
+SUMMARY_RECONCILE_INTERVAL_SECONDS = float(os.getenv("SUMMARY_RECONCILE_INTERVAL_SECONDS", "3600"))
+
+# Rewrites of an instance attempted while its summary keeps changing
+SUMMARY_RECONCILE_ATTEMPTS = 3
+
+
+def summary_from_counters(document: Dict[str, Any]) -> InstanceSummary:
+    """
+    Build an InstanceSummary from the counters of a summary document
+    
+    The median is read from the final score histogram, whose size depends
+    on the distinct scores rather than on the number of students.
+    """
+    count = document.get("student_count", 0)
+    if count <= 0:
+        return InstanceSummary(instance_id=document["instance_id"])
+    
+    scores = sorted(
+        (int(key), number)
+        for key, number in document.get("score_histogram", {}).items()
+        if number > 0
+    )
+    
+    def score_at(position: int) -> float:
+        seen = 0
+        for basis_points, number in scores:
+            seen += number
+            if seen > position:
+                return basis_points / 10000
+        return scores[-1][0] / 10000 if scores else 0.0
+    
+    middle = count // 2
+    median = score_at(middle) if count % 2 else (score_at(middle - 1) + score_at(middle)) / 2
+    
+    return InstanceSummary(
+        instance_id=document["instance_id"],
+        student_count=count,
+        pass_count=document.get("pass_count", 0),
+        pass_rate=document.get("pass_count", 0) / count,
+        mean_final_score=document.get("final_score_sum", 0.0) / count,
+        median_final_score=median,
+        average_total_time_seconds=document.get("total_time_seconds_sum", 0.0) / count,
+        attempts_histogram={
+            attempts: number
+            for attempts, number in sorted(
+                document.get("attempts_histogram", {}).items(), key=lambda item: int(item[0])
+            )
+            if number > 0
+        },
+        first_calculated_at=document.get("first_calculated_at"),
+        last_calculated_at=document.get("last_calculated_at")
+    )
+
+
+def cohort_rank(document: Optional[Dict[str, Any]], final_score: float) -> Optional[CohortRank]:
+    """
+    Position (1 = highest score, ties share a position) and percentile rank
+    (share of the cohort below, counting ties as half) of a final score,
+    from the final score histogram of a summary document
+    
+    A score missing from the histogram (a result not yet counted) is ranked
+    as if it were.
+    """
+    if not document:
+        return None
+    
+    key = int(score_key(final_score))
+    below = ties = above = 0
+    for basis_points, number in document.get("score_histogram", {}).items():
+        if number <= 0:
+            continue
+        if int(basis_points) < key:
+            below += number
+        elif int(basis_points) > key:
+            above += number
+        else:
+            ties += number
+    ties = max(ties, 1)
+    
+    cohort_size = below + ties + above
+    return CohortRank(
+        position=above + 1,
+        cohort_size=cohort_size,
+        percentile_rank=round(100 * (below + ties / 2) / cohort_size, 1)
+    )
+
+
+def _counts(document: Optional[Dict[str, Any]]) -> tuple:
+    """
+    Integer counters of a summary document, for drift detection
+    """
+    if not document:
+        return (0, 0, {}, {})
+    return (
+        document.get("student_count", 0),
+        document.get("pass_count", 0),
+        {key: number for key, number in document.get("attempts_histogram", {}).items() if number},
+        {key: number for key, number in document.get("score_histogram", {}).items() if number}
+    )
+
+
+class InstanceSummaryService:
+    """
+    Serves instance overviews from the materialized summary documents that
+    AnalyticsMetricsRepository.save keeps up to date
+    """
+    
+    def __init__(
+        self,
+        metrics_repository: AnalyticsMetricsRepository,
+        summary_repository: InstanceSummaryRepository,
+        archive_repository: Optional[AnalyticsArchiveRepository] = None
+    ):
+        self.metrics_repository = metrics_repository
+        self.summary_repository = summary_repository
+        self.archive_repository = archive_repository
+    
+    async def get_summary(self, instance_id: str) -> Optional[InstanceSummary]:
+        """
+        Get the summary of an instance
+        
+        A summary never reconciled may be missing results stored before
+        summaries existed, so it is reconciled on its first read. Archived
+        instances are served from their archived summary.
+        """
+        document = await self.summary_repository.find_by_instance(instance_id)
+        if document is None or "reconciled_at" not in document:
+            document = await self.reconcile_instance(instance_id)
+        
+        if document is not None and document.get("student_count", 0) > 0:
+            return summary_from_counters(document)
+        
+        if self.archive_repository is not None:
+            return await self.archive_repository.find_by_instance(instance_id)
+        return None
+    
+    async def get_cohort_rank(self, instance_id: str, final_score: float) -> Tuple[Optional[CohortRank], Optional[int]]:
+        """
+        Cohort standing of a final score within an instance, with the summary
+        version it was read from
+        
+        One read of the summary document, whose histogram grows with the
+        distinct scores rather than the number of students. The counters are
+        served as they are, even before their first reconciliation: rebuilding
+        them reads every result of the instance, which is left to the
+        background reconciliation rather than the student request path.
+        """
+        document = await self.summary_repository.find_by_instance(instance_id)
+        return cohort_rank(document, final_score), (document or {}).get("version")
+    
+    async def reconcile_instance(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Rewrite the summary of an instance from its stored results and return it
+        
+        The summary version is read before the results; if a change is
+        applied before the rewrite, the rewrite is retried, and after
+        SUMMARY_RECONCILE_ATTEMPTS the incrementally updated summary is kept
+        until the next reconciliation.
+        """
+        for _ in range(SUMMARY_RECONCILE_ATTEMPTS):
+            current = await self.summary_repository.find_by_instance(instance_id)
+            rows = await self.metrics_repository.find_quantitative_by_instance(instance_id)
+            if await self.summary_repository.replace(instance_id, rows, (current or {}).get("version")):
+                break
+        return await self.summary_repository.find_by_instance(instance_id)
+    
+    async def reconcile_all(self) -> Dict[str, int]:
+        """
+        Reconcile every instance with stored results or a summary
+        """
+        instance_ids = set(await self.metrics_repository.find_instance_ids())
+        instance_ids.update(await self.summary_repository.find_instance_ids())
+        
+        corrected = 0
+        for instance_id in sorted(instance_ids):
+            previous = await self.summary_repository.find_by_instance(instance_id)
+            current = await self.reconcile_instance(instance_id)
+            if _counts(previous) != _counts(current):
+                corrected += 1
+        
+        logger.info("Instance summaries reconciled", extra={"fields": {
+            "instances": len(instance_ids),
+            "corrected": corrected
+        }})
+        
+        return {"instances": len(instance_ids), "corrected": corrected}
+
+
+# Global reconciliation job for this worker
+_reconcile_task: Optional[asyncio.Task] = None
+
+
+def start_summary_reconciliation(
+    service_factory: Callable[[], InstanceSummaryService],
+    claim: Optional[Callable[[float], Awaitable[bool]]] = None
+):
+    """
+    Periodically reconcile all instance summaries (no-op unless SUMMARY_RECONCILE_ENABLED)
+    
+    With claim, a run only happens in the worker whose claim for the
+    interval succeeds.
+    """
+    global _reconcile_task
+    if not SUMMARY_RECONCILE_ENABLED or _reconcile_task is not None:
+        return
+    
+    async def loop():
+        while True:
+            await asyncio.sleep(SUMMARY_RECONCILE_INTERVAL_SECONDS)
+            try:
+                if claim is None or await claim(SUMMARY_RECONCILE_INTERVAL_SECONDS):
+                    await service_factory().reconcile_all()
+            except Exception as e:
+                logger.warning("Instance summary reconciliation failed", extra={"fields": {"error": str(e)}})
+    
+    _reconcile_task = asyncio.create_task(loop())
+
+
+async def stop_summary_reconciliation():
+    """
+    Stop the periodic reconciliation job
+    """
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
@@ -0,0 +1,101 @@
+"""
+Benchmark bytes on the wire and encode time for instance metric payloads
+
+Compares the current JSON response against the negotiated representations
+(columnar JSON, MessagePack) with and without gzip/brotli compression.
+
+Usage: python -m benchmarks.bench_encoding [number_of_students]
+"""
+import random
+import sys
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.routers.negotiation import (
+    JSON_MEDIA_TYPE,
+    COLUMNAR_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    encode_body,
+    compress_body,
+    msgpack,
+    brotli
+)
+
+WORDS = (
+    "the force acting on the body is balanced so it keeps moving with constant "
+    "velocity because of inertia and friction is negligible acceleration mass"
+).split()
+
+
+def build_instance_payload(number_of_students: int) -> dict:
+    """
+    Build a synthetic /instances/{instance_id}/metrics response body
+    """
+    rng = random.Random(42)
+    students = []
+    for index in range(number_of_students):
+        attempts = rng.randint(1, 3)
+        total_time = rng.randint(60, 1800)
+        correct = rng.randint(0, 10)
+        students.append({
+            "student_id": f"student_{index:05d}",
+            "metrics": {
+                "total_attempts": attempts,
+                "total_time_seconds": total_time,
+                "average_time_per_attempt": total_time / attempts,
+                "number_of_correct_answers": correct,
+                "final_score": correct / 10,
+                "activity_success": correct >= 5
+            },
+            "qualitative": {
+                "answer_rationale": [
+                    " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 40)))
+                    for _ in range(rng.randint(3, 10))
+                ]
+            },
+            "calculated_at": "2025-01-01T12:00:00.000000Z"
+        })
+    return {"instance_id": "inst_bench", "count": len(students), "students": students}
+
+
+def timed(function, repeat: int = 5):
+    """
+    Run a function several times and return its result and best time in ms
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def main():
+    number_of_students = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    payload = build_instance_payload(number_of_students)
+    
+    print(f"Instance payload with {number_of_students} students\n")
+    print(f"{'representation':<34}{'bytes':>12}{'ratio':>8}{'encode ms':>12}")
+    
+    baseline, baseline_ms = timed(lambda: JSONResponse(jsonable_encoder(payload)).body)
+    print(f"{'json (current JSONResponse)':<34}{len(baseline):>12}{1.0:>8.2f}{baseline_ms:>12.2f}")
+    
+    media_types = [JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE]
+    if msgpack is not None:
+        media_types.append(MSGPACK_MEDIA_TYPE)
+    encodings = [None, "gzip"] + (["br"] if brotli is not None else [])
+    
+    for media_type in media_types:
+        for encoding in encodings:
+            def encode():
+                body = encode_body(payload, media_type)
+                return compress_body(body, encoding)[0]
+            
+            body, elapsed_ms = timed(encode)
+            label = f"{media_type.split('/')[-1].replace('vnd.mrnewton.', '')} + {encoding or 'identity'}"
+            print(f"{label:<34}{len(body):>12}{len(body) / len(baseline):>8.2f}{elapsed_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark parse time and peak memory of Activity API submission payloads
+
+Compares the previous ingest path (response.json() then Submission(**data)
+per submission, with every upstream field declared) against validating the
+raw bytes with model_validate_json into the models the service uses.
+
+Usage: python -m benchmarks.bench_ingest [number_of_students] [exercises]
+"""
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+import json
+import sys
+import time
+import tracemalloc
+from app.models.schemas import Answer, Submission, SubmissionList
+from loadtest.cohort import CohortConfig, build_activity, build_submission, student_ids
+
+
+class _FullAttemptResult(BaseModel):
+    """AttemptResult as declared before unused fields were dropped"""
+    attemptIndex: int
+    answers: Dict[str, Answer]
+    result: float
+    submittedAt: str
+    timeSpentSeconds: Optional[int] = None
+
+
+class _FullSubmission(BaseModel):
+    """Submission as declared before unused fields were dropped"""
+    submissionId: str = Field(alias="submission_id")
+    instanceId: str = Field(alias="instance_id")
+    studentId: str = Field(alias="student_id")
+    numberOfAttempts: int = Field(alias="number_of_attempts")
+    attempts: List[_FullAttemptResult]
+    createdAt: str = Field(alias="created_at")
+
+
+def build_submissions_body(number_of_students: int, exercises: int) -> bytes:
+    """
+    Build a synthetic /submissions/instance/{instance_id} response body
+    """
+    config = CohortConfig(students_per_instance=number_of_students, exercises=exercises, max_attempts=3)
+    activity = build_activity("act_bench", config)
+    submissions = [
+        build_submission("inst_bench", student_id, activity, config)
+        for student_id in student_ids(config)
+    ]
+    return json.dumps({"count": len(submissions), "submissions": submissions}).encode("utf-8")
+
+
+def measure(function, repeat: int = 5):
+    """
+    Best time in ms over several runs and peak traced memory in MiB of one run
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+        del result
+    
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    
+    return best * 1000, peak / (1024 * 1024)
+
+
+def main():
+    number_of_students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    exercises = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    body = build_submissions_body(number_of_students, exercises)
+    
+    paths = [
+        ("json() + Submission(**) (previous)", lambda: [
+            _FullSubmission(**submission) for submission in json.loads(body)["submissions"]
+        ]),
+        ("json() + Submission(**) lean", lambda: [
+            Submission(**submission) for submission in json.loads(body)["submissions"]
+        ]),
+        ("model_validate_json (current)", lambda: SubmissionList.model_validate_json(body).submissions)
+    ]
+    
+    print(f"{number_of_students} submissions x {exercises} exercises, {len(body) / (1024 * 1024):.1f} MiB body\n")
+    print(f"{'path':<38}{'parse ms':>10}{'peak MiB':>10}")
+    
+    for label, parse in paths:
+        elapsed_ms, peak_mib = measure(parse)
+        print(f"{label:<38}{elapsed_ms:>10.1f}{peak_mib:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Load-testing harness: fake Activity API, cohort generator and load generator
@@ -0,0 +1,141 @@
+"""
+Deterministic synthetic cohorts in the Activity API wire format
+
+Instances are named inst_<n> and students student_<n>; the same id always
+produces the same data, so the fake Activity API and the load generator
+agree on which instances and students exist without sharing state.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import random
+import zlib
+
+WORDS = (
+    "the force acting on the body is balanced so it keeps moving with constant "
+    "velocity because of inertia friction is negligible and acceleration depends "
+    "on the net force divided by the mass of the object"
+).split()
+
+OPTIONS = ["A", "B", "C", "D"]
+
+
+class CohortConfig:
+    """Shape of the generated data"""
+    
+    def __init__(
+        self,
+        students_per_instance: int = 200,
+        exercises: int = 10,
+        max_attempts: int = 3,
+        activities: int = 5,
+        expires_in_hours: float = 24.0
+    ):
+        self.students_per_instance = students_per_instance
+        self.exercises = exercises
+        self.max_attempts = max_attempts
+        self.activities = activities
+        self.expires_in_hours = expires_in_hours
+        # All instances are deployed an hour before the harness starts
+        self.created_at = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+
+
+def instance_ids(count: int) -> List[str]:
+    return [f"inst_{index:04d}" for index in range(count)]
+
+
+def student_ids(config: CohortConfig) -> List[str]:
+    return [f"student_{index:05d}" for index in range(config.students_per_instance)]
+
+
+def _seed(*parts: str) -> int:
+    return zlib.crc32("|".join(parts).encode("utf-8"))
+
+
+def activity_id_for(instance_id: str, config: CohortConfig) -> str:
+    """
+    Map an instance to one of the configured activities
+    """
+    return f"act_{_seed(instance_id) % max(1, config.activities):03d}"
+
+
+def build_instance(instance_id: str, config: CohortConfig) -> Dict[str, Any]:
+    created_at = config.created_at
+    return {
+        "instance_id": instance_id,
+        "activity_id": activity_id_for(instance_id, config),
+        "created_at": created_at.isoformat() + "Z",
+        "expires_at": (created_at + timedelta(hours=config.expires_in_hours)).isoformat() + "Z",
+        "session_params": {}
+    }
+
+
+def build_activity(activity_id: str, config: CohortConfig) -> Dict[str, Any]:
+    rng = random.Random(_seed(activity_id))
+    exercises = []
+    for index in range(config.exercises):
+        correct = rng.choice(OPTIONS)
+        exercises.append({
+            "question": f"Question {index + 1}",
+            "options": OPTIONS,
+            "correct_options": correct,
+            "correct_answer": f"Answer {correct}"
+        })
+    
+    return {
+        "activity_id": activity_id,
+        "created_at": "2025-01-01T00:00:00Z",
+        "title": f"Synthetic activity {activity_id}",
+        "grade": 10,
+        "modules": "mechanics",
+        "number_of_exercises": config.exercises,
+        "total_time_minutes": 30,
+        "number_of_retries": config.max_attempts,
+        "scoring_policy": rng.choice(["linear", "non-linear"]),
+        "approval_threshold": 0.5,
+        "exercises": exercises
+    }
+
+
+def build_submission(
+    instance_id: str,
+    student_id: str,
+    activity: Dict[str, Any],
+    config: CohortConfig
+) -> Dict[str, Any]:
+    rng = random.Random(_seed(instance_id, student_id))
+    skill = rng.random()
+    submitted_at = datetime(2025, 1, 1, 12, 0, 0)
+    attempts = []
+    
+    for attempt_index in range(rng.randint(1, config.max_attempts)):
+        answers = {}
+        correct_count = 0
+        for q_index, exercise in enumerate(activity["exercises"]):
+            if rng.random() < skill:
+                selected = exercise["correct_options"]
+                correct_count += 1
+            else:
+                selected = rng.choice(OPTIONS)
+            answers[f"q{q_index}"] = {
+                "selectedOption": selected,
+                "rationale": " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 25)))
+            }
+        
+        time_spent = rng.randint(60, 900)
+        submitted_at += timedelta(seconds=time_spent)
+        attempts.append({
+            "attemptIndex": attempt_index,
+            "answers": answers,
+            "result": correct_count / max(1, len(activity["exercises"])),
+            "submittedAt": submitted_at.isoformat() + "Z",
+            "timeSpentSeconds": time_spent
+        })
+    
+    return {
+        "submission_id": f"sub_{instance_id}_{student_id}",
+        "instance_id": instance_id,
+        "student_id": student_id,
+        "number_of_attempts": len(attempts),
+        "attempts": attempts,
+        "created_at": "2025-01-01T12:00:00Z"
+    }
@@ -0,0 +1,105 @@
+"""
+Local fake of the mrnewton-activity API for offline load testing
+
+Serves /deploy, /config and /submissions/instance/... with generated
+cohorts and an injectable response latency.
+
+Usage:
+    python -m loadtest.fake_activity_api --port 5000 --students 500 --latency-ms 20
+"""
+from fastapi import FastAPI, HTTPException
+from typing import Any, Dict
+import argparse
+import asyncio
+import random
+import uvicorn
+from loadtest.cohort import (
+    CohortConfig,
+    build_instance,
+    build_activity,
+    build_submission,
+    student_ids
+)
+
+
+class FakeActivityApi:
+    """Generated cohorts plus latency settings, cached per instance"""
+    
+    def __init__(self, config: CohortConfig, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.config = config
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._submissions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    
+    async def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+    
+    def submissions(self, instance_id: str) -> Dict[str, Dict[str, Any]]:
+        if instance_id not in self._submissions:
+            instance = build_instance(instance_id, self.config)
+            activity = build_activity(instance["activity_id"], self.config)
+            self._submissions[instance_id] = {
+                student_id: build_submission(instance_id, student_id, activity, self.config)
+                for student_id in student_ids(self.config)
+            }
+        return self._submissions[instance_id]
+
+
+def create_app(fake: FakeActivityApi) -> FastAPI:
+    app = FastAPI(title="Fake MrNewton Activity API")
+    
+    @app.get("/api/v1/deploy/{instance_id}")
+    async def get_instance(instance_id: str):
+        await fake.delay()
+        return build_instance(instance_id, fake.config)
+    
+    @app.get("/api/v1/config/{activity_id}")
+    async def get_activity(activity_id: str):
+        await fake.delay()
+        return build_activity(activity_id, fake.config)
+    
+    @app.get("/api/v1/submissions/instance/{instance_id}")
+    async def get_instance_submissions(instance_id: str):
+        await fake.delay()
+        submissions = list(fake.submissions(instance_id).values())
+        return {"count": len(submissions), "submissions": submissions}
+    
+    @app.get("/api/v1/submissions/instance/{instance_id}/student/{student_id}")
+    async def get_submission(instance_id: str, student_id: str):
+        await fake.delay()
+        submission = fake.submissions(instance_id).get(student_id)
+        if submission is None:
+            raise HTTPException(status_code=404, detail="Submission not found")
+        return submission
+    
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake MrNewton Activity API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--students", type=int, default=200, help="Students per instance")
+    parser.add_argument("--exercises", type=int, default=10)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--activities", type=int, default=5, help="Distinct activities instances map to")
+    parser.add_argument("--expires-in-hours", type=float, default=24.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform jitter around the latency")
+    args = parser.parse_args()
+    
+    config = CohortConfig(
+        students_per_instance=args.students,
+        exercises=args.exercises,
+        max_attempts=args.max_attempts,
+        activities=args.activities,
+        expires_in_hours=args.expires_in_hours
+    )
+    fake = FakeActivityApi(config, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
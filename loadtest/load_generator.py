@@ -0,0 +1,217 @@
+"""
+Async open-loop load generator for the analytics endpoints
+
+Requests are scheduled at a fixed target rate regardless of how fast the
+server answers, so queueing delay shows up in the latency percentiles.
+
+Usage:
+    python -m loadtest.load_generator --base-url http://localhost:8000 --rps 50 --duration 30
+"""
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import random
+import time
+import httpx
+from loadtest.cohort import CohortConfig, instance_ids, student_ids
+
+API_PREFIX = "/api/v1/analytics"
+
+DEFAULT_MIX = "student=8,instance=1,contract=1"
+
+DEFAULT_CONTRACT = {
+    "qualitative": [
+        {"name": "answer_rationale", "type": "text/plain"}
+    ],
+    "quantitative": [
+        {"name": name, "type": "number"}
+        for name in (
+            "total_attempts",
+            "total_time_seconds",
+            "average_time_per_attempt",
+            "number_of_correct_answers",
+            "final_score",
+            "activity_success"
+        )
+    ]
+}
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    """
+    Parse "scenario=weight,..." into (scenario, weight) pairs
+    """
+    entries = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        entries.append((name.strip(), float(weight or 1)))
+    return entries
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadResult:
+    """Latencies and status codes collected per scenario"""
+    
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+    
+    def record(self, scenario: str, latency_ms: float, status: str):
+        self.latencies.setdefault(scenario, []).append(latency_ms)
+        counts = self.statuses.setdefault(scenario, {})
+        counts[status] = counts.get(status, 0) + 1
+    
+    def report(self, elapsed_seconds: float) -> str:
+        lines = [
+            f"{'scenario':<12}{'count':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses"
+        ]
+        all_latencies = []
+        for scenario in sorted(self.latencies):
+            values = sorted(self.latencies[scenario])
+            all_latencies.extend(values)
+            lines.append(self._line(scenario, values, elapsed_seconds, self.statuses[scenario]))
+        
+        all_statuses: Dict[str, int] = {}
+        for counts in self.statuses.values():
+            for status, count in counts.items():
+                all_statuses[status] = all_statuses.get(status, 0) + count
+        lines.append(self._line("total", sorted(all_latencies), elapsed_seconds, all_statuses))
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _line(name: str, values: List[float], elapsed_seconds: float, statuses: Dict[str, int]) -> str:
+        throughput = len(values) / elapsed_seconds if elapsed_seconds > 0 else 0.0
+        status_text = " ".join(f"{status}:{count}" for status, count in sorted(statuses.items()))
+        return (
+            f"{name:<12}{len(values):>8}{throughput:>9.1f}"
+            f"{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}"
+            f"{percentile(values, 99):>10.1f}  {status_text}"
+        )
+
+
+class LoadGenerator:
+    """Drives the analytics API at a target request rate"""
+    
+    def __init__(
+        self,
+        base_url: str,
+        rps: float,
+        duration_seconds: float,
+        instances: List[str],
+        students: List[str],
+        mix: List[Tuple[str, float]],
+        max_in_flight: int = 1000,
+        force_recalculate_ratio: float = 0.0,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.rps = rps
+        self.duration_seconds = duration_seconds
+        self.instances = instances
+        self.students = students
+        self.scenarios = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.force_recalculate_ratio = force_recalculate_ratio
+        self.headers = headers or {}
+        self.rng = random.Random(1)
+    
+    def build_request(self, scenario: str) -> str:
+        instance_id = self.rng.choice(self.instances)
+        query = ""
+        if self.rng.random() < self.force_recalculate_ratio:
+            query = "?force_recalculate=true"
+        
+        if scenario == "student":
+            student_id = self.rng.choice(self.students)
+            return f"{API_PREFIX}/instances/{instance_id}/students/{student_id}/metrics{query}"
+        if scenario == "instance":
+            return f"{API_PREFIX}/instances/{instance_id}/metrics{query}"
+        if scenario == "contract":
+            return f"{API_PREFIX}/contract"
+        raise ValueError(f"Unknown scenario {scenario}")
+    
+    async def ensure_contract(self, client: httpx.AsyncClient):
+        """
+        Create a default contract if the target has none (e.g. in-memory storage)
+        """
+        response = await client.get(f"{API_PREFIX}/contract")
+        if response.status_code == 404:
+            await client.post(f"{API_PREFIX}/contract", json=DEFAULT_CONTRACT)
+    
+    async def _send(self, client: httpx.AsyncClient, scenario: str, path: str, result: LoadResult):
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, headers=self.headers)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            result.record(scenario, (time.perf_counter() - start) * 1000, status)
+    
+    async def run(self) -> Tuple[LoadResult, float]:
+        result = LoadResult()
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+        
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60.0, limits=limits) as client:
+            await self.ensure_contract(client)
+            
+            total_requests = int(self.rps * self.duration_seconds)
+            interval = 1.0 / self.rps
+            tasks = []
+            start = time.perf_counter()
+            
+            for index in range(total_requests):
+                delay = start + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scenario = self.rng.choices(self.scenarios, self.weights)[0]
+                path = self.build_request(scenario)
+                tasks.append(asyncio.create_task(self._send(client, scenario, path, result)))
+            
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+        
+        return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the analytics API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--rps", type=float, default=50.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument("--instances", type=int, default=10, help="Number of instances to spread load over")
+    parser.add_argument("--students", type=int, default=200, help="Students per instance (match the fake API)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. student=8,instance=1,contract=1")
+    parser.add_argument("--force-recalculate-ratio", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    args = parser.parse_args()
+    
+    config = CohortConfig(students_per_instance=args.students)
+    generator = LoadGenerator(
+        base_url=args.base_url,
+        rps=args.rps,
+        duration_seconds=args.duration,
+        instances=instance_ids(args.instances),
+        students=student_ids(config),
+        mix=parse_mix(args.mix),
+        max_in_flight=args.max_in_flight,
+        force_recalculate_ratio=args.force_recalculate_ratio
+    )
+    
+    result, elapsed = asyncio.run(generator.run())
+    print(f"Target {args.rps:.1f} rps for {args.duration:.0f}s, completed in {elapsed:.1f}s\n")
+    print(result.report(elapsed))
+
+
+if __name__ == "__main__":
+    main()
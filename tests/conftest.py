@@ -0,0 +1,81 @@
+"""
+Shared fixtures for the MrNewton Analytics API tests
+"""
+from typing import Optional
+import pytest
+from app.models.schemas import AnalyticsMetrics
+from app.repositories.metrics_cache import MetricsCache
+from app.repositories.metrics_repository import AnalyticsMetricsRepository
+
+
+@pytest.fixture
+def anyio_backend():
+    """Run the async tests on asyncio, the loop the app is served on"""
+    return "asyncio"
+
+
+@pytest.fixture
+def make_metrics():
+    """
+    Factory for stored results; every field has a default so a test only
+    names the ones it is about
+    
+    activity_success follows final_score and the average time follows the
+    total time unless they are given.
+    """
+    def build(
+        student_id: str = "student_1",
+        instance_id: str = "inst_1",
+        final_score: float = 1.0,
+        total_attempts: int = 1,
+        total_time_seconds: float = 10,
+        average_time_per_attempt: Optional[float] = None,
+        activity_success: Optional[bool] = None,
+        calculated_at: str = "2025-01-01T00:00:00Z",
+        answer_rationale: tuple = ("because",)
+    ) -> AnalyticsMetrics:
+        return AnalyticsMetrics(**{
+            "instance_id": instance_id,
+            "student_id": student_id,
+            "metrics": {
+                "total_attempts": total_attempts,
+                "total_time_seconds": total_time_seconds,
+                "average_time_per_attempt": (
+                    average_time_per_attempt
+                    if average_time_per_attempt is not None
+                    else total_time_seconds / total_attempts
+                ),
+                "number_of_correct_answers": 1,
+                "final_score": final_score,
+                "activity_success": activity_success if activity_success is not None else final_score >= 0.5
+            },
+            "qualitative": {"answer_rationale": list(answer_rationale)},
+            "calculated_at": calculated_at
+        })
+    
+    return build
+
+
+def _without_sort(method):
+    def add(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return add
+
+
+@pytest.fixture
+def mongo_database(monkeypatch):
+    """In-memory Motor database, fresh for each test"""
+    import mongomock_motor
+    from mongomock.collection import BulkOperationBuilder
+    
+    # pymongo 4.11+ passes sort to the bulk builder, which mongomock does not accept
+    for name in ("add_update", "add_replace"):
+        monkeypatch.setattr(BulkOperationBuilder, name, _without_sort(getattr(BulkOperationBuilder, name)))
+    
+    return mongomock_motor.AsyncMongoMockClient()["test"]
+
+
+@pytest.fixture
+def metrics_repository(mongo_database):
+    """Results repository with its own cache, isolated from other tests"""
+    return AnalyticsMetricsRepository(mongo_database, MetricsCache())
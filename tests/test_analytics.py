@@ -82,3 +82,1107 @@ def test_get_student_metrics_success():
     # 2. Test instance created
     # 3. Test submission recorded
     pass
+
+
+def test_rationale_snippets_around_match():
+    """Test snippet extraction for rationale search hits"""
+    from app.repositories.metrics_repository import AnalyticsMetricsRepository
+    
+    rationales = [
+        "The box keeps moving because of inertia, no net force acts on it",
+        "Gravity pulls it down"
+    ]
+    snippets = AnalyticsMetricsRepository._extract_snippets(rationales, "Inertia")
+    
+    assert len(snippets) == 1
+    assert "inertia" in snippets[0]
+    
+    # Stemmed matches without the literal term fall back to the first rationale
+    fallback = AnalyticsMetricsRepository._extract_snippets(["x" * 200], "inertial")
+    assert fallback[0].endswith("...")
+
+
+def test_etag_matching():
+    """Test If-None-Match comparison against a strong ETag"""
+    from app.routers.http_cache import make_etag, etag_matches
+    
+    etag = make_etag("student", "inst_1", "stu_1", "2025-01-01T00:00:00Z")
+    
+    assert etag == make_etag("student", "inst_1", "stu_1", "2025-01-01T00:00:00Z")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(make_etag("student", "inst_1", "stu_2", "x"), etag)
+
+
+def test_content_negotiation():
+    """Test Accept / Accept-Encoding negotiation and columnar encoding"""
+    from app.routers.negotiation import (
+        JSON_MEDIA_TYPE,
+        COLUMNAR_MEDIA_TYPE,
+        select_media_type,
+        select_encoding,
+        to_columnar
+    )
+    
+    assert select_media_type(None) == JSON_MEDIA_TYPE
+    assert select_media_type("text/html;q=0.9, */*;q=0.1") == JSON_MEDIA_TYPE
+    assert select_media_type(f"{COLUMNAR_MEDIA_TYPE}, application/json;q=0.5") == COLUMNAR_MEDIA_TYPE
+    assert select_encoding("gzip;q=0, identity") is None
+    assert select_encoding("gzip") == "gzip"
+    
+    columnar = to_columnar({
+        "count": 2,
+        "students": [
+            {"student_id": "a", "metrics": {"final_score": 1.0}},
+            {"student_id": "b", "metrics": {"final_score": 0.5}}
+        ]
+    })
+    assert columnar["count"] == 2
+    assert columnar["students"] == {"student_id": ["a", "b"], "metrics.final_score": [1.0, 0.5]}
+
+
+def test_structured_log_record():
+    """Test JSON log records carry the request id and structured fields"""
+    import json
+    import logging
+    from app.logging_config import (
+        JsonFormatter,
+        RequestContextFilter,
+        start_request,
+        end_request,
+        record_upstream_call,
+        get_request_context
+    )
+    
+    token = start_request("req-1")
+    try:
+        record_upstream_call("activity_api")
+        record_upstream_call("activity_api")
+        assert get_request_context().upstream_calls == {"activity_api": 2}
+        
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+        record.fields = {"status": 200}
+        RequestContextFilter().filter(record)
+    finally:
+        end_request(token)
+    
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert entry["request_id"] == "req-1"
+    assert entry["status"] == 200
+
+
+def test_server_timing_header():
+    """Test stage timings are aggregated into a Server-Timing header"""
+    from app.logging_config import start_request, end_request
+    from app.request_timing import timed, server_timing_header
+    
+    assert server_timing_header(1.0) is None
+    
+    token = start_request("req-2")
+    try:
+        with timed("cache"):
+            pass
+        with timed("persistence"):
+            pass
+        with timed("persistence"):
+            pass
+        header = server_timing_header(12.5)
+    finally:
+        end_request(token)
+    
+    assert header.startswith("cache;dur=")
+    assert 'persistence;dur=' in header and 'desc="2 calls"' in header
+    assert header.endswith("total;dur=12.50")
+
+
+def test_loadtest_cohort_matches_activity_models():
+    """Test generated load-test data parses with the Activity API models"""
+    from app.models.schemas import Activity, DeploymentInstance, Submission
+    from loadtest.cohort import CohortConfig, build_instance, build_activity, build_submission
+    from loadtest.load_generator import percentile
+    
+    config = CohortConfig(students_per_instance=3, exercises=4)
+    instance = DeploymentInstance(**build_instance("inst_0001", config))
+    activity_data = build_activity(instance.activityId, config)
+    activity = Activity(**activity_data)
+    submission = Submission(**build_submission("inst_0001", "student_00000", activity_data, config))
+    
+    assert len(activity.exercises) == 4
+    assert submission.studentId == "student_00000"
+    assert build_submission("inst_0001", "student_00000", activity_data, config) == \
+        build_submission("inst_0001", "student_00000", activity_data, config)
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
+
+
+@pytest.mark.anyio
+async def test_precompute_scheduler_tracks_active_instances():
+    """Test the precompute scheduler skips expired and idle instances and warms active ones"""
+    import time
+    from app.models.schemas import DeploymentInstance
+    from app.services.precompute_scheduler import PrecomputeScheduler
+    
+    recomputed = []
+    
+    async def recompute(instance_id):
+        recomputed.append(instance_id)
+    
+    scheduler = PrecomputeScheduler(recompute, interval_seconds=60, concurrency=2)
+    scheduler.track(DeploymentInstance(
+        instance_id="active", activity_id="act", created_at="2025-01-01T00:00:00Z",
+        expires_at="2999-01-01T00:00:00Z"
+    ))
+    scheduler.track(DeploymentInstance(
+        instance_id="expired", activity_id="act", created_at="2025-01-01T00:00:00Z",
+        expires_at="2000-01-01T00:00:00Z"
+    ))
+    
+    assert not scheduler.is_warm("active")
+    await scheduler.run_once()
+    
+    assert recomputed == ["active"]
+    assert scheduler.is_warm("active")
+    assert not scheduler.is_warm("expired")
+    
+    # Recomputing an instance does not count as reading it: unread, it goes idle
+    scheduler.idle_seconds = 0.01
+    time.sleep(0.02)
+    await scheduler.run_once()
+    
+    assert recomputed == ["active"]
+    assert scheduler.active_instances() == []
+
+
+@pytest.mark.anyio
+async def test_precompute_claims_instance_once_across_workers(mongo_database):
+    """Test only the worker holding an instance's lease recomputes it"""
+    from app.models.schemas import DeploymentInstance
+    from app.repositories.lease_repository import LeaseRepository
+    from app.services.precompute_scheduler import PrecomputeScheduler
+    
+    leases = LeaseRepository(mongo_database)
+    await leases.ensure_indexes()
+    recomputed = []
+    schedulers = []
+    
+    for worker in ("worker-a", "worker-b"):
+        async def recompute(instance_id, worker=worker):
+            recomputed.append((worker, instance_id))
+        
+        async def claim(instance_id, lease_seconds, worker=worker):
+            return await leases.acquire(f"precompute:{instance_id}", worker, lease_seconds)
+        
+        scheduler = PrecomputeScheduler(recompute, interval_seconds=60, claim=claim)
+        scheduler.track(DeploymentInstance(
+            instance_id="active", activity_id="act", created_at="2025-01-01T00:00:00Z",
+            expires_at="2999-01-01T00:00:00Z"
+        ))
+        schedulers.append(scheduler)
+    
+    for scheduler in schedulers:
+        await scheduler.run_once()
+    assert recomputed == [("worker-a", "active")]
+    
+    # Once released, the next interval may go to another worker
+    await leases.release("precompute:active", "worker-a")
+    await schedulers[1].run_once()
+    assert recomputed[-1] == ("worker-b", "active")
+
+
+def test_build_instance_summary():
+    """Test the per-instance summary used when archiving cold instances"""
+    from app.services.retention_service import build_instance_summary
+    
+    rows = [
+        {"metrics": {"final_score": 0.2, "activity_success": False, "total_attempts": 1, "total_time_seconds": 100}, "calculated_at": "2025-01-02T00:00:00Z"},
+        {"metrics": {"final_score": 0.6, "activity_success": True, "total_attempts": 2, "total_time_seconds": 200}, "calculated_at": "2025-01-01T00:00:00Z"},
+        {"metrics": {"final_score": 1.0, "activity_success": True, "total_attempts": 2, "total_time_seconds": 300}, "calculated_at": "2025-01-03T00:00:00Z"},
+        {"metrics": {"final_score": 0.8, "activity_success": True, "total_attempts": 3, "total_time_seconds": 400}, "calculated_at": "2025-01-04T00:00:00Z"}
+    ]
+    summary = build_instance_summary("inst_1", rows)
+    
+    assert summary.student_count == 4
+    assert summary.pass_rate == 0.75
+    assert summary.median_final_score == 0.7
+    assert summary.average_total_time_seconds == 250
+    assert summary.attempts_histogram == {"1": 1, "2": 2, "3": 1}
+    assert summary.first_calculated_at == "2025-01-01T00:00:00Z"
+    assert build_instance_summary("empty", []).student_count == 0
+
+
+@pytest.mark.anyio
+async def test_archive_keeps_live_and_concurrent_results(make_metrics, mongo_database, metrics_repository):
+    """Test archiving spares instances with live results and results written mid-archive"""
+    from datetime import datetime, timedelta
+    from app.repositories.archive_repository import AnalyticsArchiveRepository
+    from app.repositories.metrics_repository import ANALYTICS_RETENTION_DAYS
+    from app.services.retention_service import RetentionService
+    
+    repository = metrics_repository
+    archive = AnalyticsArchiveRepository(mongo_database)
+    expiring = datetime.utcnow() - timedelta(days=ANALYTICS_RETENTION_DAYS) + timedelta(hours=1)
+    for instance_id in ("cold", "mixed"):
+        await repository.save(make_metrics("a", instance_id), instance_expires_at=expiring)
+    # A second result of "mixed" expires long after the archive lead
+    await repository.save(make_metrics("b", "mixed"))
+    
+    # A result written between the read and the delete
+    save_summary = archive.save
+    
+    async def save_and_race(summary):
+        await save_summary(summary)
+        await repository.save(make_metrics("late", summary.instance_id), instance_expires_at=expiring)
+    
+    archive.save = save_and_race
+    report = await RetentionService(repository, archive).archive_expiring()
+    remaining = {
+        (document["instance_id"], document["student_id"])
+        async for document in repository.collection.find({}, {"_id": 0, "instance_id": 1, "student_id": 1})
+    }
+    archived = await archive.find_by_instance("cold")
+    
+    # A concurrent run finding the instance already archived keeps its summary
+    archive.save = save_summary
+    await repository.delete_by_instance_and_student("cold", "late")
+    rerun = await RetentionService(repository, archive).archive_instance("cold")
+    
+    assert report == {"archived_instances": 1, "deleted_documents": 1}
+    assert remaining == {("cold", "late"), ("mixed", "a"), ("mixed", "b")}
+    assert archived.student_count == 1
+    assert rerun == 0
+    assert (await archive.find_by_instance("cold")).student_count == 1
+
+
+@pytest.mark.anyio
+async def test_regrade_job_recomputes_stale_results(mongo_database, metrics_repository):
+    """Test a regrade job recomputes results after the answer key changes"""
+    from app.models.schemas import Activity, DeploymentInstance, Submission
+    from app.repositories.regrade_job_repository import RegradeJobRepository
+    from app.services.analytics_service import AnalyticsCalculationService
+    from app.services.regrade_service import RegradeService
+    from loadtest.cohort import CohortConfig, build_instance, build_activity, build_submission, student_ids
+    
+    config = CohortConfig(students_per_instance=4, activities=1)
+    original = build_activity("act_000", config)
+    
+    class FakeActivityClient:
+        activity = original
+        lookups = []
+        
+        async def get_instance(self, instance_id):
+            self.lookups.append(instance_id)
+            if instance_id == "inst_gone":
+                return None
+            return DeploymentInstance(**build_instance(instance_id, config))
+        
+        async def get_activity(self, activity_id):
+            return Activity(**self.activity)
+        
+        async def get_instance_submissions(self, instance_id):
+            return [
+                Submission(**build_submission(instance_id, student_id, original, config))
+                for student_id in student_ids(config)
+            ]
+    
+    client = FakeActivityClient()
+    job_repository = RegradeJobRepository(mongo_database)
+    await job_repository.ensure_indexes()
+    analytics_service = AnalyticsCalculationService(client, metrics_repository)
+    await analytics_service.calculate_instance_metrics("inst_0000")
+    await metrics_repository.collection.insert_one({"instance_id": "inst_gone", "student_id": "x"})
+    # Results stored before they recorded their activity
+    await metrics_repository.collection.update_many({}, {"$unset": {"_activity_id": ""}})
+    
+    # Teacher fixes the answer key
+    client.activity = {**original, "exercises": [
+        {**exercise, "correct_options": "Z"} for exercise in original["exercises"]
+    ]}
+    
+    regrade_service = RegradeService(client, metrics_repository, job_repository, analytics_service)
+    client.lookups.clear()
+    job = await regrade_service.create_job("act_000")
+    # The activity of stored results is only resolved by the job run
+    assert client.lookups == []
+    # A second active job of the activity is never stored
+    duplicate = await job_repository.create(job.model_copy(update={"job_id": "other"}))
+    
+    # The first run fails on the instance, which is left pending
+    regrade_instance = analytics_service.regrade_instance
+    
+    async def unavailable(instance_id, activity, activity_hash):
+        raise RuntimeError("Activity API unavailable")
+    
+    analytics_service.regrade_instance = unavailable
+    await regrade_service.run_job(job.job_id)
+    partial = await job_repository.find_by_id(job.job_id)
+    
+    analytics_service.regrade_instance = regrade_instance
+    resumed = await regrade_service.create_job("act_000")
+    await regrade_service.run_job(resumed.job_id)
+    
+    finished = await job_repository.find_by_id(job.job_id)
+    results = await metrics_repository.find_by_instance("inst_0000")
+    with pytest.raises(ValueError):
+        await regrade_service.create_job("act_without_results")
+    
+    # A cancel arriving while the last instance is regraded is kept
+    cancelled = await regrade_service.create_job("act_000")
+    
+    async def cancelled_meanwhile(instance_id, activity, activity_hash):
+        await regrade_service.cancel_job(cancelled.job_id)
+        return await regrade_instance(instance_id, activity, activity_hash)
+    
+    analytics_service.regrade_instance = cancelled_meanwhile
+    await regrade_service.run_job(cancelled.job_id)
+    assert (await job_repository.find_by_id(cancelled.job_id)).status == "cancelled"
+    
+    assert duplicate.job_id == resumed.job_id == finished.job_id
+    assert partial.status == "partial"
+    assert partial.completed_instances == []
+    assert [(failure.instance_id, failure.error) for failure in partial.failed_instances] == [
+        ("inst_0000", "Activity API unavailable")
+    ]
+    assert finished.status == "completed"
+    assert finished.failed_instances == []
+    assert finished.completed_instances == ["inst_0000"]
+    assert finished.students_recomputed == 4
+    assert all(result.metrics.number_of_correct_answers == 0 for result in results)
+    # The unresolved instance was looked up by the first run only
+    assert client.lookups.count("inst_gone") == 1
+
+
+def test_metrics_cache_lru_and_invalidation(make_metrics):
+    """Test the metrics LRU evicts, invalidates by document id and skips racing reads"""
+    from app.repositories.metrics_cache import MetricsCache, get_metrics_cache
+    
+    cache = MetricsCache(max_size=2, ttl_seconds=60)
+    cache.put(make_metrics("a"), "id_a")
+    cache.put(make_metrics("b"), "id_b")
+    assert cache.get("inst_1", "a") is not None
+    
+    # "b" is now least recently used
+    cache.put(make_metrics("c"), "id_c")
+    assert cache.get("inst_1", "b") is None
+    
+    # Change stream event from another worker
+    cache.invalidate_document("id_a")
+    assert cache.get("inst_1", "a") is None
+    
+    # A read that started before a write must not repopulate the cache
+    generation = cache.generation
+    cache.invalidate("inst_1", "d")
+    cache.put(make_metrics("d"), "id_d", generation)
+    assert cache.get("inst_1", "d") is None
+    
+    # ... but writes to other students do not keep a read out of the cache
+    generation = cache.generation
+    cache.invalidate("inst_1", "a")
+    cache.invalidate_document("id_elsewhere")
+    cache.put(make_metrics("d"), "id_d", generation)
+    assert cache.get("inst_1", "d") is not None
+    
+    cache.invalidate_instance("inst_1")
+    assert cache.stats()["size"] == 0
+    
+    # Each database has its own cache
+    if get_metrics_cache("db_a") is not None:
+        assert get_metrics_cache("db_a") is get_metrics_cache("db_a")
+        assert get_metrics_cache("db_a") is not get_metrics_cache("db_b")
+
+
+@pytest.mark.anyio
+async def test_admission_control_sheds_excess_recomputes(monkeypatch):
+    """Test recompute budgets shed with 503 while reads are still admitted"""
+    import asyncio
+    import ipaddress
+    from fastapi import HTTPException, Request
+    from app.routers import admission
+    from app.routers.admission import (
+        READ,
+        INSTANCE_RECOMPUTE,
+        AdmissionBudget,
+        AdmissionController,
+        TokenBucket
+    )
+    
+    controller = AdmissionController({
+        READ: AdmissionBudget(READ, concurrency=4, queue_size=4, queue_timeout_seconds=1),
+        INSTANCE_RECOMPUTE: AdmissionBudget(INSTANCE_RECOMPUTE, concurrency=1, queue_size=1, queue_timeout_seconds=0.05)
+    })
+    release = asyncio.Event()
+    
+    async def recompute():
+        async with controller.admit(INSTANCE_RECOMPUTE, "client"):
+            await release.wait()
+    
+    running = asyncio.create_task(recompute())
+    queued = asyncio.create_task(recompute())
+    await asyncio.sleep(0.01)
+    
+    # Queue is full: rejected immediately
+    with pytest.raises(HTTPException) as shed:
+        async with controller.admit(INSTANCE_RECOMPUTE, "client"):
+            pass
+    
+    # Reads use their own budget
+    async with controller.admit(READ, "client"):
+        pass
+    
+    # The queued request misses its deadline
+    with pytest.raises(HTTPException):
+        await queued
+    
+    release.set()
+    await running
+    stats = controller.stats()
+    
+    assert shed.value.status_code == 503
+    assert int(shed.value.headers["Retry-After"]) >= 1
+    assert stats[INSTANCE_RECOMPUTE]["shed"] == 2
+    assert stats[INSTANCE_RECOMPUTE]["active"] == 0
+    
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.take("a") is None
+    assert bucket.take("a") is None
+    assert bucket.take("a") == 1
+    assert bucket.take("b") is None
+    
+    def request(peer):
+        return Request({"type": "http", "headers": [(b"x-client-id", b"spoofed")], "client": (peer, 1234)})
+    
+    monkeypatch.setattr(admission, "ADMISSION_TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    assert admission.get_client_id(request("203.0.113.7")) == "203.0.113.7"
+    assert admission.get_client_id(request("10.1.2.3")) == "spoofed"
+
+
+@pytest.mark.anyio
+async def test_activity_rollups_follow_replaced_results(make_metrics, metrics_repository):
+    """Test rollups swap a student's contribution when the result is recomputed"""
+    from app.services.rollup_service import RollupReconciliationService, merge_rollups, bucket_rollups
+    
+    repository = metrics_repository
+    
+    def result(instance_id, student_id, score, calculated_at):
+        return make_metrics(student_id, instance_id, score, total_attempts=2, total_time_seconds=60, calculated_at=calculated_at)
+    
+    await repository.save(result("inst.1", "a", 0.2, "2025-03-03T10:00:00Z"), activity_id="act")
+    await repository.save(result("inst_2", "b", 1.0, "2025-03-03T11:00:00Z"), activity_id="act")
+    # Student a is regraded the following week
+    await repository.save(result("inst.1", "a", 0.8, "2025-03-10T09:00:00Z"), activity_id="act")
+    documents = await repository.rollups.find_by_activity("act")
+    
+    # An update lost between a result write and its rollup $inc
+    await repository.rollups.collection.update_one(
+        {"activity_id": "act", "bucket": "2025-03-03"},
+        {"$inc": {"result_count": 5, "version": 1}}
+    )
+    reconciliation = RollupReconciliationService(repository, repository.rollups)
+    counts = await reconciliation.reconcile_activity("act", "2025-03-01")
+    stale = await repository.rollups.replace_bucket("act", "2025-03-10", [], version=0)
+    reconciled = await repository.rollups.find_by_activity("act")
+    summary = merge_rollups("act", documents)
+    
+    assert summary.result_count == 2
+    assert summary.instance_count == 2
+    assert summary.pass_rate == 1.0
+    assert summary.mean_final_score == pytest.approx(0.9)
+    assert summary.attempts_histogram == {"2": 2}
+    
+    weeks = bucket_rollups("act", documents, "week")
+    assert [(week.bucket_start, week.result_count) for week in weeks] == [("2025-03-03", 1), ("2025-03-10", 1)]
+    
+    # inst.1 (ids may hold characters field names cannot) left the first day with its only result
+    assert documents[0]["instance_ids"] == ["inst_2"]
+    
+    assert counts == {"buckets": 2, "conflicts": 0}
+    assert not stale
+    assert [(document["bucket"], document["result_count"]) for document in reconciled] == [
+        ("2025-03-03", 1), ("2025-03-10", 1)
+    ]
+
+
+def test_item_analysis():
+    """Test difficulty, discrimination and option counts of the item analysis"""
+    from app.models.schemas import Activity, Submission
+    from app.services.item_analysis import compute_item_analysis
+    
+    activity = Activity(**{
+        "activity_id": "act_1",
+        "created_at": "2025-01-01T00:00:00Z",
+        "title": "Kinematics",
+        "grade": 10,
+        "modules": "mechanics",
+        "number_of_exercises": 2,
+        "total_time_minutes": 30,
+        "number_of_retries": 1,
+        "exercises": [
+            {"question": "Q1", "options": ["A", "B", "C"], "correct_options": "A", "correct_answer": "a"},
+            {"question": "Q2", "options": ["A", "B", "C"], "correct_options": "B", "correct_answer": "b"}
+        ]
+    })
+    
+    def submission(student_id, q0, q1, rationale=""):
+        return Submission(**{
+            "submission_id": f"sub_{student_id}",
+            "instance_id": "inst_1",
+            "student_id": student_id,
+            "number_of_attempts": 1,
+            "attempts": [{
+                "attemptIndex": 0,
+                "answers": {
+                    "q0": {"selectedOption": q0, "rationale": rationale},
+                    "q1": {"selectedOption": q1, "rationale": ""}
+                },
+                "result": 0.0,
+                "submittedAt": "2025-01-01T10:00:00Z"
+            }],
+            "created_at": "2025-01-01T10:00:00Z"
+        })
+    
+    analysis = compute_item_analysis("inst_1", activity, [
+        submission("s1", "A", "B", "because"),
+        submission("s2", "A", "B"),
+        submission("s3", "A", "C", "guess"),
+        submission("s4", "C", "C")
+    ])
+    
+    first, second = analysis.items
+    assert analysis.student_count == 4
+    assert analysis.group_size == 1
+    assert first.difficulty == 0.75
+    assert first.option_distribution == {"A": 3, "B": 0, "C": 1}
+    assert first.rationale_count == 2
+    assert first.discrimination == 1.0
+    assert second.difficulty == 0.5
+    assert second.discrimination == 1.0
+
+
+@pytest.mark.anyio
+async def test_item_analysis_skips_unchanged_writes(mongo_database):
+    """Test an unchanged item analysis is not rewritten when no result was written"""
+    from app.models.schemas import InstanceItemAnalysis
+    from app.repositories.item_analysis_repository import ItemAnalysisRepository
+    
+    repository = ItemAnalysisRepository(mongo_database)
+    
+    def analysis(student_count, calculated_at):
+        return InstanceItemAnalysis(
+            instance_id="inst_1", activity_id="act_1", student_count=student_count,
+            group_size=0, items=[], calculated_at=calculated_at
+        )
+    
+    await repository.save(analysis(2, "2025-01-01T00:00:00Z"))
+    stored = await repository.collection.find_one({"instance_id": "inst_1"})
+    await repository.save(analysis(2, "2025-01-02T00:00:00Z"), only_if_changed=True)
+    unchanged = await repository.collection.find_one({"instance_id": "inst_1"})
+    await repository.save(analysis(3, "2025-01-03T00:00:00Z"), only_if_changed=True)
+    changed = await repository.collection.find_one({"instance_id": "inst_1"})
+    
+    assert unchanged["_calculated_at"] == stored["_calculated_at"]
+    assert unchanged["calculated_at"] == "2025-01-01T00:00:00Z"
+    assert changed["student_count"] == 3
+    assert changed["calculated_at"] == "2025-01-03T00:00:00Z"
+
+
+@pytest.mark.anyio
+async def test_change_stream_looks_up_documents_only_for_subscribers():
+    """Test updated documents are only looked up while the worker has feed subscribers"""
+    import asyncio
+    from app.repositories import metrics_cache
+    
+    subscribed = False
+    opened = []
+    published = []
+    
+    class FakeStream:
+        def __init__(self, options):
+            self.options = options
+            self.resume_token = {"token": len(opened)}
+        
+        async def __aenter__(self):
+            return self
+        
+        async def __aexit__(self, *args):
+            return False
+        
+        async def try_next(self):
+            nonlocal subscribed
+            await asyncio.sleep(0)
+            if len(opened) == 1:
+                # A client subscribes while the stream is idle
+                subscribed = True
+                return None
+            return {
+                "operationType": "update",
+                "documentKey": {"_id": "id_1"},
+                "updateDescription": {"updatedFields": {"metrics": {}}},
+                "fullDocument": {"instance_id": "inst_1", "_writer": "other"}
+                if "full_document" in self.options else None
+            }
+    
+    class FakeCollection:
+        def watch(self, pipeline, **options):
+            opened.append(options)
+            return FakeStream(options)
+    
+    task = asyncio.create_task(metrics_cache._watch_changes(
+        FakeCollection(), None, published.append, lambda: subscribed
+    ))
+    while not published:
+        await asyncio.sleep(0)
+    task.cancel()
+    
+    assert "full_document" not in opened[0]
+    assert opened[1]["full_document"] == "updateLookup"
+    # Reopened where the first stream stopped
+    assert opened[1]["resume_after"] == {"token": 1}
+    assert published[0]["instance_id"] == "inst_1"
+
+
+@pytest.mark.anyio
+async def test_metrics_event_stream(make_metrics):
+    """Test the live feed replays missed results, skips duplicates and sends heartbeats"""
+    from app.services.metrics_events import MetricsEventBroker, stream_events
+    
+    broker = MetricsEventBroker(queue_size=10)
+    subscription = broker.subscribe("inst_1")
+    
+    # Saved while the backlog was being read: already replayed, so skipped live
+    broker.publish(make_metrics("a", calculated_at="2025-01-01T00:00:01Z"), 2)
+    broker.publish(make_metrics("b", calculated_at="2025-01-01T00:00:01Z"), 3)
+    broker.publish(make_metrics("other", "inst_2", calculated_at="2025-01-01T00:00:03Z"), 1)
+    # Committed late by another worker, with a lower sequence than the backlog
+    broker.publish(make_metrics("c", calculated_at="2025-01-01T00:00:00Z"), 1)
+    
+    replayed = [(make_metrics("a", calculated_at="2025-01-01T00:00:01Z"), 2)]
+    stream = stream_events(broker, subscription, replayed, heartbeat_seconds=0.01)
+    chunks = [await stream.__anext__() for _ in range(5)]
+    await stream.aclose()
+    
+    assert chunks[0].startswith("retry:")
+    assert chunks[1].startswith("id: 2\nevent: metrics\n")
+    # Same calculated_at as the replayed event, but a distinct id
+    assert chunks[2].startswith("id: 3\n")
+    assert '"student_id":"b"' in chunks[2]
+    assert chunks[3].startswith("id: 1\n")
+    assert chunks[4] == ": heartbeat\n\n"
+    assert broker.subscriber_count == 0
+
+
+def test_submission_list_validates_raw_bytes():
+    """Test Activity API submission bodies are validated from bytes with their aliases"""
+    import json
+    from app.models.schemas import SubmissionList
+    from loadtest.cohort import CohortConfig, build_activity, build_submission
+    
+    config = CohortConfig(students_per_instance=1, exercises=3)
+    raw = build_submission("inst_1", "student_1", build_activity("act_1", config), config)
+    body = json.dumps({"count": 1, "submissions": [raw]}).encode("utf-8")
+    
+    submissions = SubmissionList.model_validate_json(body).submissions
+    
+    assert len(submissions) == 1
+    assert submissions[0].studentId == "student_1"
+    assert submissions[0].submissionId == raw["submission_id"]
+    assert len(submissions[0].attempts) == len(raw["attempts"])
+    assert not hasattr(submissions[0], "createdAt")
+    assert SubmissionList.model_validate_json(b"{}").submissions == []
+
+
+@pytest.mark.anyio
+async def test_mirrored_activity_client_reads_through_mirror(mongo_database):
+    """Test mirror copies are served while fresh, final after expiry and used alone offline"""
+    import asyncio
+    from datetime import datetime, timedelta
+    import httpx
+    from app.clients.mirrored_activity_client import MirroredActivityClient
+    from app.models.schemas import DeploymentInstance, Submission
+    from app.repositories.mirror_repository import ActivityMirrorRepository
+    
+    expired = (datetime.utcnow() - timedelta(days=1)).isoformat() + "Z"
+    
+    class FakeActivityClient:
+        def __init__(self):
+            self.calls = 0
+            self.down = False
+        
+        async def get_instance(self, instance_id):
+            self.calls += 1
+            return DeploymentInstance(instance_id=instance_id, activity_id="act_1", created_at=expired, expires_at=expired)
+        
+        async def get_instance_submissions(self, instance_id):
+            self.calls += 1
+            if self.down:
+                raise httpx.ConnectError("down")
+            return [Submission(submission_id="s1", instance_id=instance_id, student_id="student_1", attempts=[])]
+    
+    mirror = ActivityMirrorRepository(mongo_database)
+    await mirror.ensure_indexes()
+    upstream = FakeActivityClient()
+    client = MirroredActivityClient(upstream, mirror, config_max_age_seconds=600, submissions_max_age_seconds=0)
+    
+    await client.get_instance("inst_1")
+    first = await client.get_instance_submissions("inst_1")
+    # Fetched after the instance expired: final, served without calling upstream
+    second = await client.get_instance_submissions("inst_1")
+    calls_after_expiry = upstream.calls
+    
+    # Not final: stale copies are refetched, and served when upstream fails
+    await mongo_database["mirrorInstances"].update_one({"instance_id": "inst_2"}, {"$set": {"x": 1}}, upsert=True)
+    # Mirrored earlier, then removed upstream: dropped by the next full fetch
+    await mirror.save_submission(Submission(submission_id="s0", instance_id="inst_2", student_id="removed", attempts=[]))
+    await asyncio.sleep(0.01)
+    await client.get_instance_submissions("inst_2")
+    upstream.down = True
+    fallback = await client.get_instance_submissions("inst_2")
+    
+    offline = MirroredActivityClient(upstream, mirror, offline=True)
+    calls = upstream.calls
+    submission = await offline.get_submission("inst_1", "student_1")
+    missing = await offline.get_instance_submissions("inst_3")
+    offline_calls = upstream.calls - calls
+    
+    assert [s.studentId for s in first] == [s.studentId for s in second] == ["student_1"]
+    assert calls_after_expiry == 2
+    assert [s.studentId for s in fallback] == ["student_1"]
+    assert submission.submissionId == "s1"
+    assert missing == []
+    assert offline_calls == 0
+
+
+@pytest.mark.anyio
+async def test_mirror_rewrites_only_changed_submissions(mongo_database):
+    """Test a full submission fetch only writes changed rows and every row expires"""
+    from app.models.schemas import Submission
+    from app.repositories.mirror_repository import MIRROR_TTL_INDEX, ActivityMirrorRepository
+    
+    mirror = ActivityMirrorRepository(mongo_database)
+    await mirror.ensure_indexes()
+    
+    def submission(student_id, submission_id="s1"):
+        return Submission(submission_id=submission_id, instance_id="inst_1", student_id=student_id, attempts=[])
+    
+    await mirror.save_instance_submissions("inst_1", [submission("a"), submission("b"), submission("c")])
+    before = {document["student_id"]: document async for document in mirror.submissions.find({})}
+    await mirror.save_instance_submissions("inst_1", [submission("a"), submission("b", "s2")])
+    after = {document["student_id"]: document async for document in mirror.submissions.find({})}
+    submissions, fetched_at = await mirror.find_instance_submissions("inst_1")
+    
+    assert sorted(after) == ["a", "b"]
+    assert after["a"]["_fetched_at"] == before["a"]["_fetched_at"]
+    assert after["b"]["_fetched_at"] > before["b"]["_fetched_at"]
+    assert fetched_at > before["a"]["_fetched_at"]
+    assert {s.submissionId for s in submissions} == {"s1", "s2"}
+    assert all("_expires_at" in document for document in after.values())
+    assert MIRROR_TTL_INDEX in await mirror.submissions.index_information()
+
+
+@pytest.mark.anyio
+async def test_save_changed_skips_unchanged_results(make_metrics, metrics_repository):
+    """Test recalculated results identical to the stored ones are not rewritten"""
+    from datetime import datetime, timedelta
+    from app.repositories.metrics_repository import ANALYTICS_RETENTION_DAYS
+    
+    repository = metrics_repository
+    await repository.save_changed(
+        [make_metrics("a", final_score=1.0), make_metrics("b", final_score=0.0)],
+        activity_id="act_1",
+        activity_hash="h1"
+    )
+    # Stored long ago: recalculating it unchanged still pushes its expiry forward
+    aged = datetime.utcnow() + timedelta(days=1)
+    await repository.collection.update_one({"student_id": "a"}, {"$set": {"_expires_at": aged}})
+    
+    recalculated = [
+        make_metrics("a", final_score=1.0, calculated_at="2025-01-02T00:00:00Z"),
+        make_metrics("b", final_score=1.0, calculated_at="2025-01-02T00:00:00Z")
+    ]
+    stored, written = await repository.save_changed(recalculated, activity_id="act_1", activity_hash="h1")
+    stored_a = await repository.collection.find_one({"student_id": "a"})
+    regraded, rewritten = await repository.save_changed(recalculated, activity_id="act_1", activity_hash="h2")
+    document = await repository.find_by_instance_and_student("inst_1", "a")
+    
+    assert [metrics.student_id for metrics, _ in written] == ["b"]
+    assert stored[0].calculated_at == "2025-01-01T00:00:00Z"
+    assert stored[1].calculated_at == "2025-01-02T00:00:00Z"
+    assert stored_a["calculated_at"] == "2025-01-01T00:00:00Z"
+    assert stored_a["_expires_at"] > datetime.utcnow() + timedelta(days=ANALYTICS_RETENTION_DAYS - 1)
+    assert len(rewritten) == 2
+    assert document.calculated_at == "2025-01-02T00:00:00Z"
+
+
+@pytest.mark.anyio
+async def test_save_changed_batches_writes(make_metrics, metrics_repository):
+    """Test changed results are written in a fixed number of round trips and raced ones saved again"""
+    from app.logging_config import start_request, end_request, get_request_context
+    
+    repository = metrics_repository
+    await repository.save_changed([make_metrics("a", final_score=0.0)], activity_id="act_1")
+    
+    # Another save rewrites "a" after it was read
+    next_sequence = repository._next_sequence
+    
+    async def racing(instance_id, count=1):
+        repository._next_sequence = next_sequence
+        await repository.save(make_metrics("a", final_score=0.5), activity_id="act_1")
+        return await next_sequence(instance_id, count)
+    
+    repository._next_sequence = racing
+    _, raced = await repository.save_changed([make_metrics("a", final_score=1.0)], activity_id="act_1")
+    
+    token = start_request("req-batch")
+    try:
+        _, written = await repository.save_changed(
+            [make_metrics(student_id, final_score=0.5) for student_id in ("a", "b", "c", "d", "e")],
+            activity_id="act_1"
+        )
+        round_trips = get_request_context().upstream_calls["mongodb"]
+    finally:
+        end_request(token)
+    summary = await repository.summaries.find_by_instance("inst_1")
+    rollups = await repository.rollups.find_by_activity("act_1")
+    
+    assert [sequence for _, sequence in raced] == [4]
+    # Read, sequences, results, then rollups and summary
+    assert round_trips == 5
+    assert [sequence for _, sequence in written] == [5, 6, 7, 8, 9]
+    assert summary["student_count"] == 5
+    assert summary["final_score_sum"] == pytest.approx(2.5)
+    assert sum(rollup["result_count"] for rollup in rollups) == 5
+
+
+@pytest.mark.anyio
+async def test_save_changed_resaves_concurrently_inserted_students(make_metrics, metrics_repository):
+    """Test a new student inserted meanwhile by another recalculation is updated, not duplicated"""
+    repository = metrics_repository
+    await repository.ensure_indexes()
+    
+    # Another recalculation inserts "a" after this one read no stored result
+    next_sequence = repository._next_sequence
+    
+    async def racing(instance_id, count=1):
+        repository._next_sequence = next_sequence
+        await repository.save(make_metrics("a", final_score=0.5))
+        return await next_sequence(instance_id, count)
+    
+    repository._next_sequence = racing
+    _, written = await repository.save_changed([make_metrics("a", final_score=1.0), make_metrics("b")])
+    documents = await repository.collection.find({"instance_id": "inst_1"}).to_list(None)
+    summary = await repository.summaries.find_by_instance("inst_1")
+    
+    assert sorted(document["student_id"] for document in documents) == ["a", "b"]
+    assert {metrics.student_id for metrics, _ in written} == {"a", "b"}
+    assert next(document for document in documents if document["student_id"] == "a")["metrics"]["final_score"] == 1.0
+    assert summary["student_count"] == 2
+
+
+@pytest.mark.anyio
+async def test_instance_version_follows_saves_and_deletes(make_metrics, metrics_repository):
+    """Test the instance version used for the instance ETag changes with saves and deletes"""
+    from app.repositories.metrics_repository import INSTANCE_CALCULATED_INDEX
+    
+    repository = metrics_repository
+    await repository.ensure_indexes()
+    assert await repository.get_instance_version("inst_1") is None
+    
+    await repository.save(make_metrics("a"))
+    await repository.save(make_metrics("b"))
+    saved = await repository.get_instance_version("inst_1")
+    await repository.save(make_metrics("a", final_score=0.5))
+    resaved = await repository.get_instance_version("inst_1")
+    await repository.delete_by_instance_and_student("inst_1", "b")
+    deleted = await repository.get_instance_version("inst_1")
+    
+    assert saved[0] == 2
+    assert resaved[0] == 2 and resaved[1] >= saved[1]
+    assert deleted[0] == 1
+    assert INSTANCE_CALCULATED_INDEX in await repository.collection.index_information()
+
+
+@pytest.mark.anyio
+async def test_find_by_student_pages_across_instances(make_metrics, metrics_repository):
+    """Test a student's results are listed across instances by calculation time"""
+    from app.models.schemas import QuantitativeMetrics
+    from app.repositories.metrics_repository import QUANTITATIVE_FIELDS, STUDENT_INDEX
+    
+    repository = metrics_repository
+    await repository.ensure_indexes()
+    for index, instance_id in enumerate(["inst_1", "inst_2", "inst_3"]):
+        await repository.save(make_metrics("student_1", instance_id, calculated_at=f"2025-01-0{index + 1}T00:00:00Z"))
+    await repository.save(make_metrics("student_2", "inst_1", calculated_at="2025-01-09T00:00:00Z"))
+    
+    total, newest = await repository.find_by_student("student_1", skip=0, limit=2, quantitative_only=True)
+    _, oldest = await repository.find_by_student("student_1", skip=2, limit=2, ascending=True)
+    
+    assert total == 3
+    assert [document["instance_id"] for document in newest] == ["inst_3", "inst_2"]
+    assert "qualitative" not in newest[0]
+    assert newest[0]["metrics"]["final_score"] == 1.0
+    # Every quantitative field is in the student index, so the page is covered by it
+    assert set(QUANTITATIVE_FIELDS) == set(QuantitativeMetrics.model_fields) == set(newest[0]["metrics"])
+    index_keys = (await repository.collection.index_information())[STUDENT_INDEX]["key"]
+    assert {f"metrics.{field}" for field in QUANTITATIVE_FIELDS} <= {field for field, _ in index_keys}
+    assert [document["instance_id"] for document in oldest] == ["inst_3"]
+    assert oldest[0]["qualitative"]["answer_rationale"] == ["because"]
+
+
+@pytest.mark.anyio
+async def test_search_rationales_filters_and_ranks(metrics_repository):
+    """Test the rationale search query, its ordering, paging and a missing text index"""
+    from pymongo.errors import OperationFailure
+    
+    # mongomock does not implement $text, so the collection records the query
+    # and returns the hits the server would rank
+    calls = {}
+    
+    class FakeCursor:
+        def __init__(self, documents):
+            self.documents = documents
+        
+        def sort(self, keys):
+            calls["sort"] = keys
+            return self
+        
+        def skip(self, count):
+            calls["skip"] = count
+            return self
+        
+        def limit(self, count):
+            calls["limit"] = count
+            return self
+        
+        def __aiter__(self):
+            return self._iterate()
+        
+        async def _iterate(self):
+            for document in self.documents:
+                yield document
+    
+    class FakeCollection:
+        def __init__(self, index_exists=True):
+            self.index_exists = index_exists
+        
+        async def count_documents(self, filter_query):
+            if not self.index_exists:
+                raise OperationFailure("text index required for $text query", code=27)
+            calls["count"] = filter_query
+            return 3
+        
+        def find(self, filter_query, projection):
+            calls["find"] = filter_query
+            calls["projection"] = projection
+            return FakeCursor([
+                {"instance_id": "inst_1", "student_id": "student_2", "score": 1.5,
+                 "qualitative": {"answer_rationale": ["Inertia keeps it moving"]}},
+                {"instance_id": "inst_1", "student_id": "student_1", "score": 0.75,
+                 "qualitative": {"answer_rationale": ["no force acts on it"]}}
+            ])
+    
+    repository = metrics_repository
+    repository.collection = FakeCollection()
+    total, hits = await repository.search_rationales("inertia", "inst_1", skip=2, limit=2)
+    
+    assert total == 3
+    assert calls["count"] == calls["find"] == {"$text": {"$search": "inertia"}, "instance_id": "inst_1"}
+    assert calls["projection"]["score"] == {"$meta": "textScore"}
+    assert calls["sort"] == [("score", {"$meta": "textScore"})]
+    assert (calls["skip"], calls["limit"]) == (2, 2)
+    # Hits keep the server's text score order
+    assert [(hit.student_id, hit.score) for hit in hits] == [("student_2", 1.5), ("student_1", 0.75)]
+    assert "Inertia" in hits[0].snippets[0]
+    assert hits[1].snippets == ["no force acts on it"]
+    
+    await repository.search_rationales("inertia")
+    assert calls["find"] == {"$text": {"$search": "inertia"}}
+    
+    repository.collection = FakeCollection(index_exists=False)
+    with pytest.raises(ValueError, match="answer_rationale_text"):
+        await repository.search_rationales("inertia")
+
+
+@pytest.mark.anyio
+async def test_cohort_ranks_follow_saves(make_metrics, metrics_repository, mongo_database):
+    """Test cohort position and percentile rank follow saves through the summary histogram"""
+    from app.repositories.summary_repository import InstanceSummaryRepository
+    from app.services.summary_service import InstanceSummaryService
+    
+    repository = metrics_repository
+    service = InstanceSummaryService(repository, InstanceSummaryRepository(mongo_database))
+    for student_id, score in [("a", 0.2), ("b", 0.5), ("c", 0.5), ("d", 0.9)]:
+        await repository.save(make_metrics(student_id, final_score=score))
+    
+    before, before_version = await service.get_cohort_rank("inst_1", 0.5)
+    await repository.save(make_metrics("a", final_score=1.0))
+    await repository.delete_by_instance_and_student("inst_1", "d")
+    after, after_version = await service.get_cohort_rank("inst_1", 0.5)
+    top, _ = await service.get_cohort_rank("inst_1", 1.0)
+    # A result not yet counted in the summary is ranked as if it were
+    uncounted, _ = await service.get_cohort_rank("inst_1", 0.7)
+    empty, _ = await service.get_cohort_rank("inst_2", 0.5)
+    
+    assert (before.position, before.cohort_size, before.percentile_rank) == (2, 4, 50.0)
+    assert (after.position, after.cohort_size, after.percentile_rank) == (2, 3, 33.3)
+    assert (top.position, top.percentile_rank) == (1, 83.3)
+    assert (uncounted.position, uncounted.cohort_size) == (2, 4)
+    assert empty is None
+    # Other students' changes move the version the student ETag is built from
+    assert after_version != before_version
+    # Ranking never rebuilds the summary from the results on the request path
+    assert "reconciled_at" not in await repository.summaries.find_by_instance("inst_1")
+
+
+@pytest.mark.anyio
+async def test_instance_summary_is_maintained_incrementally(make_metrics, mongo_database, metrics_repository):
+    """Test the materialized summary matches one built from the results and reconciles drift"""
+    from app.repositories.summary_repository import InstanceSummaryRepository
+    from app.services.retention_service import build_instance_summary
+    from app.services.summary_service import InstanceSummaryService, summary_from_counters
+    
+    repository = metrics_repository
+    summaries = InstanceSummaryRepository(mongo_database)
+    service = InstanceSummaryService(repository, summaries)
+    
+    def result(student_id, final_score, total_attempts, calculated_at):
+        return make_metrics(
+            student_id,
+            final_score=final_score,
+            total_attempts=total_attempts,
+            total_time_seconds=60 * total_attempts,
+            calculated_at=calculated_at
+        )
+    
+    await repository.save(result("a", 0.3, 1, "2025-01-01T00:00:00Z"))
+    await repository.save(result("b", 0.7, 2, "2025-01-01T00:00:00Z"))
+    await repository.save(result("c", 0.9, 2, "2025-01-02T00:00:00Z"))
+    await repository.save(result("a", 0.6, 3, "2025-01-03T00:00:00Z"))
+    await repository.delete_by_instance_and_student("inst_1", "c")
+    
+    incremental = summary_from_counters(await summaries.find_by_instance("inst_1"))
+    expected = build_instance_summary("inst_1", await repository.find_quantitative_by_instance("inst_1"))
+    
+    # Drift, e.g. a result removed by the TTL monitor
+    await repository.collection.delete_one({"student_id": "b"})
+    drifted = summary_from_counters(await summaries.find_by_instance("inst_1"))
+    report = await service.reconcile_all()
+    
+    # A rewrite based on a version an $inc has since moved is refused
+    version = (await summaries.find_by_instance("inst_1"))["version"]
+    await repository.save(result("d", 1.0, 1, "2025-01-04T00:00:00Z"))
+    stale = await summaries.replace("inst_1", await repository.find_quantitative_by_instance("inst_1"), version)
+    await repository.delete_by_instance_and_student("inst_1", "d")
+    reconciled = await service.get_summary("inst_1")
+    
+    assert incremental.student_count == expected.student_count == 2
+    assert incremental.pass_count == 2
+    assert incremental.median_final_score == pytest.approx(expected.median_final_score)
+    assert incremental.mean_final_score == pytest.approx(expected.mean_final_score)
+    assert incremental.average_total_time_seconds == pytest.approx(expected.average_total_time_seconds)
+    assert incremental.attempts_histogram == expected.attempts_histogram == {"2": 1, "3": 1}
+    assert incremental.last_calculated_at == "2025-01-03T00:00:00Z"
+    assert drifted.student_count == 2
+    assert report == {"instances": 1, "corrected": 1}
+    assert not stale
+    assert reconciled.student_count == 1
+    assert reconciled.median_final_score == pytest.approx(0.6)